@@ -0,0 +1,11 @@
+# benchmarks/__init__.py
+"""离线基准与压测工具
+
+- bench_decode：图片解码路径微基准
+- bench_prefix：请求布局的前缀缓存收益基准
+- bench_transport：图片传输方式（重编码 / 直通 / 文件 / 地址）的请求体大小与端到端延迟
+- stub_server：OpenAI 兼容的模型桩服务（可配置延迟分布、错误率、回答内容）
+- loadgen：开环 / 闭环压测，覆盖异步提交、同步分析、结果查询接口
+- report：结果报表与基线对比
+- run_suite：一键启动桩服务和推理服务，按多个并发档位压测并输出报告
+"""
@@ -0,0 +1,88 @@
+# benchmarks/bench_decode.py
+"""compress_image 解码路径微基准：DCT 缩放快速路径 vs 完整解码路径
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.bench_decode [图片路径 ...] [--repeat 5]
+
+不传图片时生成一张 4000×3000 的随机纹理 JPEG 作为样例。
+每种路径在独立子进程中运行，以便分别统计峰值 RSS（ru_maxrss）。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import resource
+import multiprocessing
+from statistics import mean, median
+
+from PIL import Image
+
+from model.model import compress_image_timed
+
+
+def make_sample_image(path: str, size=(4000, 3000)) -> str:
+    """生成随机纹理样例图（近似无人机原图的解码开销）"""
+    noise = Image.frombytes("L", (size[0] // 8, size[1] // 8), os.urandom(size[0] * size[1] // 64))
+    img = Image.merge("RGB", [noise, noise.rotate(90, expand=False), noise.transpose(Image.FLIP_LEFT_RIGHT)])
+    img = img.resize(size, Image.BILINEAR)
+    img.save(path, format="JPEG", quality=92)
+    return path
+
+
+def _run_mode(draft_decode: bool, images, repeat: int, queue) -> None:
+    """子进程：对每张图片重复压缩，回传耗时与峰值RSS"""
+    totals, decodes = [], []
+    for _ in range(repeat):
+        for image_path in images:
+            t0 = time.perf_counter()
+            _, timings = compress_image_timed(image_path, draft_decode=draft_decode)
+            totals.append(time.perf_counter() - t0)
+            decodes.append(timings["decode"])
+    # Linux 下 ru_maxrss 单位为 KB
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put({"totals": totals, "decodes": decodes, "peak_rss_mb": peak_rss_mb})
+
+
+def run_benchmark(images, repeat: int = 5):
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for name, draft_decode in (("full_decode", False), ("draft_decode", True)):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_mode, args=(draft_decode, images, repeat, queue))
+        proc.start()
+        results[name] = queue.get()
+        proc.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compress_image 解码路径微基准")
+    parser.add_argument("images", nargs="*", help="样例图片路径（默认自动生成）")
+    parser.add_argument("--repeat", type=int, default=5, help="每张图片重复次数")
+    args = parser.parse_args()
+
+    images = args.images
+    tmp_dir = None
+    if not images:
+        tmp_dir = tempfile.TemporaryDirectory()
+        images = [make_sample_image(os.path.join(tmp_dir.name, "sample_4000x3000.jpg"))]
+
+    results = run_benchmark(images, args.repeat)
+
+    print(f"样例图片: {len(images)} 张，每张重复 {args.repeat} 次")
+    print(f"{'路径':<14}{'解码中位数(ms)':>16}{'总耗时中位数(ms)':>18}{'总耗时均值(ms)':>16}{'峰值RSS(MB)':>14}")
+    for name, r in results.items():
+        print(f"{name:<14}{median(r['decodes']) * 1000:>16.1f}{median(r['totals']) * 1000:>18.1f}"
+              f"{mean(r['totals']) * 1000:>16.1f}{r['peak_rss_mb']:>14.1f}")
+
+    base, fast = results["full_decode"], results["draft_decode"]
+    print(f"快速路径总耗时加速比: {median(base['totals']) / median(fast['totals']):.2f}x")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# benchmarks/bench_prefix.py
+"""多识别类型任务的前缀缓存收益基准：text_first（问题 → 图片）vs image_first（系统前导 → 图片 → 问题）
+
+用法（在仓库根目录执行，模型服务需开启前缀缓存，如 vLLM --enable-prefix-caching）：
+    python -m benchmarks.bench_prefix [图片路径 ...] [--types 4] [--url http://...]
+
+每张图片按服务端的调度方式请求多个识别类型：第一个类型单独发出，其余类型并发发出。
+统计首个类型与后续类型的延迟；服务端返回 usage.prompt_tokens_details.cached_tokens 时，
+同时统计预填充中命中缓存的 token 比例。
+两种布局使用不同的样例图片，避免前一种布局的缓存影响后一种。
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from statistics import mean, median
+
+import httpx
+
+from model.model import MODEL_URL, MODEL_TIMEOUT, build_request_data, build_messages, compress_image
+from prompt_json import prompt
+from benchmarks.bench_decode import make_sample_image
+
+LAYOUTS = ("text_first", "image_first")
+
+
+async def _post(client: httpx.AsyncClient, url: str, data: dict) -> dict:
+    t0 = time.perf_counter()
+    resp = await client.post(url, json=data)
+    resp.raise_for_status()
+    usage = resp.json().get("usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "latency": time.perf_counter() - t0,
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "cached_tokens": details.get("cached_tokens", 0) or 0,
+    }
+
+
+async def run_image(client: httpx.AsyncClient, url: str, b64_image: str, questions, layout: str) -> dict:
+    """一张图片的全部识别类型：首个类型预热，其余并发"""
+    def request(question):
+        data = build_request_data(question, b64_image)
+        data["messages"] = build_messages(question, b64_image, layout)
+        return _post(client, url, data)
+
+    t0 = time.perf_counter()
+    first = await request(questions[0])
+    rest = await asyncio.gather(*(request(q) for q in questions[1:]))
+    return {"wall": time.perf_counter() - t0, "first": first, "rest": list(rest)}
+
+
+async def run_benchmark(url: str, images_by_layout, questions) -> dict:
+    results = {}
+    async with httpx.AsyncClient(timeout=MODEL_TIMEOUT) as client:
+        for layout in LAYOUTS:
+            results[layout] = []
+            for image_path in images_by_layout[layout]:
+                b64_image = compress_image(image_path)
+                results[layout].append(await run_image(client, url, b64_image, questions, layout))
+    return results
+
+
+def summarize(runs) -> dict:
+    firsts = [r["first"] for r in runs]
+    rests = [x for r in runs for x in r["rest"]]
+    follow = rests or firsts
+    prompt_tokens = sum(x["prompt_tokens"] for x in follow)
+    cached_tokens = sum(x["cached_tokens"] for x in follow)
+    return {
+        "wall": median(r["wall"] for r in runs),
+        "first": median(x["latency"] for x in firsts),
+        "rest": median(x["latency"] for x in follow),
+        "rest_mean": mean(x["latency"] for x in follow),
+        "cached_ratio": cached_tokens / prompt_tokens if prompt_tokens else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多识别类型任务的前缀缓存收益基准")
+    parser.add_argument("images", nargs="*", help="样例图片路径（至少2张，前一半用于 text_first，后一半用于 image_first；默认自动生成）")
+    parser.add_argument("--types", type=int, default=4, help="每张图片的识别类型数")
+    parser.add_argument("--count", type=int, default=4, help="自动生成时每种布局的图片数")
+    parser.add_argument("--url", default=MODEL_URL, help="chat/completions 接口地址")
+    args = parser.parse_args()
+
+    questions = list(prompt.values())[:args.types]
+    tmp_dir = None
+    images = args.images
+    if not images:
+        tmp_dir = tempfile.TemporaryDirectory()
+        images = [make_sample_image(os.path.join(tmp_dir.name, f"sample_{i}.jpg"))
+                  for i in range(args.count * 2)]
+    if len(images) < 2:
+        parser.error("至少需要2张图片")
+    half = len(images) // 2
+    images_by_layout = {"text_first": images[:half], "image_first": images[half:half * 2]}
+
+    results = asyncio.run(run_benchmark(args.url, images_by_layout, questions))
+
+    print(f"每种布局 {half} 张图片，每张 {len(questions)} 个识别类型，模型接口 {args.url}")
+    print(f"{'布局':<14}{'单图总耗时(ms)':>16}{'首个类型(ms)':>14}{'后续类型中位数(ms)':>20}{'后续类型均值(ms)':>18}{'后续缓存命中率':>16}")
+    summaries = {layout: summarize(runs) for layout, runs in results.items()}
+    for layout, s in summaries.items():
+        ratio = f"{s['cached_ratio']:.1%}" if s["cached_ratio"] is not None else "n/a"
+        print(f"{layout:<14}{s['wall'] * 1000:>16.1f}{s['first'] * 1000:>14.1f}{s['rest'] * 1000:>20.1f}"
+              f"{s['rest_mean'] * 1000:>18.1f}{ratio:>16}")
+
+    base, prefix = summaries["text_first"], summaries["image_first"]
+    print(f"image_first 单图总耗时加速比: {base['wall'] / prefix['wall']:.2f}x，"
+          f"后续类型延迟加速比: {base['rest'] / prefix['rest']:.2f}x")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# benchmarks/bench_transport.py
+"""图片传输方式基准：请求体大小与端到端延迟
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.bench_transport [图片路径 ...] [--repeat 10]
+
+对比四种方式（每种方式都包含预处理、构建并序列化请求体、模型服务取回图片）：
+- reencode：解码缩放后重编码为 JPEG，base64 内联（旧行为）
+- passthrough：合规 JPEG 直接使用原始字节，base64 内联
+- file：按 file:// 路径引用（模型服务同机 / 共享存储）
+- url：按 HTTP 地址引用，由模型服务拉取
+模型服务由本地桩服务代替（--resolve-images：解码 base64 / 读取文件 / 下载地址，零推理延迟）。
+默认样例为一张超出1K的原图和一张已合规的1K JPEG。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from statistics import median
+
+import httpx
+
+# 共享目录放到临时目录，避免写入仓库（需在导入 model.model 之前设置）
+SHARE_DIR = tempfile.mkdtemp(prefix="vision_bench_shared_")
+os.environ["MODEL_IMAGE_SHARE_DIR"] = SHARE_DIR
+
+from model.model import build_request_data, prepare_image_timed  # noqa: E402
+from prompt_json import prompt  # noqa: E402
+from benchmarks.bench_decode import make_sample_image  # noqa: E402
+
+# (名称, 传输方式, 是否允许直通)
+MODES = [
+    ("reencode", "base64", False),
+    ("passthrough", "base64", True),
+    ("file", "file", True),
+    ("url", "url", True),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+
+def run_mode(client: httpx.Client, url: str, image_path: str, question: str, transport: str,
+             passthrough: bool, url_base: str, repeat: int) -> dict:
+    prepares, totals, sizes = [], [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        image, _ = prepare_image_timed(image_path, transport=transport, passthrough=passthrough, url_base=url_base)
+        t1 = time.perf_counter()
+        body = json.dumps(build_request_data(question, image), ensure_ascii=False).encode("utf-8")
+        resp = client.post(url, content=body, headers={"Content-Type": "application/json"})
+        resp.raise_for_status()
+        totals.append(time.perf_counter() - t0)
+        prepares.append(t1 - t0)
+        sizes.append(len(body))
+    return {"prepare": median(prepares), "total": median(totals), "body_bytes": median(sizes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片传输方式基准")
+    parser.add_argument("images", nargs="*", help="样例图片路径（默认自动生成）")
+    parser.add_argument("--repeat", type=int, default=10, help="每张图片每种方式的重复次数")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    images = args.images or [
+        make_sample_image(os.path.join(tmp_dir.name, "oversize_4000x3000.jpg"), (4000, 3000)),
+        make_sample_image(os.path.join(tmp_dir.name, "compliant_1920x1080.jpg"), (1920, 1080)),
+    ]
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    stub = subprocess.Popen([sys.executable, "-m", "benchmarks.stub_server", "--port", str(port),
+                             "--latency-mean", "0", "--resolve-images", "--files-dir", SHARE_DIR],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    question = next(iter(prompt.values()))
+    try:
+        wait_http(f"{base}/health")
+        with httpx.Client(timeout=60) as client:
+            print(f"{'图片':<28}{'方式':<14}{'请求体(KB)':>12}{'预处理(ms)':>12}{'端到端(ms)':>12}")
+            for image_path in images:
+                rows = {}
+                for name, transport, passthrough in MODES:
+                    rows[name] = run_mode(client, f"{base}/v1/chat/completions", image_path, question,
+                                          transport, passthrough, f"{base}/files/", args.repeat)
+                    r = rows[name]
+                    print(f"{os.path.basename(image_path):<28}{name:<14}{r['body_bytes'] / 1024:>12.1f}"
+                          f"{r['prepare'] * 1000:>12.1f}{r['total'] * 1000:>12.1f}")
+                ref = rows["reencode"]
+                for name in ("passthrough", "file", "url"):
+                    print(f"{'':<28}{name} 相对 reencode：请求体 {rows[name]['body_bytes'] / ref['body_bytes']:.1%}，"
+                          f"端到端 {ref['total'] / rows[name]['total']:.2f}x")
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+        tmp_dir.cleanup()
+        shutil.rmtree(SHARE_DIR, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+# benchmarks/loadgen.py
+"""压测负载生成：闭环（固定并发）与开环（固定到达率，泊松到达）
+
+用法（在仓库根目录执行，推理服务需已启动）：
+    python -m benchmarks.loadgen --endpoint async --mode closed --level 16 --duration 20 图片1.jpg 图片2.jpg
+
+endpoint：
+- async：POST /vision_engine/image_analysis 提交后轮询 get_result 直到结束，统计端到端耗时
+- sync：POST /vision_engine/image_analysis_sync
+- get_result：反复查询同一个已完成任务
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from typing import Callable, Dict, List
+
+import httpx
+
+ENDPOINTS = ("async", "sync", "get_result")
+MODES = ("closed", "open")
+
+
+# ==============================
+# 1. 单次操作
+# ==============================
+class Workload:
+    """一类压测请求：按轮转方式取样例图片构造任务"""
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str, images: List[str], types: List[str],
+                 images_per_request: int = 1, poll_interval: float = 0.05):
+        self.client = client
+        self.base_url = base_url.rstrip("/")
+        self.images = images
+        self.types = types
+        self.images_per_request = images_per_request
+        self.poll_interval = poll_interval
+        self._next = 0
+        self.task_id = None
+
+    def make_tasks(self) -> List[Dict]:
+        tasks = []
+        for _ in range(self.images_per_request):
+            tasks.append({"identifyType": self.types, "ftp_path": self.images[self._next % len(self.images)]})
+            self._next += 1
+        return tasks
+
+    async def op_sync(self) -> Dict:
+        resp = await self.client.post(f"{self.base_url}/vision_engine/image_analysis_sync", json=self.make_tasks())
+        resp.raise_for_status()
+        return {"ok": all(item["status"] == "success" for item in resp.json())}
+
+    async def op_async(self) -> Dict:
+        t0 = time.perf_counter()
+        resp = await self.client.post(f"{self.base_url}/vision_engine/image_analysis", json=self.make_tasks())
+        resp.raise_for_status()
+        submit_latency = time.perf_counter() - t0
+        task_id = resp.json()["task_id"]
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            result = (await self.client.get(f"{self.base_url}/vision_engine/get_result/{task_id}")).json()
+            if result["status"] in ("done", "failed"):
+                ok = result["status"] == "done" and all(
+                    item["status"] == "success" for item in result.get("response") or [])
+                return {"ok": ok, "submit_latency": submit_latency}
+
+    async def prepare_get_result(self) -> None:
+        """get_result 压测前先完成一个任务，之后反复查询它"""
+        resp = await self.client.post(f"{self.base_url}/vision_engine/image_analysis", json=self.make_tasks())
+        resp.raise_for_status()
+        self.task_id = resp.json()["task_id"]
+        while (await self.client.get(f"{self.base_url}/vision_engine/get_result/{self.task_id}")).json()[
+                "status"] not in ("done", "failed"):
+            await asyncio.sleep(self.poll_interval)
+
+    async def op_get_result(self) -> Dict:
+        resp = await self.client.get(f"{self.base_url}/vision_engine/get_result/{self.task_id}")
+        resp.raise_for_status()
+        return {"ok": True}
+
+    def operation(self, endpoint: str) -> Callable:
+        return {"async": self.op_async, "sync": self.op_sync, "get_result": self.op_get_result}[endpoint]
+
+
+async def _timed(op: Callable, samples: List[Dict]) -> None:
+    t0 = time.perf_counter()
+    try:
+        sample = await op()
+    except Exception as e:
+        sample = {"ok": False, "error": repr(e)[:200]}
+    sample["latency"] = time.perf_counter() - t0
+    samples.append(sample)
+
+
+# ==============================
+# 2. 闭环 / 开环
+# ==============================
+async def run_closed(op: Callable, concurrency: int, duration: float) -> List[Dict]:
+    """闭环：concurrency 个虚拟用户，各自上一个请求完成后立即发下一个"""
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await _timed(op, samples)
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples
+
+
+async def run_open(op: Callable, rate: float, duration: float, max_in_flight: int = 10000,
+                   seed: int = None) -> List[Dict]:
+    """开环：按到达率 rate（次/秒）泊松到达发请求，不等待前一个请求完成（在途上限 max_in_flight，超出计为失败）"""
+    samples = []
+    rng = random.Random(seed)
+    pending = set()
+    deadline = time.perf_counter() + duration
+    next_arrival = time.perf_counter()
+    while next_arrival < deadline:
+        await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+        if len(pending) >= max_in_flight:
+            samples.append({"ok": False, "error": "client in-flight limit", "latency": 0.0})
+        else:
+            fut = asyncio.create_task(_timed(op, samples))
+            pending.add(fut)
+            fut.add_done_callback(pending.discard)
+        next_arrival += rng.expovariate(rate)
+    if pending:
+        await asyncio.gather(*pending)
+    return samples
+
+
+# ==============================
+# 3. 统计
+# ==============================
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    # 最近秩法
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[Dict], elapsed: float) -> Dict:
+    ok_latencies = [s["latency"] for s in samples if s["ok"]]
+    submit = [s["submit_latency"] for s in samples if "submit_latency" in s]
+    errors = [s.get("error") for s in samples if not s["ok"] and s.get("error")]
+    summary = {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok_latencies),
+        "throughput": round(len(ok_latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "p50": round(percentile(ok_latencies, 50), 4),
+        "p95": round(percentile(ok_latencies, 95), 4),
+        "p99": round(percentile(ok_latencies, 99), 4),
+        "max": round(max(ok_latencies), 4) if ok_latencies else 0.0,
+    }
+    if submit:
+        summary["submit_p99"] = round(percentile(submit, 99), 4)
+    if errors:
+        summary["error_samples"] = errors[:5]
+    return summary
+
+
+class ProcessSampler:
+    """按 /proc 采样被测进程（含预处理进程池等直接子进程）的 CPU 时间与 RSS（Linux）"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self._task = None
+        self._cpu_start: Dict[int, float] = {}
+        self._wall_start = 0.0
+        self._ticks = os.sysconf("SC_CLK_TCK")
+
+    def _pids(self) -> List[int]:
+        pids = [self.pid]
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    if self._stat_fields(int(entry))[1] == str(self.pid):
+                        pids.append(int(entry))
+                except (OSError, IndexError):
+                    continue
+        return pids
+
+    @staticmethod
+    def _stat_fields(pid: int) -> List[str]:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # 进程名可能含空格，从最后一个 ")" 之后切分：下标 1 为 ppid，11、12 为 utime、stime
+            return f.read().rsplit(")", 1)[1].split()
+
+    def _cpu_seconds(self) -> Dict[int, float]:
+        cpu = {}
+        for pid in self._pids():
+            try:
+                fields = self._stat_fields(pid)
+                cpu[pid] = (int(fields[11]) + int(fields[12])) / self._ticks
+            except (OSError, IndexError):
+                continue
+        return cpu
+
+    def _rss_mb(self) -> float:
+        total = 0.0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status", "r") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) / 1024
+                            break
+            except OSError:
+                continue
+        return total
+
+    async def _loop(self) -> None:
+        while True:
+            self.peak_rss_mb = max(self.peak_rss_mb, self._rss_mb())
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self.peak_rss_mb = 0.0
+        self._cpu_start = self._cpu_seconds()
+        self._wall_start = time.perf_counter()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> Dict:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        wall = time.perf_counter() - self._wall_start
+        # 压测期间新建的子进程起始CPU时间按 0 计
+        cpu = sum(t - self._cpu_start.get(pid, 0.0) for pid, t in self._cpu_seconds().items())
+        return {
+            "cpu_percent": round(cpu / wall * 100, 1) if wall > 0 else 0.0,
+            "peak_rss_mb": round(max(self.peak_rss_mb, self._rss_mb()), 1),
+        }
+
+
+async def fetch_server_stats(client: httpx.AsyncClient, base_url: str) -> Dict:
+    """读取 /vision_engine/stats，失败时返回空字典"""
+    try:
+        return (await client.get(f"{base_url.rstrip('/')}/vision_engine/stats")).json()
+    except Exception:
+        return {}
+
+
+def queue_metrics(before: Dict, after: Dict) -> Dict:
+    """本档位期间的排队指标：预处理排队平均耗时按前后两次快照的累计值求差"""
+    def queue_wait(stats):
+        stage = stats.get("preprocess_pool", {}).get("stages", {}).get("queue_wait", {})
+        return stage.get("count", 0), stage.get("count", 0) * stage.get("avg", 0.0)
+
+    count_before, total_before = queue_wait(before)
+    count_after, total_after = queue_wait(after)
+    count = count_after - count_before
+    return {
+        "preprocess_queue_wait_avg": round((total_after - total_before) / count, 4) if count > 0 else 0.0,
+        "limiter_limit": after.get("model_limiter", {}).get("limit"),
+        "limiter_waiting": after.get("model_limiter", {}).get("waiting"),
+        "scheduler_pending_items": after.get("scheduler", {}).get("pending_items"),
+    }
+
+
+async def run_level(base_url: str, endpoint: str, mode: str, level: float, duration: float,
+                    images: List[str], types: List[str], images_per_request: int = 1,
+                    server_pid: int = None, seed: int = None) -> Dict:
+    """一个档位：闭环时 level 为并发数，开环时 level 为每秒请求数"""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=1000)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0), limits=limits) as client:
+        workload = Workload(client, base_url, images, types, images_per_request)
+        if endpoint == "get_result":
+            await workload.prepare_get_result()
+        op = workload.operation(endpoint)
+
+        stats_before = await fetch_server_stats(client, base_url)
+        sampler = ProcessSampler(server_pid) if server_pid else None
+        if sampler:
+            sampler.start()
+        t0 = time.perf_counter()
+        if mode == "closed":
+            samples = await run_closed(op, int(level), duration)
+        else:
+            samples = await run_open(op, level, duration, seed=seed)
+        elapsed = time.perf_counter() - t0
+
+        result = {"endpoint": endpoint, "mode": mode, "level": level, "duration": round(elapsed, 2)}
+        result.update(summarize(samples, elapsed))
+        if sampler:
+            result.update(await sampler.stop())
+        result.update(queue_metrics(stats_before, await fetch_server_stats(client, base_url)))
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理服务压测负载生成")
+    parser.add_argument("images", nargs="+", help="样例图片路径（需为推理服务可访问的本地路径）")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="async")
+    parser.add_argument("--mode", choices=MODES, default="closed")
+    parser.add_argument("--level", type=float, default=8, help="闭环为并发数，开环为每秒请求数")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--types", default="道路-破损,道路-积水", help="识别类型，逗号分隔")
+    parser.add_argument("--images-per-request", type=int, default=1)
+    parser.add_argument("--server-pid", type=int, default=None, help="推理服务进程号（用于统计CPU与RSS）")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_level(args.base_url, args.endpoint, args.mode, args.level, args.duration,
+                                   args.images, args.types.split(","), args.images_per_request,
+                                   args.server_pid, args.seed))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# benchmarks/report.py
+"""压测结果报表与基线对比
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.report results.json [--baseline baseline.json] [--tolerance 0.15]
+
+与基线相同（endpoint, mode, level）的档位对比吞吐与 p95/p99 延迟，
+吞吐下降或延迟上升超过 tolerance 时列为回归，并以退出码 1 结束，便于部署前流水线拦截。
+"""
+import sys
+import json
+import argparse
+from typing import Dict, List
+
+COLUMNS = [
+    ("endpoint", "接口", "{}"),
+    ("mode", "模式", "{}"),
+    ("level", "档位", "{:g}"),
+    ("requests", "请求数", "{}"),
+    ("errors", "失败", "{}"),
+    ("throughput", "吞吐(次/s)", "{:.2f}"),
+    ("p50", "p50(ms)", "{:.0f}", 1000),
+    ("p95", "p95(ms)", "{:.0f}", 1000),
+    ("p99", "p99(ms)", "{:.0f}", 1000),
+    ("preprocess_queue_wait_avg", "预处理排队(ms)", "{:.1f}", 1000),
+    ("cpu_percent", "CPU%", "{:.0f}"),
+    ("peak_rss_mb", "峰值RSS(MB)", "{:.0f}"),
+]
+
+# (指标, 越大越好)
+COMPARED_METRICS = [("throughput", True), ("p95", False), ("p99", False)]
+
+
+def _cell(row: Dict, column) -> str:
+    key, _, fmt = column[:3]
+    value = row.get(key)
+    if value is None:
+        return "-"
+    if len(column) > 3:
+        value = value * column[3]
+    return fmt.format(value)
+
+
+def format_table(rows: List[Dict]) -> str:
+    table = [[title for _, title, *_ in COLUMNS]]
+    table += [[_cell(row, c) for c in COLUMNS] for row in rows]
+    widths = [max(len(r[i]) for r in table) + 2 for i in range(len(COLUMNS))]
+    return "\n".join("".join(cell.rjust(w) for cell, w in zip(r, widths)) for r in table)
+
+
+def _key(row: Dict) -> tuple:
+    return row["endpoint"], row["mode"], float(row["level"])
+
+
+def compare(rows: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """返回回归说明列表"""
+    base_by_key = {_key(r): r for r in baseline}
+    regressions = []
+    for row in rows:
+        base = base_by_key.get(_key(row))
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            old, new = base.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{row['endpoint']}/{row['mode']}/{row['level']:g} {metric}: "
+                                   f"{old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def load_results(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["results"] if isinstance(data, dict) else data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测结果报表与基线对比")
+    parser.add_argument("results", help="run_suite 输出的结果文件")
+    parser.add_argument("--baseline", default=None, help="基线结果文件")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的相对退化比例")
+    args = parser.parse_args()
+
+    rows = load_results(args.results)
+    print(format_table(rows))
+    if args.baseline:
+        regressions = compare(rows, load_results(args.baseline), args.tolerance)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项性能回归（容差 {args.tolerance:.0%}）：")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n与基线相比无性能回归（容差 {args.tolerance:.0%}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# benchmarks/run_suite.py
+"""一键离线压测：启动模型桩服务和推理服务，按多个档位压测各接口并输出报告
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.run_suite --endpoints async,sync,get_result --levels 1,8,32 --duration 15 \\
+        --output bench_results.json [--baseline bench_baseline.json]
+
+- 推理服务在临时目录中运行（任务库、结果缓存、日志都不落在仓库里），默认关闭结果缓存以测量真实推理路径
+- 桩服务的延迟分布 / 错误率通过 --latency-* / --error-rate 等参数配置，与 stub_server 相同
+- 指定 --baseline 时与基线对比，存在回归则退出码为 1
+- --server-env KEY=VALUE（可重复）覆盖推理服务的环境变量，用于对比配置，例如
+  同步日志基线：--server-env LOG_ASYNC=0 --server-env LOG_PAYLOAD_MAX_CHARS=0 --server-env AUDIT_LOG_ENABLED=0
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+from benchmarks.bench_decode import make_sample_image
+from benchmarks.stub_server import add_stub_arguments
+from benchmarks.loadgen import run_level, ENDPOINTS, MODES
+from benchmarks.report import format_table, compare, load_results
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url: str, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+
+def stub_command(args, port: int) -> list:
+    cmd = [sys.executable, "-m", "benchmarks.stub_server", "--port", str(port),
+           "--latency-dist", args.latency_dist, "--latency-mean", str(args.latency_mean),
+           "--latency-std", str(args.latency_std), "--error-rate", str(args.error_rate),
+           "--error-status", str(args.error_status), "--response-text", args.response_text,
+           "--token-interval", str(args.token_interval)]
+    if args.seed is not None:
+        cmd += ["--seed", str(args.seed)]
+    return cmd
+
+
+def server_env(args, workdir: str, stub_port: int, api_port: int) -> dict:
+    env = dict(os.environ)
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    env.update({
+        "API_PORT": str(api_port),
+        "MODEL_URL": f"{stub_url}/v1/chat/completions",
+        "MODEL_BACKENDS": "",
+        "MODEL_BACKENDS_FILE": "",
+        "CALLBACK_URL": f"{stub_url}/callback",
+        "RESULT_CACHE_ENABLED": "1" if args.cache else "0",
+        "RESULT_CACHE_PATH": os.path.join(workdir, "result_cache.db"),
+        "TASK_DATA_DIR": os.path.join(workdir, "task_data"),
+        "TASK_STORE_PATH": os.path.join(workdir, "task_data", "tasks.db"),
+        "CALLBACK_OUTBOX_FILE": os.path.join(workdir, "failed_push.jsonl"),
+    })
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线压测套件")
+    parser.add_argument("--endpoints", default="async,sync,get_result", help=f"逗号分隔，可选 {ENDPOINTS}")
+    parser.add_argument("--mode", choices=MODES, default="closed")
+    parser.add_argument("--levels", default="1,8,32", help="闭环为并发数，开环为每秒请求数，逗号分隔")
+    parser.add_argument("--duration", type=float, default=15, help="每个档位的压测时长（秒）")
+    parser.add_argument("--warmup", type=float, default=3, help="正式压测前的预热时长（秒）")
+    parser.add_argument("--images", type=int, default=16, help="生成的样例图片数")
+    parser.add_argument("--image-size", default="4000x3000", help="样例图片尺寸")
+    parser.add_argument("--types", default="道路-破损,道路-积水", help="识别类型，逗号分隔")
+    parser.add_argument("--images-per-request", type=int, default=1)
+    parser.add_argument("--cache", action="store_true", help="开启结果缓存（默认关闭）")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--keep", action="store_true", help="保留临时目录（含服务日志）")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="覆盖推理服务的环境变量，可重复")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    levels = [float(level) for level in args.levels.split(",") if level]
+    types = args.types.split(",")
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+
+    workdir = tempfile.mkdtemp(prefix="vision_bench_")
+    images = [make_sample_image(os.path.join(workdir, f"sample_{i}.jpg"), (width, height))
+              for i in range(args.images)]
+    stub_port, api_port = free_port(), free_port()
+    base_url = f"http://127.0.0.1:{api_port}"
+
+    procs = []
+    try:
+        with open(os.path.join(workdir, "stub.log"), "w") as stub_log:
+            procs.append(subprocess.Popen(stub_command(args, stub_port), cwd=REPO_ROOT,
+                                          stdout=stub_log, stderr=subprocess.STDOUT))
+        with open(os.path.join(workdir, "server.out"), "w") as server_log:
+            server = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "server.py")], cwd=workdir,
+                                      env=server_env(args, workdir, stub_port, api_port),
+                                      stdout=server_log, stderr=subprocess.STDOUT)
+            procs.append(server)
+        wait_http(f"http://127.0.0.1:{stub_port}/health")
+        wait_http(f"{base_url}/vision_engine/stats")
+
+        if args.warmup > 0:
+            asyncio.run(run_level(base_url, endpoints[0], "closed", 2, args.warmup, images, types,
+                                  args.images_per_request))
+
+        rows = []
+        for endpoint in endpoints:
+            for level in levels:
+                row = asyncio.run(run_level(base_url, endpoint, args.mode, level, args.duration, images, types,
+                                            args.images_per_request, server.pid, args.seed))
+                rows.append(row)
+                print(f"{endpoint}/{args.mode}/{level:g}: {row['throughput']} 次/s, "
+                      f"p99 {row['p99'] * 1000:.0f}ms, 失败 {row['errors']}", flush=True)
+
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+
+        print()
+        print(format_table(rows))
+        print(f"\n结果已写入 {args.output}")
+        if args.baseline:
+            regressions = compare(rows, load_results(args.baseline), args.tolerance)
+            if regressions:
+                print(f"\n发现 {len(regressions)} 项性能回归（容差 {args.tolerance:.0%}）：")
+                for line in regressions:
+                    print(f"  {line}")
+                return 1
+            print(f"\n与基线相比无性能回归（容差 {args.tolerance:.0%}）")
+        return 0
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if args.keep:
+            print(f"临时目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
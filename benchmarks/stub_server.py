@@ -0,0 +1,200 @@
+# benchmarks/stub_server.py
+"""OpenAI 兼容的模型桩服务，离线压测时代替真实模型
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.stub_server --port 5001 --latency-dist lognormal --latency-mean 0.8 --latency-std 0.3 --error-rate 0.01
+
+- POST /v1/chat/completions：按配置的延迟分布等待后返回固定回答，支持 stream、response_format / guided_json；
+  --resolve-images 时像真实模型服务一样取回请求中的图片（解码 base64 / 读取 file:// / 下载 http://）
+- GET  /health：健康探测
+- POST /callback：回调接收端（压测时把推理服务的 CALLBACK_URL 指向这里）
+- GET  /stub/stats：请求计数
+- GET  /files/{name}：--files-dir 下的图片，作为巡检系统图片 HTTP 地址的本地替身
+"""
+import os
+import re
+import sys
+import json
+import math
+import base64
+import random
+import asyncio
+import argparse
+from urllib.parse import urlparse, unquote
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+
+DEFAULT_RESPONSE = "[{'状态':'不存在','描述':'桩服务固定回答，用于离线压测'}]"
+LATENCY_DISTS = ("fixed", "uniform", "normal", "lognormal")
+
+
+class StubConfig:
+    def __init__(self, latency_dist: str = "fixed", latency_mean: float = 0.5, latency_std: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, response_text: str = DEFAULT_RESPONSE,
+                 token_interval: float = 0.0, seed: int = None, files_dir: str = None,
+                 resolve_images: bool = False):
+        self.latency_dist = latency_dist
+        self.latency_mean = latency_mean
+        self.latency_std = latency_std
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.response_text = response_text
+        # 流式输出时每个 chunk 的间隔（秒）
+        self.token_interval = token_interval
+        self.files_dir = files_dir
+        self.resolve_images = resolve_images
+        self.rng = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        mean, std = self.latency_mean, self.latency_std
+        if self.latency_dist == "uniform":
+            return max(0.0, self.rng.uniform(mean - std, mean + std))
+        if self.latency_dist == "normal":
+            return max(0.0, self.rng.gauss(mean, std))
+        if self.latency_dist == "lognormal" and mean > 0:
+            # 按目标均值 / 标准差换算对数正态参数
+            sigma2 = math.log(1 + (std / mean) ** 2)
+            return self.rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+        return mean
+
+
+def build_answer(config: StubConfig, data: dict) -> str:
+    """按请求形态给出可被服务端解析的回答"""
+    text = json.dumps(data.get("messages", []), ensure_ascii=False)
+    verdict_only = "response_format" in data or "guided_json" in data
+    if "合并为一个JSON对象" in text:
+        types = re.findall(r"问题\d+【(.*?)】", text)
+        value = {"状态": "不存在"} if verdict_only else [{"状态": "不存在", "描述": "桩服务固定回答"}]
+        return json.dumps({t: value for t in types}, ensure_ascii=False)
+    if verdict_only:
+        return '{"状态": "不存在"}'
+    return config.response_text
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def resolve_images(client: httpx.AsyncClient, data: dict) -> int:
+    """取回请求中的全部图片，返回图片字节数"""
+    total = 0
+    for message in data.get("messages", []):
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get("type") != "image_url":
+                continue
+            url = part["image_url"]["url"]
+            if url.startswith("data:"):
+                total += len(base64.b64decode(url.split(",", 1)[1]))
+            elif url.startswith("file://"):
+                total += len(await asyncio.to_thread(_read_file, unquote(urlparse(url).path)))
+            else:
+                resp = await client.get(url)
+                resp.raise_for_status()
+                total += len(resp.content)
+    return total
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+    counters = {"requests": 0, "errors": 0, "streams": 0, "callbacks": 0, "files": 0, "image_bytes": 0}
+    client = httpx.AsyncClient(timeout=30)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/callback")
+    async def callback(request: Request):
+        await request.body()
+        counters["callbacks"] += 1
+        return {"code": 200}
+
+    @app.get("/files/{name}")
+    async def files(name: str):
+        path = os.path.join(config.files_dir or "", os.path.basename(name))
+        if not config.files_dir or not os.path.isfile(path):
+            raise HTTPException(status_code=404)
+        counters["files"] += 1
+        return FileResponse(path)
+
+    @app.get("/stub/stats")
+    async def stats():
+        return counters
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        data = await request.json()
+        counters["requests"] += 1
+        if config.resolve_images:
+            try:
+                counters["image_bytes"] += await resolve_images(client, data)
+            except Exception as e:
+                counters["errors"] += 1
+                return JSONResponse({"error": {"message": f"image fetch failed: {e}"}}, status_code=400)
+        await asyncio.sleep(config.sample_latency())
+        if config.rng.random() < config.error_rate:
+            counters["errors"] += 1
+            return JSONResponse({"error": {"message": "stub injected error"}}, status_code=config.error_status)
+
+        answer = build_answer(config, data)
+        if data.get("stream"):
+            counters["streams"] += 1
+
+            async def generate():
+                for i in range(0, len(answer), 2):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": answer[i:i + 2]}}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    if config.token_interval:
+                        await asyncio.sleep(config.token_interval)
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(generate(), media_type="text/event-stream")
+
+        return {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(answer) // 2,
+                      "total_tokens": len(answer) // 2},
+        }
+
+    return app
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTS, default="fixed", help="延迟分布")
+    parser.add_argument("--latency-mean", type=float, default=0.5, help="平均延迟（秒）")
+    parser.add_argument("--latency-std", type=float, default=0.0, help="延迟标准差 / uniform 半宽（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的比例")
+    parser.add_argument("--error-status", type=int, default=503, help="注入错误的状态码")
+    parser.add_argument("--response-text", default=DEFAULT_RESPONSE, help="单类型问题的回答内容")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="流式输出每个 chunk 的间隔（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，固定后延迟与错误序列可复现")
+    parser.add_argument("--files-dir", default=None, help="通过 /files/{name} 提供下载的图片目录")
+    parser.add_argument("--resolve-images", action="store_true", help="取回请求中的图片（计入请求处理时间）")
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(args.latency_dist, args.latency_mean, args.latency_std, args.error_rate,
+                      args.error_status, args.response_text, args.token_interval, args.seed, args.files_dir,
+                      args.resolve_images)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的模型桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
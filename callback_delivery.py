@@ -0,0 +1,358 @@
+# callback_delivery.py
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import httpx
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不支持多进程共享发件箱
+    fcntl = None
+
+from metrics import observe_stage, STAGE_CALLBACK
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# 回调推送配置
+# ============================
+# 同时进行中的回调请求上限
+CALLBACK_CONCURRENCY = int(os.environ.get("CALLBACK_CONCURRENCY", 8))
+# 内存待推送队列上限，队列满时直接写入落盘发件箱，不再占用内存
+CALLBACK_QUEUE_SIZE = int(os.environ.get("CALLBACK_QUEUE_SIZE", 10000))
+CALLBACK_MAX_RETRIES = int(os.environ.get("CALLBACK_MAX_RETRIES", 3))
+CALLBACK_TIMEOUT = float(os.environ.get("CALLBACK_TIMEOUT", 10.0))
+# 批量推送：大于1时一次POST多个任务结果（请求体为 [{"taskId":..., "response":...}, ...]）
+CALLBACK_BATCH_SIZE = int(os.environ.get("CALLBACK_BATCH_SIZE", 1))
+CALLBACK_BATCH_WAIT = float(os.environ.get("CALLBACK_BATCH_WAIT", 0.2))
+# 失败推送发件箱（追加写 JSON Lines）及补推周期
+CALLBACK_OUTBOX_FILE = Path(os.environ.get("CALLBACK_OUTBOX_FILE", "./failed_push.jsonl"))
+CALLBACK_REDELIVERY_INTERVAL = float(os.environ.get("CALLBACK_REDELIVERY_INTERVAL", 30))
+CALLBACK_REDELIVERY_MAX_INTERVAL = float(os.environ.get("CALLBACK_REDELIVERY_MAX_INTERVAL", 600))
+
+# 旧版失败推送记录文件（整体读写的 JSON 数组），启动时一次性迁入发件箱
+LEGACY_FAILED_PUSH_FILE = Path("./failed_push.json")
+
+
+# ============================
+# 落盘发件箱
+# ============================
+class FailedPushOutbox:
+    """追加写的失败推送发件箱：记录失败 O(1) 追加，补推成功后整体压缩重写
+
+    多个服务进程共用同一发件箱：读写通过文件锁互斥，同一时刻只有一个进程执行补推
+    """
+
+    def __init__(self, path: Path = CALLBACK_OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self, suffix: str = ".lock", blocking: bool = True):
+        """跨进程文件锁，返回是否取得锁（非阻塞模式下其他进程持有时为 False）"""
+        if fcntl is None:
+            yield True
+            return
+        with open(self.path.with_suffix(self.path.suffix + suffix), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def redelivery_lock(self):
+        """补推轮次锁（非阻塞）：其他进程正在补推时本轮跳过，避免重复推送"""
+        with self._file_lock(".redeliver.lock", blocking=False) as acquired:
+            yield acquired
+
+    def append(self, records: List[Dict]) -> None:
+        if not records:
+            return
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with self._lock, self._file_lock():
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+    def read(self) -> tuple:
+        """返回 (全部记录, 当前文件长度)"""
+        with self._lock, self._file_lock():
+            if not self.path.exists():
+                return [], 0
+            with open(self.path, "r", encoding="utf-8") as f:
+                content = f.read()
+        records = []
+        for line in content.splitlines():
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.error(f"发件箱记录损坏，已跳过: {line[:200]}")
+        return records, len(content.encode("utf-8"))
+
+    def compact(self, remaining: List[Dict], read_offset: int) -> None:
+        """用剩余记录 + 读取之后新追加的记录原子替换发件箱文件"""
+        with self._lock, self._file_lock():
+            tail = b""
+            if self.path.exists():
+                with open(self.path, "rb") as f:
+                    f.seek(read_offset)
+                    tail = f.read()
+            tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            with open(tmp_path, "wb") as f:
+                for r in remaining:
+                    f.write((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8"))
+                f.write(tail)
+            os.replace(tmp_path, self.path)
+
+    def migrate_legacy(self, legacy_file: Path = LEGACY_FAILED_PUSH_FILE) -> int:
+        # 多个进程同时启动时只由一个进程迁移
+        with self._file_lock(".redeliver.lock"):
+            if not legacy_file.exists():
+                return 0
+            try:
+                with open(legacy_file, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            except Exception as e:
+                logger.error(f"读取旧版失败推送记录 {legacy_file} 失败: {e}")
+                return 0
+            self.append(records)
+            legacy_file.rename(legacy_file.with_suffix(".json.migrated"))
+            return len(records)
+
+
+# ============================
+# 回调推送组件
+# ============================
+class CallbackDelivery:
+    """任务结果回调推送
+
+    - 共享一个带连接池的 httpx.AsyncClient
+    - 固定数量的发送协程从有界队列取任务，限制并发
+    - 可选批量推送
+    - 最终失败写入追加式发件箱，后台补推循环按退避间隔重新投递
+    """
+
+    def __init__(self, callback_url: str, outbox: Optional[FailedPushOutbox] = None):
+        self.callback_url = callback_url
+        self.outbox = outbox or FailedPushOutbox()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=CALLBACK_QUEUE_SIZE)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._workers: List[asyncio.Task] = []
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.outboxed = 0
+        self.spilled = 0
+        self.redelivered = 0
+        self.redelivery_interval = CALLBACK_REDELIVERY_INTERVAL
+        # 队列中任务的登记时间与识别类型，用于统计推送耗时
+        self._submitted: Dict[str, tuple] = {}
+        # 各发送协程正在推送、尚未送达也未落盘的记录，服务关闭时由 stop() 统一写入发件箱
+        self._sending: Dict[int, List[Dict]] = {}
+
+    # ---------- 生命周期 ----------
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(
+            timeout=CALLBACK_TIMEOUT,
+            limits=httpx.Limits(max_connections=CALLBACK_CONCURRENCY,
+                                max_keepalive_connections=CALLBACK_CONCURRENCY),
+        )
+        migrated = await asyncio.to_thread(self.outbox.migrate_legacy)
+        if migrated:
+            logger.info(f"已将 {migrated} 条旧版失败推送记录迁入发件箱 {self.outbox.path}")
+        for _ in range(CALLBACK_CONCURRENCY):
+            self._workers.append(asyncio.create_task(self._sender()))
+        self._workers.append(asyncio.create_task(self._redelivery_loop()))
+
+    async def stop(self) -> None:
+        """停止推送：未发出的结果写入发件箱，下次启动后补推"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        leftover = [record for records in self._sending.values() for record in records]
+        self._sending.clear()
+        while not self._queue.empty():
+            task_id, data = self._queue.get_nowait()
+            leftover.append(self._make_record(task_id, data))
+        if leftover:
+            await asyncio.to_thread(self.outbox.append, leftover)
+            self.outboxed += len(leftover)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------- 提交 ----------
+    async def submit(self, task_id: str, data: Dict, identify_types: Optional[List[str]] = None) -> None:
+        """登记一次推送；内存队列已满时直接落盘等待补推"""
+        try:
+            self._queue.put_nowait((task_id, data))
+            self._submitted[task_id] = (time.monotonic(), identify_types)
+        except asyncio.QueueFull:
+            self.spilled += 1
+            await asyncio.to_thread(self.outbox.append, [self._make_record(task_id, data)])
+            self.outboxed += 1
+            logger.warning(f"⚠️ 推送队列已满，任务 {task_id} 结果写入发件箱等待补推")
+
+    def _observe(self, task_ids: List[str]) -> None:
+        """记录登记到推送成功 / 最终失败的耗时"""
+        now = time.monotonic()
+        for task_id in task_ids:
+            submitted = self._submitted.pop(task_id, None)
+            if submitted is not None:
+                observe_stage(STAGE_CALLBACK, now - submitted[0], submitted[1])
+
+    def _make_record(self, task_id: str, data: Dict) -> Dict:
+        return {
+            "task_id": task_id,
+            "callback_url": self.callback_url,
+            "data": data,
+            "time": datetime.now().isoformat()
+        }
+
+    # ---------- 发送 ----------
+    @staticmethod
+    def _payload(datas: List[Dict]):
+        """请求体：未启用批量推送时为单个结果，启用时为结果列表（即使只有一条）"""
+        return datas[0] if CALLBACK_BATCH_SIZE <= 1 else list(datas)
+
+    async def _post(self, payload, url: Optional[str] = None) -> bool:
+        try:
+            resp = await self._client.post(url or self.callback_url, json=payload)
+            if resp.status_code == 200:
+                return True
+            logger.warning(f"⚠️ 推送失败，状态码: {resp.status_code}，响应: {resp.text[:500]}")
+        except Exception as e:
+            logger.error(f"❌ 推送异常: {e!r}")
+        self.failed_attempts += 1
+        return False
+
+    async def _next_batch(self) -> List[tuple]:
+        batch = [await self._queue.get()]
+        if CALLBACK_BATCH_SIZE > 1:
+            deadline = time.monotonic() + CALLBACK_BATCH_WAIT
+            try:
+                while len(batch) < CALLBACK_BATCH_SIZE:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # 凑批过程中被取消，已取出的结果放回队列，由 stop() 统一落盘
+                for item in batch:
+                    self._queue.put_nowait(item)
+                raise
+        return batch
+
+    async def _sender(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            task_ids = [task_id for task_id, _ in batch]
+            payload = self._payload([data for _, data in batch])
+
+            records = [self._make_record(t, d) for t, d in batch]
+            # 推送期间被取消（服务关闭）时记录留在 _sending 中，由 stop() 落盘，下次启动后补推
+            self._sending[id(records)] = records
+
+            retry_delay = 2
+            for attempt in range(1, CALLBACK_MAX_RETRIES + 1):
+                if await self._post(payload):
+                    del self._sending[id(records)]
+                    self._observe(task_ids)
+                    self.delivered += len(batch)
+                    logger.info(f"✅ 成功推送任务结果: {task_ids} (第 {attempt} 次尝试)")
+                    break
+                if attempt < CALLBACK_MAX_RETRIES:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+            else:
+                # 先移出 _sending 再落盘：落盘期间被取消时写入线程仍会完成，stop() 不会重复写入
+                del self._sending[id(records)]
+                self._observe(task_ids)
+                self.outboxed += len(batch)
+                await asyncio.to_thread(self.outbox.append, records)
+                logger.error(f"❌ 推送最终失败，已写入发件箱: {task_ids}")
+
+    # ---------- 补推 ----------
+    async def _redelivery_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.redelivery_interval)
+            try:
+                with self.outbox.redelivery_lock() as acquired:
+                    if acquired:
+                        await self._redeliver_once()
+            except Exception as e:
+                logger.exception(f"补推失败记录出错: {e}")
+
+    @staticmethod
+    def _redelivery_batches(records: List[Dict]) -> List[List[Dict]]:
+        """按原顺序把回调地址相同的相邻记录分成不超过 CALLBACK_BATCH_SIZE 条的批次"""
+        batches = []
+        for record in records:
+            if (batches and len(batches[-1]) < CALLBACK_BATCH_SIZE
+                    and batches[-1][0].get("callback_url") == record.get("callback_url")):
+                batches[-1].append(record)
+            else:
+                batches.append([record])
+        return batches
+
+    async def _redeliver_once(self) -> None:
+        records, read_offset = await asyncio.to_thread(self.outbox.read)
+        if not records:
+            self.redelivery_interval = CALLBACK_REDELIVERY_INTERVAL
+            return
+
+        remaining = []
+        receiver_down = False
+        batches = self._redelivery_batches(records)
+        for index, batch in enumerate(batches):
+            if receiver_down:
+                remaining.extend(r for b in batches[index:] for r in b)
+                break
+            # 与实时推送相同的请求体形态；历史记录可能指向旧的回调地址，仍按记录中的地址补推
+            ok = await self._post(self._payload([r["data"] for r in batch]), batch[0].get("callback_url"))
+            if ok:
+                self.redelivered += len(batch)
+            else:
+                remaining.extend(batch)
+                # 首批即失败说明接收方仍不可用，本轮不再逐批重试
+                receiver_down = index == 0
+
+        await asyncio.to_thread(self.outbox.compact, remaining, read_offset)
+        if receiver_down:
+            self.redelivery_interval = min(self.redelivery_interval * 2, CALLBACK_REDELIVERY_MAX_INTERVAL)
+            logger.warning(f"回调接收方不可用，{len(remaining)} 条记录待补推，{self.redelivery_interval:.0f}s 后重试")
+        else:
+            self.redelivery_interval = CALLBACK_REDELIVERY_INTERVAL
+            logger.info(f"补推完成：成功 {len(records) - len(remaining)} 条，剩余 {len(remaining)} 条")
+
+    def stats(self) -> Dict:
+        return {
+            "callback_url": self.callback_url,
+            "queued": self._queue.qsize(),
+            "queue_max": self._queue.maxsize,
+            "concurrency": CALLBACK_CONCURRENCY,
+            "batch_size": CALLBACK_BATCH_SIZE,
+            "delivered": self.delivered,
+            "failed_attempts": self.failed_attempts,
+            "outboxed": self.outboxed,
+            "spilled": self.spilled,
+            "redelivered": self.redelivered,
+            "redelivery_interval": self.redelivery_interval,
+        }
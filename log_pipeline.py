@@ -0,0 +1,230 @@
+# log_pipeline.py
+"""非阻塞日志管线
+
+- 标准库 logging 与 loguru 的日志都先放入内存队列，由后台 QueueListener 线程写文件和控制台，
+  调用方（事件循环 / 工作线程）不等待磁盘或 stdout；队列满时丢弃并计数
+- 大块载荷（请求参数、推送结果）在普通日志里只记截断后的摘要，可按比例抽样
+- 完整结果写入独立的结构化审计日志（JSON Lines），由后台线程攒批写入
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+from typing import Dict, Optional
+
+from loguru import logger as loguru_logger
+
+
+# ============================
+# 日志配置
+# ============================
+LOG_DIR = os.environ.get("LOG_DIR", "./logs")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+# 0 时回退为同步写文件和控制台（用于压测对比）
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "1") == "1"
+# 日志队列上限（条），满时丢弃新日志而不是阻塞调用方
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 100000))
+# 普通日志中载荷摘要的最大字符数，0 表示不截断
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 500))
+# 记录载荷摘要的比例（0~1），未抽中的请求只记录条数等元信息
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 1.0))
+
+# 审计日志：完整请求参数与结果
+AUDIT_LOG_ENABLED = os.environ.get("AUDIT_LOG_ENABLED", "1") == "1"
+AUDIT_LOG_FILE = os.environ.get("AUDIT_LOG_FILE", os.path.join(LOG_DIR, "audit.jsonl"))
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", 10000))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 200))
+AUDIT_BATCH_WAIT = float(os.environ.get("AUDIT_BATCH_WAIT", 0.5))
+
+
+# ============================
+# 载荷截断与抽样
+# ============================
+def truncate(payload, max_chars: int = LOG_PAYLOAD_MAX_CHARS) -> str:
+    """载荷转为字符串并截断，保留原始长度信息"""
+    text = payload if isinstance(payload, str) else str(payload)
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...(共{len(text)}字符)"
+
+
+def sample_payload() -> bool:
+    """本次是否记录载荷摘要"""
+    return LOG_PAYLOAD_SAMPLE_RATE >= 1 or random.random() < LOG_PAYLOAD_SAMPLE_RATE
+
+
+def payload_summary(payload) -> str:
+    """日志中的载荷：抽中时为截断后的内容，否则只给出条数"""
+    if sample_payload():
+        return truncate(payload)
+    size = len(payload) if hasattr(payload, "__len__") else 1
+    return f"<{size} 项，未抽样>"
+
+
+# ============================
+# 队列日志
+# ============================
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，不阻塞调用方"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(log_file: str) -> None:
+    """配置进程日志：标准库 logging 与 loguru 共用一条队列，由后台线程写文件和控制台"""
+    global _queue_handler, _listener
+    if _listener is not None:
+        return
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+    sinks = [logging.FileHandler(log_file, encoding="utf-8"), logging.StreamHandler()]
+    for handler in sinks:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    loguru_logger.remove()
+
+    if not LOG_ASYNC:
+        for handler in sinks:
+            root.addHandler(handler)
+        loguru_logger.add(sys.stderr, level=LOG_LEVEL)
+        return
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    root.addHandler(_queue_handler)
+    # loguru 的日志转为标准库记录放入同一队列（格式化在调用方完成，写入在后台线程）
+    loguru_logger.add(_queue_handler, level=LOG_LEVEL, format="{message}")
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *sinks, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """写完队列中剩余日志后停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict:
+    return {
+        "async": LOG_ASYNC,
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "queue_max": LOG_QUEUE_SIZE,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "payload_max_chars": LOG_PAYLOAD_MAX_CHARS,
+        "payload_sample_rate": LOG_PAYLOAD_SAMPLE_RATE,
+    }
+
+
+# ============================
+# 审计日志
+# ============================
+class AuditLog:
+    """结构化审计日志：调用方只把记录放入有界队列，后台线程序列化后攒批追加写入 JSON Lines"""
+
+    def __init__(self, path: str = AUDIT_LOG_FILE, enabled: bool = AUDIT_LOG_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+        self._writer = None
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self) -> None:
+        if self.enabled and self._writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._writer = threading.Thread(target=self._write_loop, name="audit-log-writer", daemon=True)
+            self._writer.start()
+
+    def close(self) -> None:
+        """写完队列中剩余记录后停止后台线程"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def record(self, event: str, **fields) -> None:
+        """登记一条审计记录（字段需可 JSON 序列化）；未启动或队列满时丢弃"""
+        if self._writer is None:
+            return
+        try:
+            self._queue.put_nowait({"time": datetime.now().isoformat(), "event": event, **fields})
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + AUDIT_BATCH_WAIT
+            while len(batch) < AUDIT_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                # 停止前取尽队列中剩余记录
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+            records = [r for r in batch if r is not None]
+            if not records:
+                continue
+            try:
+                lines = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                self.written += len(records)
+                self.batches += 1
+            except Exception as e:
+                self.errors += 1
+                logging.getLogger(__name__).error(f"审计日志写入失败（{len(records)} 条）: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "queue_max": self._queue.maxsize,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+
+# 进程级共享审计日志
+audit_log = AuditLog()
@@ -3,11 +3,17 @@ import json
 import os
 import asyncio
 import time
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple, Optional
 from loguru import logger
 from prompt_json import prompt
-from model.model import run_inference  # 导入模型推理函数
+from model.model import run_inference_async, model_params_signature  # 导入模型推理函数
+from model.stream_parser import SHAPE_OBJECT
+from model.preprocess_pool import preprocess_pool
+from result_cache import result_cache
+from singleflight import SingleFlight, LeaderCancelled
+from image_fetcher import fetch_image, FetchedImage
+from metrics import (observe_stage, STAGE_VALIDATION, STAGE_PREPROCESS_QUEUE, STAGE_DECODE, STAGE_RESIZE,
+                     STAGE_ENCODE, STAGE_MODEL, STAGE_PARSE, STAGE_PERSIST, STAGE_FETCH, metric_types, record_result)
 
 
 # ==============================
@@ -15,14 +21,24 @@ from model.model import run_inference  # 导入模型推理函数
 # ==============================
 PROMPT_MAP = prompt
 VALID_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff")
-MAX_WORKERS = 4  # 并发线程数
+# 多问题合并模式：同一图片的所有识别类型合并为一次模型调用（可被任务中的 multiQuestion 覆盖）
+MULTI_QUESTION_MODE = os.environ.get("MULTI_QUESTION_MODE", "0") == "1"
+
+# 同一图片多个识别类型逐个推理时，先单独完成第一个类型（服务端缓存该图片的前缀），其余类型再并发推理
+PREFIX_WARMUP_FANOUT = os.environ.get("PREFIX_WARMUP_FANOUT", "1") == "1"
+# 仅判定模式（只返回状态、不生成描述）默认启用的识别类型，逗号分隔，"*" 表示全部（可被任务中的 verdictOnly 覆盖）
+VERDICT_ONLY_TYPES = {t.strip() for t in os.environ.get("VERDICT_ONLY_TYPES", "").split(",") if t.strip()}
+VERDICT_ONLY_SUFFIX = "\n本次只需给出判定状态，不需要描述理由，忽略上述返回格式，必须按照如下格式返回:{\"状态\":\"\"}"
+
+# 同一图片+识别类型+Prompt 的并发推理请求合并为一次模型调用
+inference_flight = SingleFlight()
 
 
 # ==============================
 # 2. 参数校验与结果解析
 # ==============================
-def validate_task_params(task: Dict) -> None:
-    """校验输入任务的合法性"""
+def validate_task_fields(task: Dict) -> None:
+    """校验任务字段（不访问图片）"""
     required_fields = ["identifyType", "ftp_path"]
     for field in required_fields:
         if field not in task:
@@ -36,7 +52,9 @@ def validate_task_params(task: Dict) -> None:
     if invalid_types:
         raise ValueError(f"以下识别类型无对应Prompt：{', '.join(invalid_types)}")
 
-    img_path = task["ftp_path"]
+
+def validate_image_path(img_path: str) -> None:
+    """校验本地图片路径（远程图片为下载后的暂存路径）"""
     if not os.path.exists(img_path):
         raise FileNotFoundError(f"图片路径不存在：{img_path}")
     if not os.path.isfile(img_path):
@@ -64,6 +82,19 @@ import re
 
 def parse_model_answer(identify_type: str, model_answer: str) -> Dict:
     """解析模型回答为结构化JSON"""
+    # 快速路径：结构化输出（仅判定模式）返回的是严格JSON对象，直接解析
+    stripped = model_answer.strip()
+    if stripped.startswith("{"):
+        try:
+            answer_obj = json.loads(stripped)
+            if isinstance(answer_obj, dict) and answer_obj.get("状态") in ("存在", "不存在"):
+                return {
+                    "identifyType": identify_type,
+                    "result": answer_obj["状态"],
+                    "sceneDesc": answer_obj.get("描述", "")
+                }
+        except json.JSONDecodeError:
+            pass
     try:
         # 使用正则表达式提取JSON数组部分
         json_pattern = r'\[\s*\{.*?\}\s*\]'
@@ -85,37 +116,375 @@ def parse_model_answer(identify_type: str, model_answer: str) -> Dict:
         raise ValueError(f"模型返回结果解析失败: {e}\n原始内容: {model_answer}")
 
 
+def build_multi_question_prompt(identify_types: List[str], verdict_only: bool = False) -> str:
+    """将多个识别类型的Prompt合并为一个问题，要求按类型名返回JSON对象"""
+    lines = [f"以下是针对同一张图片的{len(identify_types)}个相互独立的识别问题，请逐一判断，每个问题单独作答，互不影响。"]
+    for idx, type_name in enumerate(identify_types, 1):
+        lines.append(f"问题{idx}【{type_name}】：{PROMPT_MAP[type_name]}")
+    if verdict_only:
+        example = ", ".join(f'"{t}": {{"状态":""}}' for t in identify_types)
+        lines.append(
+            "请将所有问题的答案合并为一个JSON对象返回，键为问题对应的识别类型名称（【】中的内容），"
+            f"值只需给出判定状态，不需要描述理由，必须按照如下格式返回:{{{example}}}"
+        )
+        return "\n".join(lines)
+    example = ", ".join(f'"{t}": [{{"状态":"","描述":""}}]' for t in identify_types)
+    lines.append(
+        "请将所有问题的答案合并为一个JSON对象返回，键为问题对应的识别类型名称（【】中的内容），"
+        f"值为该问题要求的格式，必须按照如下格式返回:{{{example}}}"
+    )
+    return "\n".join(lines)
+
+
+def build_question(identify_type: str, verdict_only: bool = False) -> str:
+    """单类型问题文本，仅判定模式追加只返回状态的要求"""
+    if verdict_only:
+        return PROMPT_MAP[identify_type] + VERDICT_ONLY_SUFFIX
+    return PROMPT_MAP[identify_type]
+
+
+def resolve_multi_question(task: Dict) -> bool:
+    """任务中的 multiQuestion 优先，未指定时按 MULTI_QUESTION_MODE 配置"""
+    multi_question = task.get("multiQuestion")
+    if multi_question is None:
+        return MULTI_QUESTION_MODE
+    return bool(multi_question)
+
+
+def cache_params_signature(verdict_only: bool, merged: bool) -> str:
+    """结果缓存与请求合并使用的参数签名：区分合并提问与逐类型提问，单类型仅判定模式计入追加的提示文本"""
+    return model_params_signature(verdict_only, merged, VERDICT_ONLY_SUFFIX if verdict_only and not merged else "")
+
+
+def resolve_verdict_only(task: Dict, identify_type: str) -> bool:
+    """任务中的 verdictOnly 优先，未指定时按 VERDICT_ONLY_TYPES 配置"""
+    verdict_only = task.get("verdictOnly")
+    if verdict_only is not None:
+        return bool(verdict_only)
+    return "*" in VERDICT_ONLY_TYPES or identify_type in VERDICT_ONLY_TYPES
+
+
+def _extract_verdict(identify_type: str, value) -> Dict:
+    """从合并回答中单个类型的值提取结构化结果"""
+    if isinstance(value, list):
+        value = value[0]
+    return {
+        "identifyType": identify_type,
+        "result": value['状态'],
+        "sceneDesc": value.get('描述', "")
+    }
+
+
+def parse_multi_model_answer(identify_types: List[str], model_answer: str) -> Dict[str, Dict]:
+    """解析多问题合并回答，返回 {识别类型: 结构化结果}，缺失或无法解析的类型不在结果中"""
+    parsed = {}
+    formatted_answer = model_answer.replace("'", "\"")
+
+    # 优先整体解析最外层JSON对象
+    start, end = formatted_answer.find("{"), formatted_answer.rfind("}")
+    if 0 <= start < end:
+        try:
+            answer_obj = json.loads(formatted_answer[start:end + 1])
+            if isinstance(answer_obj, dict):
+                for type_name in identify_types:
+                    try:
+                        parsed[type_name] = _extract_verdict(type_name, answer_obj[type_name])
+                    except Exception:
+                        continue
+        except json.JSONDecodeError:
+            pass
+
+    # 整体解析未覆盖的类型按类型名逐个提取
+    for type_name in identify_types:
+        if type_name in parsed:
+            continue
+        pattern = re.escape(f'"{type_name}"') + r'\s*:\s*(\[\s*\{.*?\}\s*\]|\{.*?\})'
+        match = re.search(pattern, formatted_answer, re.DOTALL)
+        if not match:
+            continue
+        try:
+            parsed[type_name] = _extract_verdict(type_name, json.loads(match.group(1)))
+        except Exception:
+            continue
+    return parsed
+
+
 # ==============================
-# 3. 单任务同步处理
+# 3. 异步处理
 # ==============================
-def process_single_task_sync(task: Dict) -> Dict:
-    """同步处理单个任务"""
+async def prepare_task_image_async(task: Dict, identify_types: List[str] = None, content_key: str = None) -> str:
+    """异步预处理图片：解码压缩交给常驻预处理进程池（content_key 见 PreparedTask.content_key）"""
+    timings = {}
+    try:
+        b64_image = await preprocess_pool.get_image(task["ftp_path"], timings=timings, content_key=content_key)
+    except Exception as e:
+        raise ValueError(f"图片处理出错: {e}")
+    if timings:
+        observe_stage(STAGE_PREPROCESS_QUEUE, timings["queue_wait"], identify_types)
+        observe_stage(STAGE_DECODE, timings["decode"], identify_types)
+        observe_stage(STAGE_RESIZE, timings["resize"], identify_types)
+        observe_stage(STAGE_ENCODE, timings["encode"] + timings["base64"], identify_types)
+    return b64_image
+
+
+class PreparedTask:
+    """推理前阶段（取图/校验、查结果缓存、预处理）的产物，交给推理阶段使用"""
+
+    def __init__(self, task: Dict):
+        # 原始任务，返回结果中的 ftp_path 保持原样
+        self.task = task
+        # ftp_path 替换为本地路径后的任务（本地图片即原任务）
+        self.local_task = task
+        self.image: Optional[FetchedImage] = None
+        self.error: Optional[Exception] = None
+        # 远程图片的内容哈希：暂存文件路径每次下载都不同，跨任务的在途合并、实例亲和与预处理缓存按内容匹配
+        self.content_key: Optional[str] = None
+        # 仅判定模式与否 -> 结果缓存命中的 {识别类型: 结果}
+        self.cached: Dict[bool, Dict[str, Dict]] = {}
+        self.b64_image: Optional[str] = None
+        # 任务中断前已完成的识别类型 {识别类型: 结果}，续跑时不再推理
+        self.resumed: Dict[str, Dict] = {}
+        # 每个识别类型推理完成时的回调 (识别类型, 结果)，用于记录检查点
+        self.on_type_result: Optional[Callable[[str, Dict], None]] = None
+
+    @property
+    def image_key(self) -> str:
+        """跨任务识别同一图片的键：远程图片按内容，本地图片按路径"""
+        return self.content_key or os.path.abspath(self.local_task["ftp_path"])
+
+    def release(self) -> None:
+        """删除远程图片的本地暂存文件，并释放预处理结果"""
+        if self.image is not None:
+            self.image.release()
+        self.b64_image = None
+
+
+def group_types(task: Dict) -> Dict[bool, List[str]]:
+    """仅判定模式与完整模式的类型分组（两者的请求参数与缓存条目不同）"""
+    groups = {}
+    for type_name in task["identifyType"]:
+        groups.setdefault(resolve_verdict_only(task, type_name), []).append(type_name)
+    return groups
+
+
+async def fetch_task_async(task: Dict) -> PreparedTask:
+    """校验任务字段，按 ftp_path 取图到本地并校验图片；出错记录在 error 中，由推理阶段按失败返回"""
+    prepared = PreparedTask(task)
+    identify_types = metric_types(task)
+    try:
+        validate_task_fields(task)
+        fetch_start = time.perf_counter()
+        prepared.image = await fetch_image(task["ftp_path"])
+        observe_stage(STAGE_FETCH, time.perf_counter() - fetch_start, identify_types)
+        if prepared.image.path != task["ftp_path"]:
+            prepared.local_task = {**task, "ftp_path": prepared.image.path}
+        validate_start = time.perf_counter()
+        await asyncio.to_thread(validate_image_path, prepared.image.path)
+        observe_stage(STAGE_VALIDATION, time.perf_counter() - validate_start, identify_types)
+        if prepared.image.temporary:
+            # 哈希按文件记忆，随后查结果缓存时不再重复计算
+            prepared.content_key = "sha256:" + await asyncio.to_thread(result_cache.image_hash, prepared.image.path)
+    except Exception as e:
+        prepared.error = e
+    return prepared
+
+
+async def preprocess_task_async(prepared: PreparedTask) -> None:
+    """查结果缓存（续跑时先取已完成的类型），仍有类型需要推理时预处理图片"""
+    if prepared.error is not None:
+        return
+    task = prepared.local_task
+    try:
+        missing = []
+        multi_question = resolve_multi_question(task)
+        for verdict_only, types in group_types(task).items():
+            cached = {t: prepared.resumed[t] for t in types if t in prepared.resumed}
+            rest = [t for t in types if t not in cached]
+            if rest and not task.get("bypassCache"):
+                prompts = {t: PROMPT_MAP[t] for t in rest}
+                model_params = cache_params_signature(verdict_only, multi_question and len(types) > 1)
+                cached.update(await asyncio.to_thread(result_cache.get_many, task["ftp_path"], prompts, model_params))
+            prepared.cached[verdict_only] = cached
+            missing.extend(t for t in types if t not in cached)
+        if missing:
+            prepared.b64_image = await prepare_task_image_async(task, missing, prepared.content_key)
+    except Exception as e:
+        prepared.error = e
+
+
+async def infer_types_async(img_path: str, identify_types: List[str], b64_image: str,
+                            multi_question: bool, verdict_only: bool = False,
+                            on_result: Optional[Callable[[str, Dict], None]] = None,
+                            affinity_key: Optional[str] = None) -> Dict[str, Dict]:
+    """对一张图片推理若干识别类型，返回 {识别类型: 结构化结果}
+    on_result 在每个类型得到结果时立即调用（不等同组其他类型完成）；
+    affinity_key 为模型实例亲和键，默认为图片路径
+    """
+    affinity_key = affinity_key or img_path
+    parsed = {}
+    if multi_question and len(identify_types) > 1:
+        logger.info(f"合并识别{identify_types} -> {os.path.basename(img_path)}")
+        timings = {}
+        model_answer = await run_inference_async(
+            question=build_multi_question_prompt(identify_types, verdict_only),
+            b64_image=b64_image,
+            shape=SHAPE_OBJECT,
+            verdict_only=verdict_only,
+            identify_types=identify_types if verdict_only else None,
+            affinity_key=affinity_key,
+            timings=timings
+        )
+        if "model_http" in timings:
+            observe_stage(STAGE_MODEL, timings["model_http"], identify_types)
+        logger.debug(f"模型原始回答（前200字符）：{model_answer[:200]}")
+        parse_start = time.perf_counter()
+        parsed = parse_multi_model_answer(identify_types, model_answer)
+        observe_stage(STAGE_PARSE, time.perf_counter() - parse_start, identify_types)
+        if on_result is not None:
+            for type_name, type_result in parsed.items():
+                on_result(type_name, type_result)
+        missing = [t for t in identify_types if t not in parsed]
+        if missing:
+            logger.warning(f"合并回答缺少或无法解析{missing}，回退为单类型识别")
+
+    async def infer_one(type_name: str) -> None:
+        logger.info(f"开始识别【{type_name}】 -> {os.path.basename(img_path)}")
+        timings = {}
+        model_answer = await run_inference_async(
+            question=build_question(type_name, verdict_only),
+            b64_image=b64_image,
+            verdict_only=verdict_only,
+            affinity_key=affinity_key,
+            timings=timings
+        )
+        if "model_http" in timings:
+            observe_stage(STAGE_MODEL, timings["model_http"], [type_name])
+        logger.debug(f"模型原始回答（前200字符）：{model_answer[:200]}")
+        parse_start = time.perf_counter()
+        try:
+            parsed[type_name] = parse_model_answer(type_name, model_answer)
+        finally:
+            observe_stage(STAGE_PARSE, time.perf_counter() - parse_start, [type_name])
+        if on_result is not None:
+            on_result(type_name, parsed[type_name])
+
+    remaining = [t for t in identify_types if t not in parsed]
+    if PREFIX_WARMUP_FANOUT and len(remaining) > 1:
+        # 第一个类型完成后图片前缀已在服务端缓存，其余类型并发发出，只需预填充各自的问题部分
+        await infer_one(remaining[0])
+        fanout = [asyncio.ensure_future(infer_one(t)) for t in remaining[1:]]
+        try:
+            await asyncio.gather(*fanout)
+        except BaseException:
+            # 任一类型失败即整张图片失败：取消其余在途调用并等待其结束，
+            # 避免它们在图片已判定失败后继续回调 on_result、写入检查点
+            for call in fanout:
+                call.cancel()
+            await asyncio.gather(*fanout, return_exceptions=True)
+            raise
+    else:
+        for type_name in remaining:
+            await infer_one(type_name)
+    return parsed
+
+
+async def resolve_types_async(task: Dict, types: List[str], multi_question: bool,
+                              verdict_only: bool, prepared: PreparedTask = None) -> Dict[str, Dict]:
+    """一组识别类型的结果：先查结果缓存，再合并在途请求，其余类型预处理图片并推理
+    prepared 中已有的缓存查询结果和预处理图片直接使用
+    """
+    img_path = task["ftp_path"]
+
+    # 结果缓存（bypassCache=true 时跳过读取，但仍写入最新结果）
+    prompts = {t: PROMPT_MAP[t] for t in types}
+    model_params = cache_params_signature(verdict_only, multi_question and len(types) > 1)
+    results = {}
+    if prepared is not None and verdict_only in prepared.cached:
+        results = dict(prepared.cached[verdict_only])
+    elif not task.get("bypassCache"):
+        results = await asyncio.to_thread(result_cache.get_many, img_path, prompts, model_params)
+    if results:
+        logger.info(f"结果缓存命中{list(results)} -> {os.path.basename(img_path)}")
+
+    missing = [t for t in types if t not in results]
+    image_key = prepared.image_key if prepared is not None else os.path.abspath(img_path)
+    flight_keys = {t: (image_key, t, prompts[t], model_params) for t in missing}
+    while missing:
+        # 已有相同请求在途的类型直接等待其结果，其余类型由本任务执行
+        joined = {}
+        for type_name in missing:
+            fut = inference_flight.join(flight_keys[type_name])
+            if fut is not None:
+                joined[type_name] = fut
+        to_run = [t for t in missing if t not in joined]
+
+        if to_run:
+            for type_name in to_run:
+                inference_flight.lead(flight_keys[type_name])
+            try:
+                b64_image = prepared.b64_image if prepared is not None and prepared.b64_image else None
+                if b64_image is None:
+                    b64_image = await prepare_task_image_async(task, to_run,
+                                                               prepared.content_key if prepared is not None else None)
+                inferred = await infer_types_async(img_path, to_run, b64_image, multi_question, verdict_only,
+                                                   prepared.on_type_result if prepared is not None else None,
+                                                   affinity_key=image_key)
+                # 部分类型已命中缓存时实际按剩余类型数决定是否合并提问，按实际方式写入
+                run_params = cache_params_signature(verdict_only, multi_question and len(to_run) > 1)
+                persist_start = time.perf_counter()
+                await asyncio.to_thread(result_cache.put_many, img_path, prompts, run_params, inferred)
+                observe_stage(STAGE_PERSIST, time.perf_counter() - persist_start, to_run)
+            except BaseException as e:
+                for type_name in to_run:
+                    inference_flight.resolve(flight_keys[type_name], error=e)
+                raise
+            for type_name in to_run:
+                inference_flight.resolve(flight_keys[type_name], result=inferred[type_name])
+            results.update(inferred)
+
+        # 执行者被取消（如其客户端断开）的类型重新合并或由本任务执行
+        missing = []
+        for type_name, fut in joined.items():
+            logger.info(f"合并在途请求【{type_name}】 -> {os.path.basename(img_path)}")
+            try:
+                results[type_name] = dict(await asyncio.shield(fut))
+            except LeaderCancelled:
+                logger.info(f"在途请求的执行者已取消，重新推理【{type_name}】 -> {os.path.basename(img_path)}")
+                missing.append(type_name)
+
+    return results
+
+
+async def process_single_task_async(task: Dict, prepared: PreparedTask = None) -> Dict:
+    """异步处理单任务：取图校验，查结果缓存，未命中的类型再预处理图片并推理
+    prepared 为流水线前序阶段的产物（由调用方负责释放），未传入时在此依次完成各阶段
+    """
     start_time = time.time()
+    owned = prepared is None
     try:
-        validate_task_params(task)
-        img_path = task["ftp_path"]
+        if owned:
+            prepared = await fetch_task_async(task)
+            await preprocess_task_async(prepared)
+        if prepared.error is not None:
+            raise prepared.error
+        local_task = prepared.local_task
         identify_types = task["identifyType"]
 
-        judgment_info = []
-        for type_name in identify_types:
-            current_prompt = PROMPT_MAP[type_name]
-            logger.info(f"开始识别【{type_name}】 -> {os.path.basename(img_path)}")
+        multi_question = resolve_multi_question(task)
 
-            model_answer = run_inference(
-                image_path=img_path,
-                question=current_prompt
-            )
-            print(model_answer)
-            logger.debug(f"模型原始回答（前200字符）：{model_answer[:200]}")
+        results = {}
+        for group_results in await asyncio.gather(*(
+            resolve_types_async(local_task, types, multi_question, verdict_only, prepared)
+            for verdict_only, types in group_types(local_task).items()
+        )):
+            results.update(group_results)
 
-            parsed = parse_model_answer(type_name, model_answer)
-            judgment_info.append(parsed)
+        judgment_info = [results[t] for t in identify_types]
 
         elapsed = round(time.time() - start_time, 2)
-        logger.info(f"任务完成 {os.path.basename(img_path)} ✅ 耗时 {elapsed}s")
-
-        return {
-            "ftp_path": img_path,
+        logger.info(f"任务完成 {os.path.basename(task['ftp_path'])} ✅ 耗时 {elapsed}s")
+        result = {
+            "ftp_path": task["ftp_path"],
             "judgmentInfo": judgment_info,
             "status": "success",
             "error_msg": ""
@@ -124,47 +493,34 @@ def process_single_task_sync(task: Dict) -> Dict:
     except Exception as e:
         error_msg = str(e)
         logger.error(f"任务失败：{error_msg}")
-        return {
+        result = {
             "ftp_path": task.get("ftp_path", "未知路径"),
             "judgmentInfo": [],
             "status": "failed",
             "error_msg": error_msg
         }
-
-
-# ==============================
-# 4. 异步包装
-# ==============================
-async def process_single_task_async(task: Dict, executor) -> Dict:
-    """异步封装单任务"""
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(
-        executor,
-        process_single_task_sync,
-        task,
-    )
+    finally:
+        if owned and prepared is not None:
+            prepared.release()
+    record_result(result, metric_types(task))
     return result
 
 
-async def process_batch_tasks_async(
-    tasks: List[Dict],
-    max_workers: int = MAX_WORKERS
-) -> List[Dict]:
-    """批量异步任务处理入口"""
+async def process_batch_tasks_async(tasks: List[Dict]) -> List[Dict]:
+    """批量异步任务处理入口（预处理并发由 preprocess_pool 决定，模型并发由 model_limiter 决定）"""
     total = len(tasks)
-    logger.info(f"启动批量任务，共 {total} 个，最大并发：{max_workers}")
+    logger.info(f"启动批量任务，共 {total} 个，预处理进程数：{preprocess_pool.workers}")
     start_time = time.time()
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        coroutines = [
-            process_single_task_async(task, executor)
-            for task in tasks
-        ]
-        results = await asyncio.gather(*coroutines)
+    coroutines = [
+        process_single_task_async(task)
+        for task in tasks
+    ]
+    results = await asyncio.gather(*coroutines)
 
     elapsed = round(time.time() - start_time, 2)
     success = sum(1 for r in results if r["status"] == "success")
     failed = total - success
     logger.info(f"✅ 批量任务完成：成功 {success} / 失败 {failed}，耗时 {elapsed}s")
 
-    return results
\ No newline at end of file
+    return results
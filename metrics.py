@@ -0,0 +1,205 @@
+# metrics.py
+"""Prometheus 文本格式的运行指标（不依赖 prometheus_client）
+
+- vision_stage_seconds：各处理阶段耗时直方图，按 stage / identifyType 分组
+- vision_type_results_total：各识别类型的结果计数，按 identifyType / status 分组
+- 队列深度、在途模型调用、活跃 Worker、缓存命中率等瞬时值由 Gauge 在抓取时回调读取
+"""
+import os
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from prompt_json import prompt as PROMPT_MAP
+
+
+# ============================
+# 指标配置
+# ============================
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# 直方图分桶（秒），覆盖毫秒级的解析/校验到数十秒的模型调用
+METRICS_BUCKETS = tuple(
+    float(b) for b in os.environ.get(
+        "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+    ).split(",") if b.strip()
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 阶段名称
+STAGE_QUEUE_WAIT = "queue_wait"              # 提交到 Worker 取出该图片
+STAGE_FETCH = "fetch"                        # 按 ftp_path 取图（远程图片下载到本地）
+STAGE_VALIDATION = "validation"              # 图片路径校验
+STAGE_PREPROCESS_QUEUE = "preprocess_queue"  # 等待预处理子进程
+STAGE_DECODE = "decode"
+STAGE_RESIZE = "resize"
+STAGE_ENCODE = "encode"                      # JPEG 编码 + base64
+STAGE_MODEL = "model_http"                   # 拿到并发槽位后到模型服务的 HTTP 往返
+STAGE_PARSE = "parse"                        # 解析模型回答
+STAGE_PERSIST = "persist"                    # 写结果缓存 / 登记任务落盘
+STAGE_CALLBACK = "callback"                  # 登记推送到推送成功或最终失败
+
+UNKNOWN_TYPE = "unknown"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ============================
+# 指标类型
+# ============================
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str], buckets: Tuple = METRICS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数..., 总和, 总数]
+        self._series: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for labelvalues, series in items:
+            for bound, count in zip(self.buckets, series):
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str]):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """抓取时调用 collect 取值：返回单个数值，或 {标签值元组: 数值}"""
+
+    def __init__(self, name: str, help_text: str, collect: Callable, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.collect()
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        for labelvalues, v in samples:
+            if v is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(v)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, collect: Callable, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, collect, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:  # 单个 Gauge 回调出错不影响其余指标
+                lines.append(f"# {metric.name} 采集失败: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+# ============================
+# 进程级指标
+# ============================
+registry = MetricsRegistry()
+
+stage_seconds = registry.register(Histogram(
+    "vision_stage_seconds", "各处理阶段耗时（秒）", ("stage", "identifyType")))
+type_results = registry.register(Counter(
+    "vision_type_results_total", "各识别类型的结果数", ("identifyType", "status")))
+
+
+def metric_type(identify_type) -> str:
+    """识别类型作为指标标签：只有已配置 Prompt 的类型作为标签值，
+    客户端传入的其他值（在校验之前就会被统计）归为 unknown，避免标签取值无限增长
+    """
+    return identify_type if isinstance(identify_type, str) and identify_type in PROMPT_MAP else UNKNOWN_TYPE
+
+
+def metric_types(task: Dict) -> List[str]:
+    """任务的识别类型列表作为指标标签（格式不合法或未配置的类型归为 unknown）"""
+    identify_types = task.get("identifyType") if isinstance(task, dict) else None
+    if not isinstance(identify_types, list) or not identify_types:
+        return [UNKNOWN_TYPE]
+    return [metric_type(t) for t in identify_types]
+
+
+def observe_stage(stage: str, seconds: float, identify_types: Optional[Iterable[str]]) -> None:
+    """记录一个阶段耗时；按图片执行的阶段对该图片的每个识别类型各记一次"""
+    for identify_type in identify_types or [UNKNOWN_TYPE]:
+        stage_seconds.observe(seconds, stage, metric_type(identify_type))
+
+
+def record_result(result: Dict, identify_types: Iterable[str]) -> None:
+    """按识别类型记录一张图片的处理结果（整张图片失败时所有类型都记失败）"""
+    if result.get("status") != "success":
+        for identify_type in identify_types:
+            type_results.inc(metric_type(identify_type), "failed")
+        return
+    for item in result.get("judgmentInfo") or []:
+        type_results.inc(metric_type(item.get("identifyType")), "success")
@@ -0,0 +1,236 @@
+# model/backend_pool.py
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================
+# 1. 后端配置
+# ==============================
+# 模型服务实例列表（逗号分隔的 chat/completions 地址），或 JSON 文件：["url", ...] / [{"url": ..., "weight": 2}, ...]
+MODEL_BACKENDS = os.environ.get("MODEL_BACKENDS", "")
+MODEL_BACKENDS_FILE = os.environ.get("MODEL_BACKENDS_FILE", "")
+# 路由策略：least_outstanding（在途请求最少）或 latency（在途数 × 平滑延迟 最小）
+BACKEND_ROUTING = os.environ.get("BACKEND_ROUTING", "least_outstanding")
+# 同一图片优先路由到同一实例（保持前缀缓存），该实例在途数比最空闲实例多出此值时放弃亲和
+BACKEND_AFFINITY = os.environ.get("BACKEND_AFFINITY", "1") == "1"
+BACKEND_AFFINITY_SLACK = int(os.environ.get("BACKEND_AFFINITY_SLACK", 4))
+# 健康探测
+BACKEND_HEALTH_PATH = os.environ.get("BACKEND_HEALTH_PATH", "/health")
+BACKEND_HEALTH_INTERVAL = float(os.environ.get("BACKEND_HEALTH_INTERVAL", 10))
+BACKEND_HEALTH_TIMEOUT = float(os.environ.get("BACKEND_HEALTH_TIMEOUT", 3))
+# 熔断：连续失败次数达到阈值后摘除实例，冷却期后放行一个试探请求，再失败则冷却期加倍
+BACKEND_FAILURE_THRESHOLD = int(os.environ.get("BACKEND_FAILURE_THRESHOLD", 5))
+BACKEND_EJECT_SECONDS = float(os.environ.get("BACKEND_EJECT_SECONDS", 30))
+BACKEND_EJECT_MAX_SECONDS = float(os.environ.get("BACKEND_EJECT_MAX_SECONDS", 300))
+# 延迟平滑系数
+BACKEND_LATENCY_ALPHA = 0.2
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+def load_backend_config(default_url: str) -> List[Dict]:
+    """读取后端配置，未配置时只有 default_url 一个实例"""
+    if MODEL_BACKENDS_FILE:
+        with open(MODEL_BACKENDS_FILE, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    elif MODEL_BACKENDS:
+        entries = [u.strip() for u in MODEL_BACKENDS.split(",") if u.strip()]
+    else:
+        entries = [default_url]
+    return [e if isinstance(e, dict) else {"url": e} for e in entries]
+
+
+# ==============================
+# 2. 单个后端实例
+# ==============================
+class Backend:
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        parts = urlsplit(url)
+        self.health_url = f"{parts.scheme}://{parts.netloc}{BACKEND_HEALTH_PATH}"
+        self.weight = max(float(weight), 0.01)
+        self.in_flight = 0
+        self.latency = None  # 成功请求的平滑延迟（秒）
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.circuit = CIRCUIT_CLOSED
+        self.open_until = 0.0
+        self.eject_seconds = BACKEND_EJECT_SECONDS
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.circuit == CIRCUIT_OPEN:
+            if now < self.open_until:
+                return False
+            self.circuit = CIRCUIT_HALF_OPEN
+        if self.circuit == CIRCUIT_HALF_OPEN:
+            # 半开状态只放行一个试探请求
+            return not self.trial_in_flight
+        return True
+
+    def score(self) -> float:
+        load = (self.in_flight + 1) / self.weight
+        if BACKEND_ROUTING == "latency" and self.latency is not None:
+            return load * self.latency
+        return load
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "healthy": self.healthy,
+            "circuit": self.circuit,
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class BackendCall:
+    """一次路由结果，调用方在请求失败（连接错误 / 超时 / 5xx）时设置 failed"""
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.failed = False
+        self.cancelled = False
+
+
+# ==============================
+# 3. 后端池
+# ==============================
+class BackendPool:
+    """多模型实例路由
+
+    - 在途请求最少（按权重）或延迟加权选择实例
+    - 同一图片按一致性哈希优先固定到同一实例，负载偏差过大时放弃亲和
+    - 健康探测失败的实例不参与路由；连续失败的实例熔断摘除，冷却后半开试探
+    - 所有实例都不可用时仍选择其中负载最低的实例（不整体拒绝）
+    """
+
+    def __init__(self, backends: List[Dict]):
+        self.backends = [Backend(b["url"], b.get("weight", 1.0)) for b in backends]
+        self.affinity_hits = 0
+        self.fallbacks = 0
+
+    def _rendezvous(self, key: str, candidates: List[Backend]) -> Backend:
+        return max(candidates, key=lambda b: hashlib.md5(f"{b.url}|{key}".encode()).digest())
+
+    def select(self, affinity_key: Optional[str] = None, exclude=()) -> Backend:
+        now = time.monotonic()
+        remaining = [b for b in self.backends if b not in exclude] or self.backends
+        candidates = [b for b in remaining if b.available(now)]
+        if not candidates:
+            self.fallbacks += 1
+            candidates = remaining
+        best = min(candidates, key=Backend.score)
+        if BACKEND_AFFINITY and affinity_key and len(candidates) > 1:
+            preferred = self._rendezvous(affinity_key, candidates)
+            if preferred.in_flight <= best.in_flight + BACKEND_AFFINITY_SLACK:
+                self.affinity_hits += 1
+                return preferred
+        return best
+
+    def can_retry(self, tried) -> bool:
+        """还有未尝试过的实例（连接失败时换实例重试）"""
+        return len(tried) < len(self.backends)
+
+    @contextmanager
+    def route(self, affinity_key: Optional[str] = None, exclude=()):
+        """选择实例并统计在途数、延迟与失败，yield BackendCall；exclude 为本次请求已连接失败的实例"""
+        backend = self.select(affinity_key, exclude)
+        if backend.circuit == CIRCUIT_HALF_OPEN:
+            backend.trial_in_flight = True
+        call = BackendCall(backend)
+        backend.in_flight += 1
+        backend.requests += 1
+        start = time.monotonic()
+        try:
+            yield call
+        except asyncio.CancelledError:
+            # 调用方取消（如客户端断开）不算实例故障，也不计入延迟
+            call.cancelled = True
+            raise
+        finally:
+            backend.in_flight -= 1
+            self._record(backend, call, time.monotonic() - start)
+
+    def _record(self, backend: Backend, call: BackendCall, latency: float) -> None:
+        was_trial = backend.circuit == CIRCUIT_HALF_OPEN and backend.trial_in_flight
+        if was_trial:
+            backend.trial_in_flight = False
+        if call.cancelled:
+            return
+        if not call.failed:
+            backend.consecutive_failures = 0
+            backend.latency = latency if backend.latency is None else \
+                (1 - BACKEND_LATENCY_ALPHA) * backend.latency + BACKEND_LATENCY_ALPHA * latency
+            if was_trial:
+                backend.circuit = CIRCUIT_CLOSED
+                backend.eject_seconds = BACKEND_EJECT_SECONDS
+                logger.info(f"模型实例恢复: {backend.url}")
+            return
+
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if was_trial:
+            backend.eject_seconds = min(backend.eject_seconds * 2, BACKEND_EJECT_MAX_SECONDS)
+            self._eject(backend)
+        elif backend.circuit == CIRCUIT_CLOSED and backend.consecutive_failures >= BACKEND_FAILURE_THRESHOLD:
+            self._eject(backend)
+
+    def _eject(self, backend: Backend) -> None:
+        backend.circuit = CIRCUIT_OPEN
+        backend.open_until = time.monotonic() + backend.eject_seconds
+        backend.ejections += 1
+        logger.warning(f"模型实例熔断摘除 {backend.eject_seconds:.0f}s: {backend.url}"
+                       f"（连续失败 {backend.consecutive_failures} 次）")
+
+    # ---------- 健康探测 ----------
+    async def probe_once(self, client) -> None:
+        async def probe(backend: Backend):
+            try:
+                resp = await client.get(backend.health_url, timeout=BACKEND_HEALTH_TIMEOUT)
+                healthy = resp.status_code == 200
+            except Exception:
+                healthy = False
+            if healthy != backend.healthy:
+                logger.warning(f"模型实例健康状态变化: {backend.url} -> {'healthy' if healthy else 'unhealthy'}")
+            backend.healthy = healthy
+
+        await asyncio.gather(*(probe(b) for b in self.backends))
+
+    async def health_loop(self, client, interval: float = BACKEND_HEALTH_INTERVAL) -> None:
+        while True:
+            try:
+                await self.probe_once(client)
+            except Exception as e:
+                logger.error(f"模型实例健康探测出错: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict:
+        return {
+            "routing": BACKEND_ROUTING,
+            "affinity": BACKEND_AFFINITY,
+            "affinity_hits": self.affinity_hits,
+            "fallbacks": self.fallbacks,
+            "backends": [b.stats() for b in self.backends],
+        }
@@ -0,0 +1,92 @@
+# model/image_cache.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+# ==============================
+# 1. 缓存配置
+# ==============================
+# 预处理缓存字节上限（默认256MB，按base64字符串长度计算）
+PREPROCESS_CACHE_MAX_BYTES = int(os.environ.get("PREPROCESS_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# 预处理缓存条目上限
+PREPROCESS_CACHE_MAX_ENTRIES = int(os.environ.get("PREPROCESS_CACHE_MAX_ENTRIES", 512))
+
+
+# ==============================
+# 2. LRU 预处理缓存
+# ==============================
+class PreprocessCache:
+    """图片预处理结果缓存（LRU淘汰 + 字节预算）
+
+    键为 (绝对路径, mtime, 文件大小, 目标分辨率, 压缩质量)，
+    文件被覆盖或修改后mtime/大小变化，旧条目自然失效。
+    """
+
+    def __init__(self, max_bytes: int = PREPROCESS_CACHE_MAX_BYTES,
+                 max_entries: int = PREPROCESS_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image_path: str, target_max_size: Tuple[int, int], quality: int) -> Tuple:
+        st = os.stat(image_path)
+        return (os.path.abspath(image_path), st.st_mtime_ns, st.st_size,
+                tuple(target_max_size), quality)
+
+    def get(self, key: Tuple) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Tuple, value: str) -> None:
+        size = len(value)
+        # 单张图片超过总预算时不缓存
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._data[key] = value
+            self.current_bytes += size
+            while self._data and (self.current_bytes > self.max_bytes
+                                  or len(self._data) > self.max_entries):
+                _, evicted = self._data.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 进程级共享缓存
+preprocess_cache = PreprocessCache()
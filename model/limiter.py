@@ -0,0 +1,190 @@
+# model/limiter.py
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+# ==============================
+# 1. 限流配置
+# ==============================
+# 服务进程数（与 server.py 的 API_WORKERS 相同）：每个进程各有一个限制器，
+# 下列并发配置为全部进程合计的值，按进程数平分，模型服务看到的总并发不超过 MODEL_CONCURRENCY_MAX
+API_WORKERS = max(1, int(os.environ.get("API_WORKERS", 1)))
+MODEL_CONCURRENCY_INITIAL = int(os.environ.get("MODEL_CONCURRENCY_INITIAL", 8))
+MODEL_CONCURRENCY_MIN = int(os.environ.get("MODEL_CONCURRENCY_MIN", 1))
+MODEL_CONCURRENCY_MAX = int(os.environ.get("MODEL_CONCURRENCY_MAX", 32))
+
+
+def per_process(total: int, workers: int = API_WORKERS) -> int:
+    """全部进程合计的数量平分到每个进程（至少为 1）"""
+    return max(1, total // workers)
+
+# 平滑延迟超过基线延迟的倍数时视为过载
+MODEL_LATENCY_TOLERANCE = float(os.environ.get("MODEL_LATENCY_TOLERANCE", 2.5))
+# 过载时并发上限的乘性收缩系数
+MODEL_BACKOFF_RATIO = float(os.environ.get("MODEL_BACKOFF_RATIO", 0.7))
+
+OUTCOME_SUCCESS = "success"    # 正常返回，参与延迟统计
+OUTCOME_OVERLOAD = "overload"  # 超时 / 429 / 503，触发收缩
+OUTCOME_IGNORE = "ignore"      # 与负载无关的错误或被取消，不参与调整
+
+# 调用类别：输出长度差异很大（仅判定只有几十个 token），延迟基线按类别分别统计
+CALL_VERDICT = "verdict"  # 仅判定模式
+CALL_SINGLE = "single"    # 单类型完整回答
+CALL_MULTI = "multi"      # 多问题合并回答
+
+
+def call_class(verdict_only: bool, multi_question: bool = False) -> str:
+    """请求的调用类别"""
+    if verdict_only:
+        return CALL_VERDICT
+    return CALL_MULTI if multi_question else CALL_SINGLE
+
+
+class LimiterSample:
+    """一次请求的限流样本，调用方在请求结束前设置 outcome"""
+
+    def __init__(self, call_class: str = CALL_SINGLE):
+        self.start = time.monotonic()
+        self.outcome = OUTCOME_SUCCESS
+        self.call_class = call_class
+
+
+# ==============================
+# 2. AIMD 自适应并发限制器
+# ==============================
+class AdaptiveLimiter:
+    """进程级模型服务并发限制器（AIMD + 延迟梯度）
+
+    - 成功且延迟正常：并发上限加性增长（每满一个窗口 +1）
+    - 超时 / 429 / 503 或平滑延迟超过基线 tolerance 倍：乘性收缩
+    - 延迟基线与平滑延迟按调用类别分别统计，快速的仅判定调用不会把完整回答的正常延迟判为过载
+    - 收缩后，收缩前已发出的请求不再重复触发收缩，避免一次拥塞把上限打到底
+    """
+
+    def __init__(self, initial: int = per_process(MODEL_CONCURRENCY_INITIAL),
+                 min_limit: int = MODEL_CONCURRENCY_MIN,
+                 max_limit: int = per_process(MODEL_CONCURRENCY_MAX),
+                 latency_tolerance: float = MODEL_LATENCY_TOLERANCE,
+                 backoff_ratio: float = MODEL_BACKOFF_RATIO):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        # 调用类别 -> 基线延迟 / 平滑延迟
+        self._baseline_latency: Dict[str, float] = {}
+        self._smoothed_latency: Dict[str, float] = {}
+
+        self.successes = 0
+        self.overloads = 0
+        self.decreases = 0
+
+    # ---------- 获取/释放 ----------
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 已被唤醒但调用方取消，需归还名额
+            if fut.done() and not fut.cancelled():
+                self.in_flight -= 1
+                self._wake_waiters()
+            else:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self, sample: LimiterSample) -> None:
+        self.in_flight -= 1
+        latency = time.monotonic() - sample.start
+        if sample.outcome == OUTCOME_OVERLOAD:
+            self.overloads += 1
+            self._decrease(sample)
+        elif sample.outcome == OUTCOME_SUCCESS:
+            self.successes += 1
+            self._on_success(sample, latency)
+        self._wake_waiters()
+
+    @asynccontextmanager
+    async def slot(self, call_class: str = CALL_SINGLE):
+        """async with limiter.slot(call_class) as sample: ... 的便捷写法"""
+        await self.acquire()
+        sample = LimiterSample(call_class)
+        try:
+            yield sample
+        except asyncio.CancelledError:
+            sample.outcome = OUTCOME_IGNORE
+            raise
+        finally:
+            self.release(sample)
+
+    # ---------- 调整逻辑 ----------
+    def _on_success(self, sample: LimiterSample, latency: float) -> None:
+        cls = sample.call_class
+        baseline = self._baseline_latency.get(cls)
+        if baseline is None or latency < baseline:
+            baseline = latency
+        else:
+            # 基线缓慢上浮，适应模型/提示词变化
+            baseline *= 1.001
+        self._baseline_latency[cls] = baseline
+        smoothed = self._smoothed_latency.get(cls)
+        smoothed = latency if smoothed is None else 0.9 * smoothed + 0.1 * latency
+        self._smoothed_latency[cls] = smoothed
+
+        if smoothed > baseline * self.latency_tolerance:
+            self._decrease(sample)
+            return
+        # 只有并发真正被用满时才增长，避免空闲时上限无意义膨胀
+        if self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def _decrease(self, sample: LimiterSample) -> None:
+        if sample.start < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        self.decreases += 1
+        # 收缩后重置平滑延迟，从新的并发水平重新观测
+        self._smoothed_latency.clear()
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+
+    def stats(self) -> Dict:
+        return {
+            "limit": round(self.limit, 2),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "baseline_latency": {cls: round(v, 3) for cls, v in self._baseline_latency.items()},
+            "smoothed_latency": {cls: round(v, 3) for cls, v in self._smoothed_latency.items()},
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "decreases": self.decreases,
+        }
+
+
+# 进程级共享限制器：异步队列、同步接口及重试请求都经由它访问模型服务；
+# 多进程部署时上限为 MODEL_CONCURRENCY_MAX / API_WORKERS
+model_limiter = AdaptiveLimiter()
@@ -1,70 +1,496 @@
-import requests
+import os
+import json
+import hashlib
 import base64
 import time
+import asyncio
+import httpx
 from pathlib import Path
+from urllib.parse import urlparse, unquote
 from PIL import Image
 import io
 
-def compress_image(image_path, quality=80):
+try:
+    from model.limiter import model_limiter, call_class, CALL_SINGLE, OUTCOME_OVERLOAD, OUTCOME_IGNORE
+    from model.stream_parser import VerdictStreamParser, stream_stats, SHAPE_ARRAY, SHAPE_OBJECT
+    from model.backend_pool import BackendPool, load_backend_config, BACKEND_HEALTH_INTERVAL
+except ImportError:  # 直接运行 model/model.py 时
+    from limiter import model_limiter, call_class, CALL_SINGLE, OUTCOME_OVERLOAD, OUTCOME_IGNORE
+    from stream_parser import VerdictStreamParser, stream_stats, SHAPE_ARRAY, SHAPE_OBJECT
+    from backend_pool import BackendPool, load_backend_config, BACKEND_HEALTH_INTERVAL
+
+# 1K标准分辨率（宽×高，主流为1920×1080，即全高清FHD）
+TARGET_MAX_SIZE = (1920, 1080)
+JPEG_QUALITY = 80
+# JPEG 解码时利用 libjpeg DCT 缩放直接解码到不小于目标尺寸的最近档位（1/2、1/4、1/8）
+JPEG_DRAFT_DECODE = os.environ.get("JPEG_DRAFT_DECODE", "1") == "1"
+# 已是目标分辨率以内的 JPEG 不再解码重编码，直接使用原始字节
+JPEG_PASSTHROUGH = os.environ.get("JPEG_PASSTHROUGH", "1") == "1"
+# 直通的文件大小上限（字节），高质量大文件仍重编码为 JPEG_QUALITY 以控制请求体积
+JPEG_PASSTHROUGH_MAX_BYTES = int(os.environ.get("JPEG_PASSTHROUGH_MAX_BYTES", 1536 * 1024))
+
+# 图片传输方式：
+#   base64：请求体内联 data URL（默认，兼容任意部署）
+#   file：按 file:// 路径引用，模型服务与本服务同机或共享存储（vLLM 需 --allowed-local-media-path 放行该目录）
+#   url：按 HTTP 地址引用，由模型服务从本服务的 /vision_engine/images/ 拉取
+MODEL_IMAGE_TRANSPORT = os.environ.get("MODEL_IMAGE_TRANSPORT", "base64")
+# file / url 方式下预处理后图片的存放目录（按内容命名）
+MODEL_IMAGE_SHARE_DIR = os.environ.get("MODEL_IMAGE_SHARE_DIR", "./shared_images")
+# url 方式下图片地址前缀，需为模型服务可访问的本服务地址
+MODEL_IMAGE_URL_BASE = os.environ.get("MODEL_IMAGE_URL_BASE", "http://127.0.0.1:5000/vision_engine/images/")
+# 共享目录中图片的保留时间（秒），超时未被使用的文件定期清理
+MODEL_IMAGE_SHARE_TTL = float(os.environ.get("MODEL_IMAGE_SHARE_TTL", 3600))
+
+# 模型服务配置（OpenAI兼容接口）；多实例部署通过 MODEL_BACKENDS / MODEL_BACKENDS_FILE 配置，未配置时只用 MODEL_URL
+MODEL_URL = os.environ.get("MODEL_URL", "http://localhost:5001/v1/chat/completions")
+MODEL_NAME = os.environ.get("MODEL_NAME", "/home/hr/Zzyq/model/Awaker")
+MODEL_TEMPERATURE = 0.1
+MODEL_MAX_TOKENS = 1024
+MODEL_TIMEOUT = 60
+# 异步客户端连接池上限，不应小于限流器的最大并发（实际并发由 model_limiter 自适应控制）
+MODEL_MAX_CONNECTIONS = max(int(os.environ.get("MODEL_MAX_CONNECTIONS", 32)), model_limiter.max_limit)
+# 视为模型服务过载的状态码
+OVERLOAD_STATUS_CODES = (429, 503)
+# 请求布局：image_first（系统前导 → 图片 → 识别问题，同一图片的多个问题共享前缀，可命中服务端前缀缓存）
+# 或 text_first（旧版：问题 → 图片）
+MODEL_PROMPT_LAYOUT = os.environ.get("MODEL_PROMPT_LAYOUT", "image_first")
+# 所有请求共用的系统前导，保持不变才能作为前缀缓存的公共部分
+MODEL_SYSTEM_PREAMBLE = os.environ.get(
+    "MODEL_SYSTEM_PREAMBLE",
+    "你是城市巡检图像分析助手。请仔细观察用户提供的图片，根据随后的识别问题作出判断，并严格按照问题要求的格式返回。"
+)
+# 仅判定模式（不生成描述）：结构化输出参数形式，response_format（OpenAI json_schema）/ guided_json（vLLM）/ none（仅靠Prompt约束）
+MODEL_STRUCTURED_OUTPUT = os.environ.get("MODEL_STRUCTURED_OUTPUT", "response_format")
+# 仅判定模式下单个识别类型的 token 预算，{"状态": "不存在"} 约十余个 token
+VERDICT_MAX_TOKENS_PER_TYPE = int(os.environ.get("VERDICT_MAX_TOKENS_PER_TYPE", 24))
+VERDICT_VALUES = ["存在", "不存在"]
+# 流式解码：判定JSON一闭合即关闭流，模型服务随之停止生成后续无用的 token
+MODEL_STREAM_EARLY_STOP = os.environ.get("MODEL_STREAM_EARLY_STOP", "0") == "1"
+
+# 模型实例池（进程级）：路由、在途统计、熔断
+backend_pool = BackendPool(load_backend_config(MODEL_URL))
+
+
+def compress_image(image_path, quality=JPEG_QUALITY):
     """将图片压缩至1K分辨率（最大1920×1080）并返回base64编码"""
-    # 1K标准分辨率（宽×高，主流为1920×1080，即全高清FHD）
-    target_max_size = (1920, 1080)
-    
+    return compress_image_timed(image_path, quality)[0]
+
+
+def fit_size(size, target_max_size):
+    """按比例缩放到 target_max_size 以内后的尺寸（与 thumbnail 结果一致，不放大）"""
+    width, height = size
+    ratio = min(target_max_size[0] / width, target_max_size[1] / height)
+    if ratio >= 1:
+        return size
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def passthrough_eligible(img, image_path, target_max_size=TARGET_MAX_SIZE) -> bool:
+    """原图可直接发送：JPEG、RGB/灰度、不超过目标分辨率且文件不过大"""
+    return (img.format == "JPEG" and img.mode in ("RGB", "L")
+            and fit_size(img.size, target_max_size) == img.size
+            and os.path.getsize(image_path) <= JPEG_PASSTHROUGH_MAX_BYTES)
+
+
+def jpeg_bytes_timed(image_path, quality=JPEG_QUALITY, draft_decode=None, passthrough=None):
+    """预处理为1K以内的JPEG字节，返回 (JPEG字节, 各阶段耗时秒数, 是否直通原文件)"""
+    target_max_size = TARGET_MAX_SIZE
+    if draft_decode is None:
+        draft_decode = JPEG_DRAFT_DECODE
+    if passthrough is None:
+        passthrough = JPEG_PASSTHROUGH
+    timings = {}
+
+    t0 = time.perf_counter()
     with Image.open(image_path) as img:
+        if passthrough and passthrough_eligible(img, image_path, target_max_size):
+            # 只读取了文件头，原始字节即为最终结果
+            t1 = time.perf_counter()
+            timings["decode"] = t1 - t0
+            timings["resize"] = 0.0
+            with open(image_path, "rb") as f:
+                data = f.read()
+            timings["encode"] = time.perf_counter() - t1
+            return data, timings, True
+
+        if draft_decode and img.format == "JPEG":
+            # 快速路径：直接以不小于最终尺寸的最近DCT档位解码，12MP原图只需解码约1/4像素
+            img.draft(None, fit_size(img.size, target_max_size))
+        else:
+            # 完整解码路径（非JPEG或关闭快速路径），与 thumbnail 默认 reducing_gap=2 行为一致
+            img.draft(None, (target_max_size[0] * 2, target_max_size[1] * 2))
+        img.load()
+        t1 = time.perf_counter()
+        timings["decode"] = t1 - t0
+
         # 转换图片模式（兼容JPEG格式）
         if img.mode in ('RGBA', 'P'):
             img = img.convert('RGB')
         
         # 按比例缩放至1K以内（保持宽高比，避免拉伸）
         img.thumbnail(target_max_size)
+        t2 = time.perf_counter()
+        timings["resize"] = t2 - t1
         
         # 保存到字节流
         buffer = io.BytesIO()
         img.save(buffer, format="JPEG", quality=quality)
-        
-        # 编码为base64字符串
-        return base64.b64encode(buffer.getvalue()).decode()
+        timings["encode"] = time.perf_counter() - t2
+        return buffer.getvalue(), timings, False
+
+
+def compress_image_timed(image_path, quality=JPEG_QUALITY, draft_decode=None, passthrough=None):
+    """compress_image 的计时版本，返回 (base64编码, 各阶段耗时秒数)"""
+    data, timings, _ = jpeg_bytes_timed(image_path, quality, draft_decode, passthrough)
+    t0 = time.perf_counter()
+    # 编码为base64字符串
+    b64_image = base64.b64encode(data).decode()
+    timings["base64"] = time.perf_counter() - t0
+    return b64_image, timings
+
+
+# ==============================
+# 图片引用（file / url 传输方式）
+# ==============================
+def is_image_reference(image: str) -> bool:
+    """预处理结果是 file:// / http(s):// 地址，而不是 base64 编码"""
+    return image.startswith(("file://", "http://", "https://"))
+
+
+def image_url(image: str) -> str:
+    """请求体中 image_url.url 的值"""
+    return image if is_image_reference(image) else f"data:image/jpeg;base64,{image}"
 
-def run_inference(image_path: str, question: str) -> str:
+
+def write_shared_image(data: bytes) -> str:
+    """按内容命名写入共享目录（已存在则只刷新修改时间），返回文件名"""
+    name = hashlib.sha256(data).hexdigest()[:32] + ".jpg"
+    path = os.path.join(MODEL_IMAGE_SHARE_DIR, name)
+    if os.path.exists(path):
+        os.utime(path)
+        return name
+    os.makedirs(MODEL_IMAGE_SHARE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return name
+
+
+def shared_image_path(name: str) -> str:
+    """共享目录中的图片路径（只取文件名部分，防止越界访问）"""
+    return os.path.join(MODEL_IMAGE_SHARE_DIR, os.path.basename(name))
+
+
+def refresh_image_reference(image: str, url_base: str = None) -> bool:
+    """缓存中的图片引用是否仍可用：共享目录中的文件可能已被清理，存在时刷新其保留时间"""
+    if not is_image_reference(image):
+        return True
+    url_base = (url_base or MODEL_IMAGE_URL_BASE).rstrip("/") + "/"
+    if image.startswith("file://"):
+        path = unquote(urlparse(image).path)
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(MODEL_IMAGE_SHARE_DIR):
+            # 直通的原图路径，缓存键已包含其修改时间和大小
+            return True
+    elif image.startswith(url_base):
+        path = shared_image_path(image[len(url_base):])
+    else:
+        return True
     try:
-        # 关键：压缩图片后再编码
-        b64_image = compress_image(image_path)
-    except Exception as e:
-        return f"图片处理出错: {e}"
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def prune_shared_images(ttl: float = MODEL_IMAGE_SHARE_TTL) -> int:
+    """删除共享目录中超过保留时间未被使用的图片，返回删除数"""
+    if not os.path.isdir(MODEL_IMAGE_SHARE_DIR):
+        return 0
+    deadline = time.time() - ttl
+    removed = 0
+    for entry in os.scandir(MODEL_IMAGE_SHARE_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
 
-    # 构建请求数据（使用OpenAI兼容格式）
-    url = "http://localhost:5001/v1/chat/completions"
+
+def prepare_image_timed(image_path, quality=JPEG_QUALITY, transport=None, passthrough=None, url_base=None,
+                        reference_original=True):
+    """按传输方式预处理图片，返回 (图片, 各阶段耗时秒数)
+    base64 方式为 base64 编码；file / url 方式为模型服务可访问的地址（写共享目录的耗时记在 base64 阶段）
+    reference_original 为 False 时（如远程图片的暂存文件，用完即删）file 方式下直通的原图也写入共享目录
+    """
+    transport = transport or MODEL_IMAGE_TRANSPORT
+    if transport == "base64":
+        return compress_image_timed(image_path, quality, passthrough=passthrough)
+    data, timings, passed = jpeg_bytes_timed(image_path, quality, passthrough=passthrough)
+    t0 = time.perf_counter()
+    if transport == "file" and passed and reference_original:
+        # 原图即可直接使用，模型服务按原路径读取（需能访问同一存储）
+        image = Path(image_path).resolve().as_uri()
+    elif transport == "file":
+        image = Path(shared_image_path(write_shared_image(data))).resolve().as_uri()
+    else:
+        image = (url_base or MODEL_IMAGE_URL_BASE).rstrip("/") + "/" + write_shared_image(data)
+    timings["base64"] = time.perf_counter() - t0
+    return image, timings
+
+
+def model_params_signature(verdict_only: bool = False, merged: bool = False, instruction: str = "") -> str:
+    """影响模型输出的参数签名，用于结果缓存键（仅判定模式的结果不含描述，单独缓存）
+    merged 为多问题合并提问产生的结果；instruction 为 Prompt 之外追加的提示文本（按哈希计入）
+    """
+    params = {
+        "model": MODEL_NAME,
+        "temperature": MODEL_TEMPERATURE,
+        "max_tokens": MODEL_MAX_TOKENS,
+    }
+    if MODEL_PROMPT_LAYOUT != "text_first":
+        # 布局与系统前导会影响输出，与旧版布局的缓存结果区分
+        params.update({"layout": MODEL_PROMPT_LAYOUT, "preamble": MODEL_SYSTEM_PREAMBLE})
+    if verdict_only:
+        params.update({"verdict_only": True, "structured_output": MODEL_STRUCTURED_OUTPUT,
+                       "verdict_max_tokens": VERDICT_MAX_TOKENS_PER_TYPE})
+    if merged:
+        params["multi_question"] = True
+    if instruction:
+        params["instruction"] = hashlib.sha256(instruction.encode("utf-8")).hexdigest()[:16]
+    return json.dumps(params, sort_keys=True)
+
+
+def build_verdict_schema(identify_types=None) -> dict:
+    """仅判定模式的 JSON Schema：单类型为 {"状态": ...}，多问题合并为 {"类型": {"状态": ...}, ...}"""
+    verdict = {
+        "type": "object",
+        "properties": {"状态": {"type": "string", "enum": VERDICT_VALUES}},
+        "required": ["状态"],
+        "additionalProperties": False,
+    }
+    if not identify_types:
+        return verdict
+    return {
+        "type": "object",
+        "properties": {t: verdict for t in identify_types},
+        "required": list(identify_types),
+        "additionalProperties": False,
+    }
+
+
+def apply_verdict_only(data: dict, identify_types=None) -> dict:
+    """将请求体改为仅判定模式：结构化输出约束 + 按 Schema 大小收紧 max_tokens"""
+    schema = build_verdict_schema(identify_types)
+    if MODEL_STRUCTURED_OUTPUT == "response_format":
+        data["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "verdict", "schema": schema, "strict": True},
+        }
+    elif MODEL_STRUCTURED_OUTPUT == "guided_json":
+        data["guided_json"] = schema
+    data["max_tokens"] = VERDICT_MAX_TOKENS_PER_TYPE * max(1, len(identify_types or ()))
+    return data
+
+
+def build_messages(question: str, b64_image: str, layout: str = None) -> list:
+    """构建 messages；image_first 布局把不变的系统前导和图片放在前面，识别问题放在最后"""
+    layout = layout or MODEL_PROMPT_LAYOUT
+    image_part = {"type": "image_url", "image_url": {"url": image_url(b64_image)}}
+    text_part = {"type": "text", "text": question}
+    if layout == "text_first":
+        return [{"role": "user", "content": [text_part, image_part]}]
+    messages = []
+    if MODEL_SYSTEM_PREAMBLE:
+        messages.append({"role": "system", "content": MODEL_SYSTEM_PREAMBLE})
+    messages.append({"role": "user", "content": [image_part, text_part]})
+    return messages
+
+
+def build_request_data(question: str, b64_image: str, verdict_only: bool = False,
+                       identify_types=None) -> dict:
+    """构建 chat/completions 请求体；verdict_only 时 identify_types 为多问题合并的类型列表（单类型为 None）"""
     data = {
-        "model": "/home/hr/Zzyq/model/Awaker",
+        "model": MODEL_NAME,
         # "model": "Awaker",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": question},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64_image}"}}
-                ]
-            }
-        ],
-        "temperature": 0.1,
-        "max_tokens": 1024
+        "messages": build_messages(question, b64_image),
+        "temperature": MODEL_TEMPERATURE,
+        "max_tokens": MODEL_MAX_TOKENS
     }
+    if verdict_only:
+        apply_verdict_only(data, identify_types)
+    return data
+
+
+# ==============================
+# 异步推理客户端（共享连接池）
+# ==============================
+class AsyncInferenceClient:
+    """基于长连接池 httpx.AsyncClient 的异步推理客户端，由服务 lifespan 创建和关闭"""
+
+    def __init__(self, pool: BackendPool = backend_pool, timeout: float = MODEL_TIMEOUT,
+                 max_connections: int = MODEL_MAX_CONNECTIONS):
+        self.pool = pool
+        self._client = httpx.AsyncClient(
+            # pool=None：连接池占满时排队等待，而不是抛出 PoolTimeout
+            timeout=httpx.Timeout(timeout, pool=None),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self._health_task = None
+        if BACKEND_HEALTH_INTERVAL > 0:
+            try:
+                self._health_task = asyncio.get_running_loop().create_task(self.pool.health_loop(self._client))
+            except RuntimeError:  # 不在事件循环中创建（如同步脚本），不做健康探测
+                pass
+
+    async def infer(self, question: str, b64_image: str, verdict_only: bool = False,
+                    identify_types=None, affinity_key: str = None, timings: dict = None,
+                    limiter_class: str = CALL_SINGLE) -> str:
+        """异步推理，出错时返回错误信息字符串（不抛出异常）；limiter_class 为限流器的调用类别"""
+        data = build_request_data(question, b64_image, verdict_only, identify_types)
+        async with model_limiter.slot(limiter_class) as sample:
+            try:
+                tried = set()
+                while True:
+                    with self.pool.route(affinity_key, tried) as call:
+                        try:
+                            resp = await self._client.post(call.backend.url, json=data)
+                        except httpx.TransportError as e:
+                            call.failed = True
+                            tried.add(call.backend)
+                            # 连接失败说明请求未送达，换一个实例重试
+                            if isinstance(e, httpx.ConnectError) and self.pool.can_retry(tried):
+                                continue
+                            raise
+                        call.failed = resp.status_code >= 500
+                        if resp.status_code in OVERLOAD_STATUS_CODES:
+                            sample.outcome = OUTCOME_OVERLOAD
+                        if timings is not None:
+                            timings["model_http"] = time.monotonic() - sample.start
+                        resp.raise_for_status()
+                    return resp.json()["choices"][0]["message"]["content"]
+            except httpx.TimeoutException as e:
+                sample.outcome = OUTCOME_OVERLOAD
+                return f"推理出错: 请求超时 {e!r}"
+            except Exception as e:
+                if sample.outcome != OUTCOME_OVERLOAD:
+                    sample.outcome = OUTCOME_IGNORE
+                return f"推理出错: {e}\n{resp.text[:500] if 'resp' in locals() else ''}"
+
+    async def infer_stream(self, question: str, b64_image: str, shape: str = SHAPE_ARRAY,
+                           verdict_only: bool = False, identify_types=None, affinity_key: str = None,
+                           timings: dict = None, limiter_class: str = CALL_SINGLE) -> str:
+        """流式推理：增量解析输出，判定JSON完整后立即关闭流，返回已收到的文本"""
+        data = build_request_data(question, b64_image, verdict_only, identify_types)
+        data["stream"] = True
+        parser = VerdictStreamParser(shape)
+        tokens = 0
+        async with model_limiter.slot(limiter_class) as sample:
+            try:
+                tried = set()
+                while True:
+                    with self.pool.route(affinity_key, tried) as call:
+                        try:
+                            async with self._client.stream("POST", call.backend.url, json=data) as resp:
+                                call.failed = resp.status_code >= 500
+                                if resp.status_code in OVERLOAD_STATUS_CODES:
+                                    sample.outcome = OUTCOME_OVERLOAD
+                                if resp.status_code >= 400:
+                                    # 读取错误响应体，供异常信息使用
+                                    await resp.aread()
+                                    resp.raise_for_status()
+                                async for line in resp.aiter_lines():
+                                    if not line.startswith("data:"):
+                                        continue
+                                    payload = line[5:].strip()
+                                    if payload == "[DONE]":
+                                        break
+                                    choices = json.loads(payload).get("choices") or []
+                                    content = (choices[0].get("delta") or {}).get("content") if choices else None
+                                    if not content:
+                                        continue
+                                    # OpenAI兼容服务端通常每个 chunk 输出一个 token
+                                    tokens += 1
+                                    if parser.feed(content):
+                                        break
+                        except httpx.TransportError as e:
+                            call.failed = True
+                            tried.add(call.backend)
+                            if isinstance(e, httpx.ConnectError) and self.pool.can_retry(tried):
+                                continue
+                            raise
+                    break
+                # 退出 stream 上下文即断开连接，服务端中止该请求的剩余生成
+                early_stop = parser.verdict is not None
+                elapsed = time.monotonic() - sample.start
+                stream_stats.record(tokens, data["max_tokens"], early_stop, elapsed)
+                if timings is not None:
+                    timings["model_http"] = elapsed
+                return parser.text
+            except httpx.TimeoutException as e:
+                sample.outcome = OUTCOME_OVERLOAD
+                return f"推理出错: 请求超时 {e!r}"
+            except Exception as e:
+                if sample.outcome != OUTCOME_OVERLOAD:
+                    sample.outcome = OUTCOME_IGNORE
+                return f"推理出错: {e}\n{e.response.text[:500] if isinstance(e, httpx.HTTPStatusError) else ''}"
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+        await self._client.aclose()
+
+
+_async_client = None
+
+
+def init_async_client() -> AsyncInferenceClient:
+    """创建进程级异步客户端（在 FastAPI lifespan 中调用）"""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncInferenceClient()
+    return _async_client
+
+
+async def close_async_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def run_inference_async(question: str, b64_image: str, shape: str = SHAPE_ARRAY,
+                              verdict_only: bool = False, identify_types=None,
+                              affinity_key: str = None, timings: dict = None) -> str:
+    """异步推理入口；未经 lifespan 初始化时（如脚本调用）按需创建客户端
+    shape 为期望的判定JSON形态（单类型数组 / 多问题合并对象），流式提前结束时使用；
+    verdict_only 时只生成判定（identify_types 为多问题合并的类型列表）；
+    affinity_key（通常为图片路径）相同的请求优先路由到同一模型实例，复用其前缀缓存；
+    传入 timings 字典时写入模型 HTTP 往返耗时 model_http（不含等待并发槽位的时间）
+    """
+    client = init_async_client()
+    # 多问题合并回答的形态为对象，其输出长度与单类型回答不同，限流器分别统计延迟基线
+    limiter_class = call_class(verdict_only, shape == SHAPE_OBJECT)
+    if MODEL_STREAM_EARLY_STOP:
+        # 仅判定模式的输出是 JSON 对象
+        shape = SHAPE_OBJECT if verdict_only else shape
+        return await client.infer_stream(question, b64_image, shape, verdict_only, identify_types, affinity_key,
+                                         timings, limiter_class)
+    return await client.infer(question, b64_image, verdict_only, identify_types, affinity_key, timings,
+                              limiter_class)
 
-    try:
-        # 发送请求并获取结果
-        resp = requests.post(url, json=data, timeout=60)
-        resp.raise_for_status()  # 触发HTTP错误（如400/500）
-        return resp.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        # 捕获并返回错误信息
-        return f"推理出错: {e}\n{resp.text[:500] if 'resp' in locals() else ''}"
 
 if __name__ == "__main__":
     t1 = time.time()
     # 测试：分析图片是否为道路路面
-    result = run_inference(
-        "/home/hr/Zzyq/img/DJI_20251017152549_0001_WIDE.jpg",
-        "请分析这张图片路面，是否存在严重的坑洼或坑槽。状态:存在或者不存在;描述:请描述你的理由和思考过程，必须按照如下格式返回:[{'状态':"",'描述':""}]"
-    )
+    result = asyncio.run(run_inference_async(
+        "请分析这张图片路面，是否存在严重的坑洼或坑槽。状态:存在或者不存在;描述:请描述你的理由和思考过程，必须按照如下格式返回:[{'状态':"",'描述':""}]",
+        compress_image("/home/hr/Zzyq/img/DJI_20251017152549_0001_WIDE.jpg")
+    ))
     print(result)
     print(f"耗时: {time.time() - t1:.2f}秒")
\ No newline at end of file
@@ -0,0 +1,187 @@
+# model/preprocess_pool.py
+import os
+import sys
+import time
+import asyncio
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict
+
+try:
+    from model import preprocess_worker
+    from model.image_cache import preprocess_cache
+    from model.limiter import per_process
+    from model.model import refresh_image_reference, TARGET_MAX_SIZE, JPEG_QUALITY
+except ImportError:  # 直接运行 model 目录下脚本时
+    import preprocess_worker
+    from image_cache import preprocess_cache
+    from limiter import per_process
+    from model import refresh_image_reference, TARGET_MAX_SIZE, JPEG_QUALITY
+
+
+# ==============================
+# 1. 进程池配置
+# ==============================
+# 预处理进程数（JPEG解码/缩放/编码为CPU密集操作，放到独立进程中绕开GIL）
+# 为本机全部服务进程合计的值，多进程部署（API_WORKERS>1）时按进程数平分，各服务进程各有一个进程池
+PREPROCESS_WORKERS = per_process(int(os.environ.get("PREPROCESS_WORKERS", max(1, (os.cpu_count() or 4) // 2))))
+
+PREPROCESS_STAGES = ("queue_wait", "decode", "resize", "encode", "base64", "total")
+
+
+@contextmanager
+def _worker_main():
+    """启动子进程期间把 __main__ 指向 preprocess_worker，子进程不再重新导入服务入口模块"""
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = preprocess_worker
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+# ==============================
+# 2. 常驻预处理进程池
+# ==============================
+class PreprocessPool:
+    """常驻图片预处理进程池，由服务 lifespan 创建和关闭
+
+    父进程先查 preprocess_cache，未命中才提交到子进程；
+    子进程返回编码结果和分阶段耗时，父进程负责写缓存和统计。
+    """
+
+    def __init__(self, workers: int = PREPROCESS_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        # 正在预处理中的图片，同一图片的并发请求共用一次计算
+        self._pending = {}
+        self._stage_stats = {stage: {"count": 0, "total": 0.0, "max": 0.0} for stage in PREPROCESS_STAGES}
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn：避免在已有事件循环/线程的进程中 fork
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def in_flight(self) -> int:
+        return self.submitted - self.completed - self.failed
+
+    @property
+    def queue_depth(self) -> int:
+        """已提交但尚未被子进程开始处理的任务数（估算）"""
+        return max(0, self.in_flight - self.workers)
+
+    async def get_image(self, image_path: str, quality: int = JPEG_QUALITY, timings: Dict = None,
+                        content_key: str = None) -> str:
+        """获取预处理后的图片（base64编码，或 file / url 传输方式下的图片地址），优先命中缓存
+        传入 timings 字典时，由本次调用实际完成预处理则写入各阶段耗时（命中缓存或合并在途计算时不写入）
+        content_key 为图片内容标识，用于远程图片的暂存文件：其路径每次下载都不同且用完即删，
+        缓存和在途合并按内容匹配，file 传输方式下也不引用暂存路径
+        """
+        if content_key is not None:
+            key = (content_key, tuple(TARGET_MAX_SIZE), quality)
+        else:
+            # stat 可能落在网络存储上，不在事件循环中执行
+            key = await asyncio.to_thread(preprocess_cache.make_key, image_path, TARGET_MAX_SIZE, quality)
+        cached = preprocess_cache.get(key)
+        if cached is not None and refresh_image_reference(cached):
+            return cached
+        pending = self._pending.get(key)
+        if pending is None:
+            # 预处理放在独立的任务中执行：发起者被取消只是不再等待结果，
+            # 进程池中的计算继续完成并写入缓存，等待同一图片的其他调用不受影响
+            pending = asyncio.ensure_future(
+                self._compute_and_cache(key, image_path, quality, timings, content_key is None))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda fut: self._on_pending_done(key, fut))
+        return await asyncio.shield(pending)
+
+    async def _compute_and_cache(self, key, image_path: str, quality: int, timings: Dict = None,
+                                 reference_original: bool = True) -> str:
+        b64_image = await self._compute(image_path, quality, timings, reference_original)
+        preprocess_cache.put(key, b64_image)
+        return b64_image
+
+    def _on_pending_done(self, key, fut: asyncio.Future) -> None:
+        if self._pending.get(key) is fut:
+            del self._pending[key]
+        if not fut.cancelled():
+            # 标记异常已被读取，避免所有调用方都已取消时打印 "Future exception was never retrieved"
+            fut.exception()
+
+    async def _compute(self, image_path: str, quality: int, timings_out: Dict = None,
+                       reference_original: bool = True) -> str:
+        self.start()
+        executor = self._executor
+        self.submitted += 1
+        start = time.perf_counter()
+        try:
+            # spawn 进程池按需在 submit 中启动子进程，提交期间切换 __main__（submit 为同步调用，不会与其他协程交错）
+            with _worker_main():
+                future = asyncio.get_running_loop().run_in_executor(
+                    executor, preprocess_worker.preprocess, image_path, quality, reference_original
+                )
+            b64_image, timings = await future
+        except BrokenProcessPool:
+            # 子进程异常退出（如OOM被杀）后进程池不可再用：关闭旧池回收其余子进程，下次提交时重建，
+            # 本次由调用方按失败处理（并发失败的调用可能已重建，只替换仍是旧池的引用）
+            self.failed += 1
+            executor.shutdown(wait=False, cancel_futures=True)
+            if self._executor is executor:
+                self._executor = None
+            raise
+        except BaseException:
+            self.failed += 1
+            raise
+        self.completed += 1
+
+        total = time.perf_counter() - start
+        timings["queue_wait"] = max(0.0, total - sum(timings.values()))
+        timings["total"] = total
+        for stage, seconds in timings.items():
+            self._record(stage, seconds)
+        if timings_out is not None:
+            timings_out.update(timings)
+        return b64_image
+
+    def _record(self, stage: str, seconds: float) -> None:
+        stat = self._stage_stats.setdefault(stage, {"count": 0, "total": 0.0, "max": 0.0})
+        stat["count"] += 1
+        stat["total"] += seconds
+        stat["max"] = max(stat["max"], seconds)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "running": self._executor is not None,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "stages": {
+                stage: {
+                    "count": stat["count"],
+                    "avg": round(stat["total"] / stat["count"], 4) if stat["count"] else 0.0,
+                    "max": round(stat["max"], 4),
+                }
+                for stage, stat in self._stage_stats.items()
+            },
+        }
+
+
+# 进程级共享预处理池
+preprocess_pool = PreprocessPool()
@@ -0,0 +1,17 @@
+# model/preprocess_worker.py
+"""预处理子进程入口
+
+spawn 方式启动的子进程会先重新导入父进程的 __main__ 模块（以 __mp_main__ 名义）。
+服务以 python server.py 启动时，这意味着每个预处理子进程都会重新执行 server.py 的模块级代码
+（初始化日志、任务存储、创建 FastAPI 应用等）。预处理池启动子进程期间把 __main__ 指向本模块，
+子进程只导入图片预处理所需的模块。
+"""
+try:
+    from model.model import prepare_image_timed
+except ImportError:  # 直接运行 model 目录下脚本时
+    from model import prepare_image_timed
+
+
+def preprocess(image_path: str, quality: int, reference_original: bool = True):
+    """子进程入口：返回 (base64编码或图片地址, 各阶段耗时)"""
+    return prepare_image_timed(image_path, quality, reference_original=reference_original)
@@ -0,0 +1,130 @@
+# model/stream_parser.py
+import os
+import json
+from collections import deque
+from typing import Dict
+
+
+# ==============================
+# 1. 增量判定解析
+# ==============================
+SHAPE_ARRAY = "array"    # 单类型回答：[{'状态':..., '描述':...}]
+SHAPE_OBJECT = "object"  # 多问题合并回答：{"类型": [{...}], ...}
+
+_BRACKETS = {SHAPE_ARRAY: ("[", "]"), SHAPE_OBJECT: ("{", "}")}
+
+
+class VerdictStreamParser:
+    """流式输出的增量解析器
+
+    逐段喂入模型输出，跟踪括号深度（忽略字符串内的括号），
+    第一个完整且可解析的判定 JSON 闭合时返回 True，调用方即可关闭流、停止生成。
+    """
+
+    def __init__(self, shape: str = SHAPE_ARRAY):
+        self.open_char, self.close_char = _BRACKETS[shape]
+        self.shape = shape
+        self.text = ""
+        self._pos = 0        # 下一个待扫描字符
+        self._start = -1     # 当前候选 JSON 起始位置
+        self._depth = 0
+        self._quote = None   # 当前所在字符串的引号字符
+        self._escaped = False
+        self.verdict = None
+
+    def feed(self, chunk: str) -> bool:
+        """追加一段输出，返回判定是否已完整"""
+        if self.verdict is not None:
+            return True
+        self.text += chunk
+        while self._pos < len(self.text):
+            ch = self.text[self._pos]
+            self._pos += 1
+            if self._start < 0:
+                if ch == self.open_char:
+                    self._start, self._depth = self._pos - 1, 1
+                continue
+            if self._quote is not None:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == self._quote:
+                    self._quote = None
+                continue
+            if ch in ("'", '"'):
+                self._quote = ch
+            elif ch == self.open_char:
+                self._depth += 1
+            elif ch == self.close_char:
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._try_parse(self.text[self._start:self._pos]):
+                        return True
+                    # 不是合法判定（如描述前的示例括号），从下一个字符重新寻找
+                    self._pos = self._start + 1
+                    self._start = -1
+        return False
+
+    def _try_parse(self, candidate: str) -> bool:
+        try:
+            value = json.loads(candidate.replace("'", "\""))
+        except json.JSONDecodeError:
+            return False
+        if self.shape == SHAPE_ARRAY:
+            ok = isinstance(value, list) and value and isinstance(value[0], dict) and "状态" in value[0]
+        else:
+            ok = isinstance(value, dict) and bool(value)
+        if ok:
+            self.verdict = candidate
+        return bool(ok)
+
+
+# ==============================
+# 2. 流式解码统计
+# ==============================
+# 保留的最近逐次调用记录数
+STREAM_STATS_RECENT = int(os.environ.get("STREAM_STATS_RECENT", 200))
+
+
+class StreamStats:
+    """流式推理的提前结束统计（进程级）：累计值 + 最近若干次调用的逐次记录"""
+
+    def __init__(self, recent: int = STREAM_STATS_RECENT):
+        self.calls = 0
+        self.early_stops = 0
+        self.tokens_generated = 0
+        # 估算值：提前结束时未用完的 token 预算（max_tokens - 已生成），是实际节省的上界，
+        # 模型不提前结束时往往也用不完预算
+        self.tokens_saved_estimate = 0
+        self.time_to_verdict_total = 0.0
+        self.time_to_verdict_max = 0.0
+        # 每次调用一条：(已生成 token 数, 判定完整 / 流结束耗时, 是否提前结束)
+        self.records = deque(maxlen=recent)
+
+    def record(self, tokens: int, max_tokens: int, early_stop: bool, time_to_verdict: float = 0.0) -> None:
+        self.calls += 1
+        self.tokens_generated += tokens
+        self.records.append((tokens, time_to_verdict, early_stop))
+        if early_stop:
+            self.early_stops += 1
+            self.tokens_saved_estimate += max(0, max_tokens - tokens)
+            self.time_to_verdict_total += time_to_verdict
+            self.time_to_verdict_max = max(self.time_to_verdict_max, time_to_verdict)
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "early_stops": self.early_stops,
+            "tokens_generated": self.tokens_generated,
+            "tokens_saved_estimate": self.tokens_saved_estimate,
+            "avg_time_to_verdict": round(self.time_to_verdict_total / self.early_stops, 4) if self.early_stops else 0.0,
+            "max_time_to_verdict": round(self.time_to_verdict_max, 4),
+            "recent": [
+                {"tokens": tokens, "time_to_verdict": round(seconds, 4), "early_stop": early_stop}
+                for tokens, seconds, early_stop in self.records
+            ],
+        }
+
+
+stream_stats = StreamStats()
@@ -0,0 +1,252 @@
+# pipeline.py
+"""异步任务的分阶段处理流水线（按图片粒度）
+
+    调度器 -> [取图/校验] -> 队列 -> [查缓存/预处理] -> 队列 -> [推理] -> 队列 -> [收尾/持久化]
+
+- 各阶段由独立的协程组处理，阶段之间用队列衔接：推理协程处理当前图片时，
+  后续图片已在下载、读盘、解码，模型服务不必等待 NFS/FTP 读取
+- 已从调度器取出、尚未进入推理阶段的图片数不超过 PIPELINE_READ_AHEAD，
+  限制暂存文件和预处理结果占用的内存，也限制预读对调度优先级的影响
+- 关闭服务时先排空：调度器停止分发，已取出的图片在超时前继续处理完成
+- 单张图片的任何异常（包括不是由关闭流水线引起的 CancelledError，如共享的在途计算被其他请求取消）
+  只让该图片按失败收尾，不会终止阶段协程，也不会泄漏在途计数和预读名额
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from main_async import PreparedTask, fetch_task_async, preprocess_task_async, process_single_task_async
+from model.preprocess_pool import PREPROCESS_WORKERS
+from scheduler import FairScheduler, TaskRun, SCHEDULER_WORKERS
+from metrics import observe_stage, metric_types, STAGE_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# 流水线配置
+# ============================
+# 取图/校验并发数（NFS/FTP/HTTP 读取为 IO 等待，可远大于 CPU 数）
+PIPELINE_FETCH_WORKERS = int(os.environ.get("PIPELINE_FETCH_WORKERS", 16))
+# 查缓存/预处理并发数，略多于预处理进程数使子进程保持忙碌
+PIPELINE_PREPROCESS_WORKERS = int(os.environ.get("PIPELINE_PREPROCESS_WORKERS", PREPROCESS_WORKERS * 2))
+# 预读上限：已取出但尚未开始推理的图片数
+PIPELINE_READ_AHEAD = int(os.environ.get("PIPELINE_READ_AHEAD", 32))
+# 收尾（记录进度、任务落盘、推送）并发数
+PIPELINE_FINISH_WORKERS = int(os.environ.get("PIPELINE_FINISH_WORKERS", 4))
+
+
+class WorkItem:
+    __slots__ = ("run", "index", "prepared", "result", "holds_slot")
+
+    def __init__(self, run: TaskRun, index: int):
+        self.run = run
+        self.index = index
+        self.prepared: Optional[PreparedTask] = None
+        self.result: Optional[Dict] = None
+        # 是否仍占用预读名额（进入推理阶段时让出）
+        self.holds_slot = True
+
+    @property
+    def task(self) -> Dict:
+        return self.run.items[self.index]
+
+
+class ImagePipeline:
+    """从调度器取图片，依次经过取图、预处理、推理、收尾四个阶段
+
+    on_dispatch(run, index)：图片从调度器取出时调用（同步）
+    on_done(run, index, result)：图片处理完成后在收尾阶段调用
+    on_fetched(run, index, prepared)：取图完成、预处理之前调用（可选，用于恢复检查点）
+    推理阶段的并发数即 SCHEDULER_WORKERS，到模型服务的实际并发仍由 model_limiter 控制
+    """
+
+    def __init__(self, scheduler: FairScheduler, on_dispatch: Callable[[TaskRun, int], None],
+                 on_done: Callable[[TaskRun, int, Dict], Awaitable[None]],
+                 on_fetched: Optional[Callable[[TaskRun, int, PreparedTask], Awaitable[None]]] = None,
+                 inference_workers: int = SCHEDULER_WORKERS, read_ahead: int = PIPELINE_READ_AHEAD):
+        self.scheduler = scheduler
+        self.on_dispatch = on_dispatch
+        self.on_done = on_done
+        self.on_fetched = on_fetched
+        self.inference_workers = inference_workers
+        self.read_ahead = read_ahead
+        self._read_ahead_slots: Optional[asyncio.Semaphore] = None
+        self._fetched: Optional[asyncio.Queue] = None
+        self._ready: Optional[asyncio.Queue] = None
+        self._done: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.active = {"fetch": 0, "preprocess": 0, "inference": 0, "finish": 0}
+        # 已从调度器取出、尚未收尾完成的图片数
+        self.in_flight = 0
+        self.processed = 0
+        self.finish_errors = 0
+        # stop() 已开始：此后的 CancelledError 来自关闭流水线，阶段协程应随之退出
+        self._stopping = False
+
+    def start(self) -> None:
+        """在服务事件循环中创建队列和各阶段协程（需在 scheduler.start 之后调用）"""
+        self._read_ahead_slots = asyncio.Semaphore(self.read_ahead)
+        self._fetched = asyncio.Queue(maxsize=self.read_ahead)
+        self._ready = asyncio.Queue(maxsize=self.read_ahead)
+        self._done = asyncio.Queue(maxsize=max(self.inference_workers, 1))
+        stages = [
+            (self._fetch_loop, PIPELINE_FETCH_WORKERS),
+            (self._preprocess_loop, PIPELINE_PREPROCESS_WORKERS),
+            (self._inference_loop, self.inference_workers),
+            (self._finish_loop, PIPELINE_FINISH_WORKERS),
+        ]
+        for loop, count in stages:
+            for _ in range(max(count, 1)):
+                self._tasks.append(asyncio.create_task(loop()))
+
+    async def drain(self, timeout: float) -> int:
+        """暂停调度器分发，等待已取出的图片处理完成（最多 timeout 秒），返回仍未完成的图片数"""
+        self.scheduler.pause()
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return self.in_flight
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    # ---------- 各阶段 ----------
+    def _is_item_error(self, e: BaseException) -> bool:
+        """异常只涉及当前图片（应按失败收尾），而不是流水线正在关闭"""
+        return isinstance(e, Exception) or (isinstance(e, asyncio.CancelledError) and not self._stopping)
+
+    def _release_slot(self, item: WorkItem) -> None:
+        if item.holds_slot:
+            item.holds_slot = False
+            self._read_ahead_slots.release()
+
+    def _drop(self, item: WorkItem) -> None:
+        """流水线关闭时丢弃尚未收尾的图片（未完成的图片由调度器归还 / 重启后按检查点续跑）"""
+        self._release_slot(item)
+        if item.prepared is not None:
+            item.prepared.release()
+        self.in_flight -= 1
+
+    @staticmethod
+    def _failed_result(item: WorkItem, e: BaseException) -> Dict:
+        if isinstance(e, asyncio.CancelledError):
+            e = RuntimeError("图片处理被取消")
+        return {
+            "ftp_path": item.task.get("ftp_path", "未知路径"),
+            "judgmentInfo": [],
+            "status": "failed",
+            "error_msg": str(e)
+        }
+
+    async def _fetch_loop(self) -> None:
+        while True:
+            await self._read_ahead_slots.acquire()
+            try:
+                run, index = await self.scheduler.get()
+            except BaseException:
+                self._read_ahead_slots.release()
+                raise
+            item = WorkItem(run, index)
+            self.in_flight += 1
+            self.active["fetch"] += 1
+            try:
+                observe_stage(STAGE_QUEUE_WAIT, time.monotonic() - run.submitted_at, metric_types(item.task))
+                self.on_dispatch(run, index)
+                item.prepared = await fetch_task_async(item.task)
+                if self.on_fetched is not None and item.prepared.error is None:
+                    await self.on_fetched(run, index, item.prepared)
+            except BaseException as e:
+                if not self._is_item_error(e):
+                    self._drop(item)
+                    raise
+                # 记录为取图错误，后续阶段按失败返回
+                if item.prepared is None:
+                    item.prepared = PreparedTask(item.task)
+                item.prepared.error = RuntimeError("图片处理被取消") if isinstance(e, asyncio.CancelledError) else e
+            finally:
+                self.active["fetch"] -= 1
+            await self._put(self._fetched, item)
+
+    async def _preprocess_loop(self) -> None:
+        while True:
+            item = await self._fetched.get()
+            self.active["preprocess"] += 1
+            try:
+                await preprocess_task_async(item.prepared)
+            except BaseException as e:
+                if not self._is_item_error(e):
+                    self._drop(item)
+                    raise
+                item.prepared.error = RuntimeError("图片处理被取消") if isinstance(e, asyncio.CancelledError) else e
+            finally:
+                self.active["preprocess"] -= 1
+            await self._put(self._ready, item)
+
+    async def _inference_loop(self) -> None:
+        while True:
+            item = await self._ready.get()
+            # 进入推理即让出预读名额，取图阶段可继续取下一张
+            self._release_slot(item)
+            self.active["inference"] += 1
+            try:
+                item.result = await process_single_task_async(item.task, item.prepared)
+            except BaseException as e:
+                if not self._is_item_error(e):
+                    self._drop(item)
+                    raise
+                item.result = self._failed_result(item, e)
+            finally:
+                self.active["inference"] -= 1
+                item.prepared.release()
+            await self._put(self._done, item)
+
+    async def _finish_loop(self) -> None:
+        while True:
+            item = await self._done.get()
+            self.active["finish"] += 1
+            try:
+                await self.on_done(item.run, item.index, item.result)
+                self.processed += 1
+            except BaseException as e:
+                if not self._is_item_error(e):
+                    raise
+                self.finish_errors += 1
+                logger.exception(f"任务 {item.run.task_id} 第 {item.index} 张图片收尾异常: {e!r}")
+            finally:
+                self.active["finish"] -= 1
+                self.in_flight -= 1
+
+    async def _put(self, queue: asyncio.Queue, item: WorkItem) -> None:
+        """交给下一阶段；等待期间流水线关闭时丢弃该图片"""
+        try:
+            await queue.put(item)
+        except BaseException:
+            self._drop(item)
+            raise
+
+    def stats(self) -> Dict:
+        return {
+            "read_ahead": self.read_ahead,
+            "workers": {
+                "fetch": PIPELINE_FETCH_WORKERS,
+                "preprocess": PIPELINE_PREPROCESS_WORKERS,
+                "inference": self.inference_workers,
+                "finish": PIPELINE_FINISH_WORKERS,
+            },
+            "active": dict(self.active),
+            "in_flight": self.in_flight,
+            "queued": {
+                "fetched": self._fetched.qsize() if self._fetched else 0,
+                "ready": self._ready.qsize() if self._ready else 0,
+                "done": self._done.qsize() if self._done else 0,
+            },
+            "processed": self.processed,
+            "finish_errors": self.finish_errors,
+        }
@@ -0,0 +1,216 @@
+# result_cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+from loguru import logger
+
+
+# ==============================
+# 1. 缓存配置
+# ==============================
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "./result_cache.db")
+# 结果有效期（秒），默认7天
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 3600))
+# 最大缓存条目数，超出后按最近访问时间淘汰
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 200000))
+# 每写入多少条执行一次过期/超量清理
+RESULT_CACHE_PRUNE_EVERY = 1000
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# ==============================
+# 2. 持久化结果缓存
+# ==============================
+class ResultCache:
+    """按内容寻址的识别结果缓存（SQLite）
+
+    键 = 图片内容哈希 + 识别类型 + Prompt文本哈希 + 模型参数，值为解析后的 judgmentInfo 条目。
+    修改 prompt_json.py 中某个类型的 Prompt 只会使该类型的条目失效。
+    """
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, ttl: float = RESULT_CACHE_TTL,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES, enabled: bool = RESULT_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._conn = None
+        self._lock = threading.Lock()
+        # (路径, mtime, 大小) -> 图片内容哈希，避免同一文件重复读取计算
+        self._hash_memo: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._hash_memo_size = 4096
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    cache_key TEXT PRIMARY KEY,
+                    identify_type TEXT NOT NULL,
+                    prompt_hash TEXT NOT NULL,
+                    image_hash TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_type ON results(identify_type, prompt_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_access ON results(last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- 键计算 ----------
+    def image_hash(self, image_path: str) -> str:
+        st = os.stat(image_path)
+        memo_key = (os.path.abspath(image_path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._hash_memo.get(memo_key)
+            if cached is not None:
+                self._hash_memo.move_to_end(memo_key)
+                return cached
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        with self._lock:
+            self._hash_memo[memo_key] = value
+            while len(self._hash_memo) > self._hash_memo_size:
+                self._hash_memo.popitem(last=False)
+        return value
+
+    @staticmethod
+    def make_key(image_hash: str, identify_type: str, prompt_text: str, model_params: str) -> Tuple[str, str]:
+        """返回 (缓存键, Prompt哈希)"""
+        prompt_hash = sha256_text(prompt_text)
+        cache_key = sha256_text("\n".join([image_hash, identify_type, prompt_hash, model_params]))
+        return cache_key, prompt_hash
+
+    # ---------- 读写 ----------
+    def get_many(self, image_path: str, prompts: Dict[str, str], model_params: str) -> Dict[str, Dict]:
+        """批量查询一张图片多个识别类型的缓存结果，返回 {识别类型: 结果}"""
+        if not self.enabled:
+            return {}
+        image_hash = self.image_hash(image_path)
+        keys = {t: self.make_key(image_hash, t, p, model_params)[0] for t, p in prompts.items()}
+        now = time.time()
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for type_name, cache_key in keys.items():
+                row = conn.execute(
+                    "SELECT result, created_at FROM results WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+                if row is None or now - row[1] > self.ttl:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                found[type_name] = json.loads(row[0])
+            if found:
+                conn.executemany(
+                    "UPDATE results SET last_access = ? WHERE cache_key = ?",
+                    [(now, keys[t]) for t in found],
+                )
+                conn.commit()
+        return found
+
+    def put_many(self, image_path: str, prompts: Dict[str, str], model_params: str,
+                 results: Dict[str, Dict]) -> None:
+        """写入一张图片多个识别类型的结果"""
+        if not self.enabled or not results:
+            return
+        image_hash = self.image_hash(image_path)
+        now = time.time()
+        rows = []
+        for type_name, result in results.items():
+            cache_key, prompt_hash = self.make_key(image_hash, type_name, prompts[type_name], model_params)
+            rows.append((cache_key, type_name, prompt_hash, image_hash,
+                         json.dumps(result, ensure_ascii=False), now, now))
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+            self.writes += len(rows)
+            self._writes_since_prune += len(rows)
+            need_prune = self._writes_since_prune >= RESULT_CACHE_PRUNE_EVERY
+        if need_prune:
+            self.prune()
+
+    # ---------- 维护 ----------
+    def invalidate_stale_prompts(self, prompt_map: Dict[str, str]) -> int:
+        """删除Prompt已变更或已下线类型的条目，返回删除条数"""
+        if not self.enabled:
+            return 0
+        removed = 0
+        with self._lock:
+            conn = self._connect()
+            stored = conn.execute("SELECT DISTINCT identify_type, prompt_hash FROM results").fetchall()
+            for type_name, prompt_hash in stored:
+                current = prompt_map.get(type_name)
+                if current is None or sha256_text(current) != prompt_hash:
+                    cur = conn.execute(
+                        "DELETE FROM results WHERE identify_type = ? AND prompt_hash = ?",
+                        (type_name, prompt_hash),
+                    )
+                    removed += cur.rowcount
+                    logger.info(f"结果缓存：Prompt已变更，清除【{type_name}】旧条目 {cur.rowcount} 条")
+            conn.commit()
+        return removed
+
+    def prune(self) -> None:
+        """清理过期条目，并在超出条目上限时淘汰最久未访问的条目"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+            count = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM results WHERE cache_key IN "
+                    "(SELECT cache_key FROM results ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            conn.commit()
+            self._writes_since_prune = 0
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        entries = None
+        if self.enabled:
+            with self._lock:
+                entries = self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# 进程级共享结果缓存
+result_cache = ResultCache()
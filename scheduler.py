@@ -0,0 +1,163 @@
+# scheduler.py
+import os
+import time
+import asyncio
+from collections import Counter, OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from metrics import metric_types
+
+
+# ============================
+# 调度配置
+# ============================
+# 优先级类别及权重（加权轮询，权重越大分到的处理机会越多）
+PRIORITY_WEIGHTS = {"high": 4, "normal": 2, "low": 1}
+DEFAULT_PRIORITY = "normal"
+# 同时处理的图片数（Worker协程数）；到模型服务的实际并发仍由 model_limiter 控制
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", 64))
+# 排队中的图片总数上限，超出时拒绝新任务
+SCHEDULER_MAX_PENDING_ITEMS = int(os.environ.get("SCHEDULER_MAX_PENDING_ITEMS", 1000000))
+
+
+class SchedulerFull(Exception):
+    """排队图片数已达上限"""
+
+
+class TaskRun:
+    """一个任务的执行进度：按图片拆分后逐个完成，全部完成后组装任务结果"""
+
+    def __init__(self, task_id: str, items: List[Dict], priority: str, create_time: Optional[float] = None):
+        self.task_id = task_id
+        self.items = items
+        self.priority = priority
+        self.create_time = create_time
+        self.results: List[Optional[Dict]] = [None] * len(items)
+        self.remaining = len(items)
+        self.started = False
+        # 服务重启后恢复的任务：图片可能已有部分识别类型的检查点
+        self.recovered = False
+        # 进入调度队列的时间，用于统计各图片的排队耗时
+        self.submitted_at = time.monotonic()
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    def complete(self, index: int, result: Dict) -> bool:
+        """记录一张图片的结果，返回任务是否已全部完成"""
+        if self.results[index] is None:
+            self.results[index] = result
+            self.remaining -= 1
+        return self.remaining == 0
+
+
+class FairScheduler:
+    """按图片粒度的公平调度器
+
+    - 任务提交后拆分为逐图片的工作项
+    - 不同优先级类别之间按 PRIORITY_WEIGHTS 平滑加权轮询
+    - 同一类别内按任务轮询，大批量任务不会阻塞后到的小任务
+    """
+
+    def __init__(self, max_pending_items: int = SCHEDULER_MAX_PENDING_ITEMS):
+        self.max_pending_items = max_pending_items
+        # 优先级 -> {task_id: 待处理图片下标队列}
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {p: OrderedDict() for p in PRIORITY_WEIGHTS}
+        self._current_weights = {p: 0 for p in PRIORITY_WEIGHTS}
+        self.runs: Dict[str, TaskRun] = {}
+        self.pending_items = 0
+        # 识别类型 -> 排队中的图片数（一张图片含多个类型时各计一次）
+        self.pending_by_type: Counter = Counter()
+        self._available: Optional[asyncio.Condition] = None
+        self.dispatched = 0
+        # 暂停后不再分发工作项（服务关闭前排空流水线），排队中的图片留待重启后恢复
+        self.paused = False
+
+    def start(self) -> None:
+        """在服务事件循环中创建条件变量（需在提交任务和启动 Worker 之前调用）"""
+        self._available = asyncio.Condition()
+
+    @staticmethod
+    def normalize_priority(priority: Optional[str]) -> str:
+        return priority if priority in PRIORITY_WEIGHTS else DEFAULT_PRIORITY
+
+    async def submit(self, task_id: str, items: List[Dict], priority: str = DEFAULT_PRIORITY,
+                     create_time: Optional[float] = None,
+                     completed: Optional[Dict[int, Dict]] = None) -> Optional[TaskRun]:
+        """提交任务，按图片拆分为工作项入队；completed 为已完成图片的 {下标: 结果}，不再入队"""
+        completed = completed or {}
+        indexes = [i for i in range(len(items)) if i not in completed]
+        if self.pending_items + len(indexes) > self.max_pending_items:
+            raise SchedulerFull(f"排队图片数已达上限 {self.max_pending_items}")
+        priority = self.normalize_priority(priority)
+        run = TaskRun(task_id, items, priority, create_time)
+        for index, result in completed.items():
+            run.complete(index, result)
+        self.runs[task_id] = run
+        if indexes:
+            self._queues[priority][task_id] = deque(indexes)
+            self.pending_items += len(indexes)
+            for index in indexes:
+                self.pending_by_type.update(self._item_types(items[index]))
+            async with self._available:
+                self._available.notify(len(indexes))
+        return run
+
+    def _pick_priority(self, candidates: Optional[List[str]] = None) -> str:
+        """平滑加权轮询选择有待处理项的优先级类别"""
+        if candidates is None:
+            candidates = [p for p, q in self._queues.items() if q]
+        total = sum(PRIORITY_WEIGHTS[p] for p in candidates)
+        for p in candidates:
+            self._current_weights[p] += PRIORITY_WEIGHTS[p]
+        chosen = max(candidates, key=lambda p: self._current_weights[p])
+        self._current_weights[chosen] -= total
+        return chosen
+
+    async def get(self) -> Tuple[TaskRun, int]:
+        """取下一个工作项，返回 (任务进度, 图片下标)"""
+        async with self._available:
+            await self._available.wait_for(lambda: self.pending_items > 0 and not self.paused)
+            queue = self._queues[self._pick_priority()]
+            task_id, indexes = next(iter(queue.items()))
+            index = indexes.popleft()
+            # 轮到的任务移到队尾，实现任务间轮询
+            queue.move_to_end(task_id)
+            if not indexes:
+                del queue[task_id]
+            self.pending_items -= 1
+            self.dispatched += 1
+            run = self.runs[task_id]
+            self._untrack_types(run.items[index])
+            return run, index
+
+    @staticmethod
+    def _item_types(item: Dict) -> List[str]:
+        """图片的识别类型（指标标签，未配置的类型归为 unknown）"""
+        return metric_types(item)
+
+    def _untrack_types(self, item: Dict) -> None:
+        """图片出队时扣减各识别类型的排队数，归零的类型移除，不保留已不再排队的标签"""
+        for identify_type in self._item_types(item):
+            self.pending_by_type[identify_type] -= 1
+            if self.pending_by_type[identify_type] <= 0:
+                del self.pending_by_type[identify_type]
+
+    def pause(self) -> None:
+        """停止分发：等待中的 get() 不再返回，已取出的工作项不受影响"""
+        self.paused = True
+
+    def finish(self, task_id: str) -> None:
+        self.runs.pop(task_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "pending_items": self.pending_items,
+            "max_pending_items": self.max_pending_items,
+            "active_tasks": len(self.runs),
+            "queued_tasks": {p: len(q) for p, q in self._queues.items()},
+            "dispatched": self.dispatched,
+            "paused": self.paused,
+            "workers": SCHEDULER_WORKERS,
+        }
@@ -1,34 +1,44 @@
 import os
+import json
+import time
 import asyncio
 import logging
 import uuid
-import json
 from datetime import datetime
-from pathlib import Path
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response, FileResponse
 from pydantic import BaseModel
-from typing import List, Dict
-import httpx  # 异步 HTTP 客户端
-
-from main_async import process_batch_tasks_async
+from typing import List, Dict, Optional, Union
+
+from main_async import process_batch_tasks_async, process_single_task_async, inference_flight, PreparedTask
+from model.image_cache import preprocess_cache
+from model.model import (init_async_client, close_async_client, backend_pool, prune_shared_images,
+                         shared_image_path, MODEL_IMAGE_TRANSPORT, MODEL_IMAGE_SHARE_TTL)
+from model.limiter import model_limiter
+from model.stream_parser import stream_stats
+from model.preprocess_pool import preprocess_pool
+from result_cache import result_cache
+from prompt_json import prompt
+from task_store import create_task_store
+from task_registry import TaskRegistry
+from task_checkpoint import task_checkpoint
+from callback_delivery import CallbackDelivery
+from scheduler import SchedulerFull, TaskRun, SCHEDULER_WORKERS, DEFAULT_PRIORITY
+from work_queue import SharedScheduler, create_scheduler
+from pipeline import ImagePipeline
+from image_fetcher import close_fetchers
+from log_pipeline import setup_logging, logging_stats, audit_log, payload_summary, LOG_DIR
+from metrics import registry, observe_stage, metric_types, CONTENT_TYPE, STAGE_PERSIST
 
 
 # ============================
 # 日志配置
 # ============================
-LOG_DIR = "./logs"
-os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "server.log")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+# 日志经内存队列由后台线程写出，请求处理路径不等待磁盘和控制台
+setup_logging(LOG_FILE)
 logger = logging.getLogger(__name__)
 
 # ============================
@@ -43,21 +53,30 @@ TASK_STATUS_FAILED = "failed"
 CALLBACK_URL = os.environ.get("CALLBACK_URL", "http://127.0.0.1:9806/patrol/v1/piTaskImg/imgCallback")
 # CALLBACK_URL = os.environ.get("CALLBACK_URL", "http://127.0.0.1:29806/patrol/v1/piTaskImg/imgCallback")
 
-# 失败推送记录文件
-FAILED_PUSH_FILE = Path("./failed_push.json")
+# 流式同步接口：单个请求同时处理的图片数上限（客户端读取慢时不再启动新的图片）
+STREAM_WINDOW = int(os.environ.get("STREAM_WINDOW", 8))
+
+# 服务进程数；大于1时各进程通过共享任务队列（TASK_QUEUE_BACKEND=sqlite）协同
+API_WORKERS = int(os.environ.get("API_WORKERS", 1))
+
+# 关闭服务时等待已取出的图片处理完成的最长时间（秒），超时后未完成的图片在重启后续跑
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 30))
 
 # ============================
-# 内存任务存储
+# 任务持久化存储（默认 SQLite WAL，后台线程批量提交）
 # ============================
-task_queue = asyncio.Queue(maxsize=100000)
-task_status = dict()
-task_metadata = dict()
+task_store = create_task_store()
 
 # ============================
-# 任务持久化目录
+# 内存任务存储（有界：已结束任务按 TTL / 数量淘汰，查询时回退到持久化存储）
 # ============================
-TASK_DATA_DIR = Path("./task_data")
-TASK_DATA_DIR.mkdir(exist_ok=True)
+# 任务队列：单进程为内存公平调度器；多进程为 SQLite 共享队列（认领 / 租约）
+scheduler = create_scheduler()
+# 共享队列模式下任务进度以共享队列为准，本进程的内存任务表只保存由本进程收尾的任务
+SHARED_QUEUE = isinstance(scheduler, SharedScheduler)
+task_registry = TaskRegistry(task_store)
+task_status = task_registry.status
+task_metadata = task_registry.metadata
 
 # ============================
 # 数据模型定义
@@ -65,6 +84,14 @@ TASK_DATA_DIR.mkdir(exist_ok=True)
 class TaskItem(BaseModel):
     identifyType: List[str]
     ftp_path: str
+    multiQuestion: Optional[bool] = None  # 是否合并为一次模型调用，None 时使用服务端默认配置
+    bypassCache: bool = False  # 为 True 时忽略已缓存的识别结果，强制重新推理
+    verdictOnly: Optional[bool] = None  # 仅返回判定状态（不生成描述），None 时按服务端 VERDICT_ONLY_TYPES 配置
+
+
+class TaskSubmitRequest(BaseModel):
+    tasks: List[TaskItem]
+    priority: str = "normal"  # 优先级：high / normal / low
 
 
 class TaskResponseItem(BaseModel):
@@ -83,156 +110,287 @@ class TaskResponseItem2(BaseModel):
 # ============================
 # 工具函数：任务持久化
 # ============================
-def save_task_to_disk(task_id, data):
-    with open(TASK_DATA_DIR / f"{task_id}.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def save_task_to_disk(task_id, with_metadata=False, on_commit=None):
+    """登记任务持久化（由后台线程批量落盘，不阻塞事件循环），返回估算字节数
+    on_commit 在记录提交后由后台写线程调用
+    """
+    return task_store.save(task_id, task_status[task_id], task_metadata[task_id] if with_metadata else None,
+                           on_commit)
 
 
-def load_tasks_from_disk():
-    for file in TASK_DATA_DIR.glob("*.json"):
-        task_id = file.stem
+async def load_tasks_from_disk():
+    """只恢复 pending/processing 任务，已结束任务在查询时按需从存储读取
+    已有检查点的任务只调度未完成的图片
+    """
+    unfinished = await asyncio.to_thread(task_store.load_unfinished)
+    if not SHARED_QUEUE:
+        # 共享队列模式下其他进程的任务可能仍在处理，不清理检查点
+        stale = await asyncio.to_thread(task_checkpoint.prune, [task_id for task_id, _, _ in unfinished])
+        if stale:
+            logger.info(f"清理 {stale} 个已结束任务的残留检查点")
+    for task_id, status_info, metadata in unfinished:
+        task_registry.add(task_id, status_info, metadata)
+        completed = await asyncio.to_thread(task_checkpoint.load_images, task_id)
         try:
-            with open(file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            task_status[task_id] = data["status_info"]
-            task_metadata[task_id] = data["metadata"]
-            if data["status_info"]["status"] in [TASK_STATUS_PENDING, TASK_STATUS_PROCESSING]:
-                asyncio.create_task(task_queue.put(task_id))
-            logger.info(f"恢复任务: {task_id} ({data['status_info']['status']})")
-        except Exception as e:
+            queued = await enqueue_task(task_id, status_info.get("priority", DEFAULT_PRIORITY), completed)
+        except SchedulerFull as e:
             logger.error(f"恢复任务 {task_id} 失败: {e}")
+            continue
+        finally:
+            if SHARED_QUEUE:
+                task_registry.discard(task_id)
+        if queued:
+            logger.info(f"恢复任务: {task_id} ({status_info['status']}，已完成 {len(completed)}/{len(metadata)} 张)")
+
+
+# ============================
+# 结果回调推送（共享连接池 + 有界并发 + 落盘发件箱补推）
+# ============================
+callback_delivery = CallbackDelivery(CALLBACK_URL)
 
 
 # ============================
-# 工具函数：推送结果（带重试）
+# 后台任务 Worker（按图片粒度公平调度）
 # ============================
-async def push_task_result(task_id: str, data: dict, max_retries: int = 3):
-    retry_delay = 2
-    for attempt in range(1, max_retries + 1):
+def format_task_results(results: List[Dict]) -> List[Dict]:
+    """构造推送结构"""
+    return [
+        TaskResponseItem(
+            ftpPath=item["ftp_path"],
+            judgmentInfo=item.get("judgmentInfo", []),
+            status=item.get("status", "success"),  # 从结果项中获取状态，默认success
+            error_msg=item.get("error_msg", "")    # 从结果项中获取错误信息，默认空
+        ).model_dump()
+        for item in results
+    ]
+
+
+async def finish_task(run: TaskRun):
+    """任务所有图片完成后组装结果、推送并持久化"""
+    task_id = run.task_id
+    if SHARED_QUEUE:
+        # 任务可能由其他进程提交，各图片也可能由不同进程完成，状态以共享队列为准
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                resp = await client.post(CALLBACK_URL, json=data)
-                if resp.status_code == 200:
-                    logger.info(f"✅ 成功推送任务结果: {task_id} (第 {attempt} 次尝试)")
-                    return
-                else:
-                    logger.warning(f"⚠️ 推送失败 {task_id} (第 {attempt} 次)，状态码: {resp.status_code}，响应: {resp.text}")
+            status_info = await shared_task_status(task_id)
         except Exception as e:
-            logger.error(f"❌ 推送异常 {task_id} (第 {attempt} 次): {e}")
-        await asyncio.sleep(retry_delay)
-        retry_delay *= 2
-    record_failed_push(task_id, data)
+            logger.error(f"读取任务 {task_id} 的共享队列状态失败，按本进程的进度收尾: {e}")
+            status_info = None
+        if status_info is None:
+            # 共享队列中已没有该任务（如已被清理），退回本进程的状态
+            status_info = task_status.get(task_id) or local_task_status(run)
+        task_registry.add(task_id, status_info, run.items)
+    try:
+        # 推送结果按提交顺序；任务状态中的 response 保持完成顺序，保证 since 游标前后一致
+        formatted_results = format_task_results(run.results)
+
+        task_status[task_id].update({
+            "status": TASK_STATUS_DONE,
+            "end_time": datetime.now().timestamp()
+        })
+
+        # 推送结果
+        await callback_delivery.submit(task_id, {
+            "taskId": task_id,
+            "response": formatted_results
+        }, run_types(run))
+        logger.info(f"推送taskId :{task_id} , 推送response: {payload_summary(formatted_results)}")
+        audit_log.record("callback", task_id=task_id, status=TASK_STATUS_DONE, response=formatted_results)
+
+    except Exception as e:
+        logger.exception(f"任务 {task_id} 执行失败: {e}")
+        formatted_failed = [
+            TaskResponseItem(
+                ftpPath=item["ftp_path"],
+                judgmentInfo=[],
+                status="failed",
+                error_msg=str(e)
+            ).model_dump()
+            for item in run.items
+        ]
+
+        task_status[task_id].update({
+            "status": TASK_STATUS_FAILED,
+            "error": str(e),
+            "end_time": datetime.now().timestamp()
+        })
+
+        # 推送失败信息
+        await callback_delivery.submit(task_id, {
+            "taskId": task_id,
+            "response": formatted_failed
+        }, run_types(run))
+        logger.info(f"推送taskId :{task_id} , 推送response: {payload_summary(formatted_failed)} ")
+        audit_log.record("callback", task_id=task_id, status=TASK_STATUS_FAILED, response=formatted_failed)
+
+    finally:
+        if SHARED_QUEUE:
+            await scheduler.close(task_id, task_status[task_id])
+        scheduler.finish(task_id)
+        persist_start = time.perf_counter()
+        types = run_types(run)
+
+        def on_persisted():
+            # 落盘耗时从登记到批次提交（含排队、凑批）
+            observe_stage(STAGE_PERSIST, time.perf_counter() - persist_start, types)
+            # 最终状态提交后检查点才不再需要：提交前进程退出时，重启后仍按检查点续跑；
+            # 提交后、删除前退出时，重启后按已结束任务清理
+            task_checkpoint.clear(task_id)
+
+        approx_bytes = save_task_to_disk(task_id, on_commit=on_persisted)
+        task_registry.mark_finished(task_id, approx_bytes)
+
+
+def local_task_status(run: TaskRun) -> Dict:
+    """按本进程持有的任务进度构造任务状态"""
+    done = [r for r in run.results if r is not None]
+    return {
+        "status": TASK_STATUS_PROCESSING,
+        "create_time": run.create_time,
+        "priority": run.priority,
+        "total": run.total,
+        "completed": len(done),
+        "response": format_task_results(done),
+    }
 
 
-def record_failed_push(task_id: str, data: dict):
-    failed_records = []
-    if FAILED_PUSH_FILE.exists():
+def run_types(run: TaskRun) -> List[str]:
+    """任务涉及的全部识别类型（任务级阶段的指标标签）"""
+    types = {}
+    for item in run.items:
+        types.update(dict.fromkeys(metric_types(item)))
+    return list(types)
+
+
+def on_item_dispatch(run: TaskRun, index: int):
+    """图片从调度器取出：任务的第一张图片开始处理时标记为处理中"""
+    if not run.started:
+        run.started = True
+        # 共享队列模式下处理中状态在认领时已写入共享队列
+        if not SHARED_QUEUE:
+            task_status[run.task_id]["status"] = TASK_STATUS_PROCESSING
+            save_task_to_disk(run.task_id)
+        logger.info(f"输入问题 :{payload_summary(run.items)} ")
+
+
+async def on_item_done(run: TaskRun, index: int, result: Dict):
+    """一张图片处理完成：记录进度，任务的最后一张图片完成时收尾"""
+    if SHARED_QUEUE:
+        # 结果写入共享队列，完成最后一张图片的进程负责收尾
+        finished = await scheduler.complete(run, index, result)
+        if finished is not None:
+            await finish_task(finished)
+        return
+
+    # 逐图片记录进度，轮询方可在整批完成前拿到已完成的结果
+    status_info = task_status[run.task_id]
+    status_info["response"].extend(format_task_results([result]))
+    status_info["completed"] += 1
+    # 逐图片检查点，重启后已完成的图片不再重复推理
+    task_checkpoint.record_image(run.task_id, index, status_info["completed"], result)
+
+    if run.complete(index, result):
+        await finish_task(run)
+
+
+async def on_item_fetched(run: TaskRun, index: int, prepared: PreparedTask):
+    """推理前：恢复的任务取回该图片已完成的识别类型；逐类型记录检查点"""
+    if run.recovered:
         try:
-            with open(FAILED_PUSH_FILE, "r", encoding="utf-8") as f:
-                failed_records = json.load(f)
-        except Exception:
-            failed_records = []
-    failed_records.append({
-        "task_id": task_id,
-        "callback_url": CALLBACK_URL,
-        "data": data,
-        "time": datetime.now().isoformat()
+            prepared.resumed = await asyncio.to_thread(task_checkpoint.load_types, run.task_id, index)
+        except Exception as e:
+            logger.error(f"读取任务 {run.task_id} 第 {index} 张图片的检查点失败，重新推理: {e}")
+        if prepared.resumed:
+            logger.info(f"任务 {run.task_id} 第 {index} 张图片续跑，跳过已完成类型 {list(prepared.resumed)}")
+    prepared.on_type_result = lambda type_name, result: task_checkpoint.record_type(
+        run.task_id, index, type_name, result)
+
+
+# 取图 -> 预处理 -> 推理 -> 收尾 分阶段流水线
+pipeline = ImagePipeline(scheduler, on_item_dispatch, on_item_done, on_item_fetched)
+
+
+async def enqueue_task(task_id: str, priority: str = DEFAULT_PRIORITY,
+                       completed: Optional[List[tuple]] = None) -> bool:
+    """将任务拆分为逐图片工作项交给调度器；共享队列中已有该任务时返回 False
+    completed 为恢复任务已完成图片的 [(下标, 结果)]（按完成顺序），这些图片不再调度
+    """
+    status_info = task_status[task_id]
+    run = await scheduler.submit(task_id, task_metadata[task_id], priority, status_info["create_time"],
+                                 dict(completed or []))
+    if run is None:
+        # 其他进程已恢复该任务
+        return False
+    run.recovered = completed is not None
+    # 恢复的任务按检查点重建进度，结果保持原完成顺序
+    status_info.update({
+        "completed": len(completed or []),
+        "total": run.total,
+        "response": format_task_results([result for _, result in completed or []])
     })
-    with open(FAILED_PUSH_FILE, "w", encoding="utf-8") as f:
-        json.dump(failed_records, f, ensure_ascii=False, indent=2)
+    if run.remaining == 0:
+        # 空任务 / 已全部完成的任务没有工作项，直接收尾（放到下一轮事件循环，保证提交接口先完成落盘）
+        asyncio.create_task(finish_task(run))
+    return True
 
 
-# ============================
-# 后台任务 Worker
-# ============================
-async def task_worker():
-    """后台任务处理Worker"""
-    while True:
-        task_id = await task_queue.get()
-        try:
-            task_status[task_id]["status"] = TASK_STATUS_PROCESSING
-            save_task_to_disk(task_id, {
-                "status_info": task_status[task_id],
-                "metadata": task_metadata[task_id]
-            })
-
-            tasks = task_metadata[task_id]
-            tasks_as_dict = [task for task in tasks]
-
-            logger.info(f"输入问题 :{tasks_as_dict} ")
-
-            # 模型推理
-            results = await process_batch_tasks_async(tasks_as_dict)
-
-            # 构造推送结构
-            # formatted_results = [
-            #     TaskResponseItem(
-            #         ftpPath=item["ftp_path"],
-            #         judgmentInfo=item.get("judgmentInfo", []),
-            #         # status="success",
-            #         s = 'results.status'
-            #         # error_msg=""
-            #         er = 'results.error_msg'
-            #     ).model_dump()
-            #     for item in results
-            # ]
-            formatted_results = [
-                TaskResponseItem(
-                    ftpPath=item["ftp_path"],
-                    judgmentInfo=item.get("judgmentInfo", []),
-                    status=item.get("status", "success"),  # 从结果项中获取状态，默认success
-                    error_msg=item.get("error_msg", "")    # 从结果项中获取错误信息，默认空
-                ).model_dump()
-                for item in results
-            ]
+async def shared_task_status(task_id: str) -> Optional[Dict]:
+    """共享队列中的任务状态，结果转为推送结构"""
+    status_info = await scheduler.task_state(task_id)
+    if status_info is not None:
+        status_info["response"] = format_task_results(status_info["response"])
+    return status_info
 
 
-            task_status[task_id] = {
-                "status": TASK_STATUS_DONE,
-                "response": formatted_results,
-                "create_time": task_status[task_id]["create_time"],
-                "end_time": datetime.now().timestamp()
-            }
+async def shared_finish_recovery_loop():
+    """共享队列模式下接手收尾进程已退出的任务"""
+    while True:
+        await asyncio.sleep(scheduler.queue.lease_seconds / 2)
+        try:
+            for run in await scheduler.reclaim_finishing():
+                await finish_task(run)
+        except Exception as e:
+            logger.exception(f"接手收尾任务出错: {e}")
 
-            # 推送结果
-            asyncio.create_task(push_task_result(task_id, {
-                "taskId": task_id,
-                "response": formatted_results
-            }))
-            logger.info(f"推送taskId :{task_id} , 推送response: {formatted_results}")
 
+async def shared_image_sweep_loop():
+    """file / url 传输方式下定期清理共享目录中超时未用的图片"""
+    while True:
+        await asyncio.sleep(max(60.0, MODEL_IMAGE_SHARE_TTL / 4))
+        try:
+            removed = await asyncio.to_thread(prune_shared_images)
+            if removed:
+                logger.info(f"清理共享图片 {removed} 张")
         except Exception as e:
-            logger.exception(f"任务 {task_id} 执行失败: {e}")
-            formatted_failed = [
-                TaskResponseItem(
-                    ftpPath=item["ftp_path"],
-                    judgmentInfo=[],
-                    status="failed",
-                    error_msg=str(e)
-                ).model_dump()
-                for item in task_metadata[task_id]
-            ]
-
-            task_status[task_id] = {
-                "status": TASK_STATUS_FAILED,
-                "error": str(e),
-                "create_time": task_status[task_id]["create_time"],
-                "end_time": datetime.now().timestamp()
-            }
-
-            # 推送失败信息
-            asyncio.create_task(push_task_result(task_id, {
-                "taskId": task_id,
-                "response": formatted_failed
-            }))
-            logger.info(f"推送taskId :{task_id} , 推送response: {formatted_results} ")
+            logger.error(f"清理共享图片出错: {e}")
 
-        finally:
-            save_task_to_disk(task_id, {
-                "status_info": task_status[task_id],
-                "metadata": task_metadata[task_id]
-            })
-            task_queue.task_done()
+
+# ============================
+# 运行指标（抓取 /metrics 时读取的瞬时值）
+# ============================
+def _hit_ratio(hits: int, misses: int) -> float:
+    total = hits + misses
+    return hits / total if total else 0.0
+
+
+registry.gauge("vision_task_queue_items", "调度器中排队的图片数", lambda: scheduler.pending_items)
+registry.gauge("vision_task_queue_depth", "按识别类型统计的排队图片数",
+               lambda: {(t,): n for t, n in scheduler.pending_by_type.items()}, ("identifyType",))
+registry.gauge("vision_active_workers", "流水线各阶段正在处理的图片数",
+               lambda: {(stage,): n for stage, n in pipeline.active.items()}, ("stage",))
+registry.gauge("vision_workers", "推理阶段 Worker 总数", lambda: SCHEDULER_WORKERS)
+registry.gauge("vision_pipeline_queue_depth", "流水线阶段之间排队的图片数",
+               lambda: {(stage,): n for stage, n in pipeline.stats()["queued"].items()}, ("queue",))
+registry.gauge("vision_model_in_flight", "在途模型调用数", lambda: model_limiter.in_flight)
+registry.gauge("vision_model_waiting", "等待模型并发槽位的调用数", lambda: model_limiter.stats()["waiting"])
+registry.gauge("vision_model_concurrency_limit", "模型并发上限（自适应）", lambda: model_limiter.limit)
+registry.gauge("vision_backend_in_flight", "各模型实例的在途请求数",
+               lambda: {(b.url,): b.in_flight for b in backend_pool.backends}, ("backend",))
+registry.gauge("vision_preprocess_queue_depth", "等待预处理子进程的图片数", lambda: preprocess_pool.queue_depth)
+registry.gauge("vision_callback_queue_depth", "待推送的回调数", lambda: callback_delivery.stats()["queued"])
+registry.gauge("vision_cache_hit_ratio", "缓存命中率", lambda: {
+    ("preprocess",): _hit_ratio(preprocess_cache.hits, preprocess_cache.misses),
+    ("result",): _hit_ratio(result_cache.hits, result_cache.misses),
+}, ("cache",))
 
 
 # ============================
@@ -240,15 +398,50 @@ async def task_worker():
 # ============================
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    load_tasks_from_disk()
+    # 共享连接池的模型推理客户端，整个服务生命周期内复用
+    init_async_client()
+    # 常驻图片预处理进程池
+    preprocess_pool.start()
+    # Prompt 有变更的识别类型，其缓存结果全部失效
+    await asyncio.to_thread(result_cache.invalidate_stale_prompts, prompt)
+    await asyncio.to_thread(result_cache.prune)
+    task_store.start()
+    audit_log.start()
+    scheduler.start()
+    await callback_delivery.start()
+    task_checkpoint.start()
+    await load_tasks_from_disk()
+    asyncio.create_task(task_registry.sweep_loop())
+    finish_recovery = asyncio.create_task(shared_finish_recovery_loop()) if SHARED_QUEUE else None
+    if MODEL_IMAGE_TRANSPORT != "base64":
+        asyncio.create_task(shared_image_sweep_loop())
     
-    worker_count = os.cpu_count() or 4
-    for _ in range(worker_count):
-        asyncio.create_task(task_worker())
-    logger.info(f"✅ 启动 {worker_count} 个任务处理器成功")
+    # 推理阶段 Worker 数只决定同时处理的图片数，到模型服务的实际并发由 model_limiter 统一控制
+    pipeline.start()
+    logger.info(f"✅ 启动任务处理流水线成功: {pipeline.stats()['workers']}")
 
     yield
     logger.info("FastAPI 服务关闭，执行清理逻辑中...")
+    # 排空：不再开始新的图片，已取出的图片在超时前处理完成；其余图片重启后按检查点续跑
+    unfinished = await pipeline.drain(SHUTDOWN_DRAIN_TIMEOUT)
+    if unfinished:
+        logger.warning(f"排空超时（{SHUTDOWN_DRAIN_TIMEOUT}s），{unfinished} 张图片未完成，重启后续跑")
+    await pipeline.stop()
+    if SHARED_QUEUE:
+        finish_recovery.cancel()
+        # 未完成的图片归还给其他进程
+        await scheduler.stop()
+    await close_async_client()
+    await close_fetchers()
+    # 未推送完成的结果写入发件箱，下次启动后补推
+    await callback_delivery.stop()
+    preprocess_pool.shutdown()
+    result_cache.close()
+    # 等待后台线程写完剩余任务状态、检查点、审计记录和日志
+    # （任务状态先落盘：提交回调会登记删除已结束任务的检查点）
+    await asyncio.to_thread(task_store.close)
+    await asyncio.to_thread(task_checkpoint.close)
+    await asyncio.to_thread(audit_log.close)
 
 
 # ============================
@@ -261,23 +454,32 @@ app = FastAPI(lifespan=lifespan)
 # API 路由
 # ============================
 @app.post("/vision_engine/image_analysis")
-async def submit_tasks(tasks: List[TaskItem]):
+async def submit_tasks(payload: Union[List[TaskItem], TaskSubmitRequest]):
+    # 兼容两种请求体：任务列表，或带优先级的 {"tasks": [...], "priority": "high"}
+    if isinstance(payload, TaskSubmitRequest):
+        tasks, priority = payload.tasks, scheduler.normalize_priority(payload.priority)
+    else:
+        tasks, priority = payload, DEFAULT_PRIORITY
 
     task_id = str(uuid.uuid4())
     create_time = datetime.now().timestamp()
 
-    task_status[task_id] = {"status": TASK_STATUS_PENDING, "create_time": create_time}
-    task_metadata[task_id] = [t.model_dump() for t in tasks]
-
-    save_task_to_disk(task_id, {"status_info": task_status[task_id], "metadata": task_metadata[task_id]})
+    task_registry.add(
+        task_id,
+        {"status": TASK_STATUS_PENDING, "create_time": create_time, "priority": priority},
+        [t.model_dump() for t in tasks]
+    )
 
     try:
-        task_queue.put_nowait(task_id)
-    except asyncio.QueueFull:
-        del task_status[task_id]
-        del task_metadata[task_id]
+        await enqueue_task(task_id, priority)
+    except SchedulerFull:
+        task_registry.discard(task_id)
         raise HTTPException(status_code=503, detail="任务队列已满，请稍后再试")
 
+    save_task_to_disk(task_id, with_metadata=True)
+    if SHARED_QUEUE:
+        task_registry.discard(task_id)
+
     logger.info(f"任务提交成功: {task_id}（{len(tasks)} 个子任务）")
     return {
         "task_id": task_id,
@@ -300,7 +502,8 @@ async def analyze_images(request: Request, tasks: List[TaskItem]):
     try:
         # 转换任务为字典格式
         tasks_as_dict = [task.model_dump() for task in tasks]
-        logger.info(f"[{request_id}] 同步请求参数: {tasks_as_dict}")
+        logger.info(f"[{request_id}] 同步请求参数: {payload_summary(tasks_as_dict)}")
+        audit_log.record("sync_request", request_id=request_id, tasks=tasks_as_dict)
 
         # 异步调用模型处理
         results = await process_batch_tasks_async(tasks_as_dict)
@@ -317,7 +520,9 @@ async def analyze_images(request: Request, tasks: List[TaskItem]):
         ]
 
         # 记录响应结果
-        logger.info(f"[{request_id}] 同步响应结果: {[r.model_dump() for r in formatted_results]}")
+        response_dump = [r.model_dump() for r in formatted_results]
+        logger.info(f"[{request_id}] 同步响应结果: {payload_summary(response_dump)}")
+        audit_log.record("sync_response", request_id=request_id, response=response_dump)
 
         return formatted_results
     except Exception as e:
@@ -336,26 +541,166 @@ async def analyze_images(request: Request, tasks: List[TaskItem]):
     
 
 
+def format_stream_line(event: str, data: Dict, fmt: str) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    # NDJSON 每行用 type 区分结果行（result）和汇总行（summary）
+    return json.dumps({"type": event, **data}, ensure_ascii=False) + "\n"
+
+
+async def stream_task_results(request: Request, tasks: List[Dict], request_id: str, fmt: str):
+    """
+    按完成顺序逐行输出每张图片的结果，最后输出一行汇总
+    - 同时处理的图片数不超过 STREAM_WINDOW，客户端未读走已输出的结果前不会启动新的图片
+    - 客户端断开后取消本请求尚在处理和排队的图片
+    """
+    start_time = time.time()
+    next_index = 0
+    running: Dict[asyncio.Task, int] = {}
+    counts = {"success": 0, "failed": 0}
+
+    def fill_window():
+        nonlocal next_index
+        while next_index < len(tasks) and len(running) < STREAM_WINDOW:
+            running[asyncio.create_task(process_single_task_async(tasks[next_index]))] = next_index
+            next_index += 1
+
+    try:
+        fill_window()
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                index = running.pop(fut)
+                try:
+                    item = fut.result()
+                except (Exception, asyncio.CancelledError) as e:
+                    # 本请求的图片只在 finally 中取消，这里的取消来自共享的在途计算，按失败输出
+                    item = {"ftp_path": tasks[index].get("ftp_path", "未知路径"), "judgmentInfo": [],
+                            "status": "failed", "error_msg": str(e)}
+                result = TaskResponseItem2(
+                    ftp_path=item["ftp_path"],
+                    judgmentInfo=item.get("judgmentInfo", []),
+                    status=item.get("status", "success"),
+                    error_msg=item.get("error_msg", "")
+                ).model_dump()
+                counts["success" if result["status"] == "success" else "failed"] += 1
+                logger.info(f"[{request_id}] 流式输出结果: {payload_summary(result)}")
+                audit_log.record("stream_result", request_id=request_id, index=index, result=result)
+                # yield 在客户端读走前挂起，形成背压
+                yield format_stream_line("result", {"index": index, **result}, fmt)
+            if await request.is_disconnected():
+                logger.warning(f"[{request_id}] 客户端已断开，取消剩余 {len(tasks) - sum(counts.values())} 张图片")
+                return
+            fill_window()
+
+        yield format_stream_line("summary", {
+            "total": len(tasks),
+            **counts,
+            "elapsed": round(time.time() - start_time, 2)
+        }, fmt)
+    finally:
+        for fut in running:
+            fut.cancel()
+
+
+@app.post("/vision_engine/image_analysis_stream")
+async def analyze_images_stream(request: Request, tasks: List[TaskItem], format: str = "ndjson"):
+    """
+    同步分析的流式版本：每张图片完成后立即输出一行结果（含 ftp_path、index），最后一行为汇总
+    format=ndjson（默认，application/x-ndjson）或 sse（text/event-stream）
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format 仅支持 ndjson 或 sse")
+
+    request_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    tasks_as_dict = [task.model_dump() for task in tasks]
+    logger.info(f"[{request_id}] 流式同步请求参数: {payload_summary(tasks_as_dict)}")
+    audit_log.record("stream_request", request_id=request_id, tasks=tasks_as_dict)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_task_results(request, tasks_as_dict, request_id, format),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/vision_engine/get_result/{task_id}")
-async def get_result(task_id: str):
-    if task_id not in task_status:
+async def get_result(task_id: str, since: int = 0):
+    """
+    查询任务状态与结果
+    response 按图片完成顺序返回；传入上次返回的 next 作为 since，只获取新完成的结果
+    result 为旧版字段：任务完成后返回全部结果
+    """
+    # 共享队列模式下任意进程都可查询；已清理出队列 / 已淘汰出内存的任务从持久化存储按需读取
+    status_info = await shared_task_status(task_id) if SHARED_QUEUE else None
+    if status_info is None:
+        status_info = await task_registry.get_status(task_id)
+    if status_info is None:
         raise HTTPException(status_code=404, detail="任务ID不存在")
-
-    status_info = task_status[task_id].copy()
+    response = status_info.get("response") or []
+    since = max(since, 0)
+    completed = status_info.get("completed", len(response))
     return {
         "task_id": task_id,
         "status": status_info["status"],
         "create_time": status_info["create_time"],
         "end_time": status_info.get("end_time"),
-        "result": status_info.get("result") if status_info["status"] == TASK_STATUS_DONE else None,
+        "completed": completed,
+        "total": status_info.get("total", completed),
+        "response": response[since:],
+        "next": len(response),
+        # 兼容旧版轮询方：任务完成后为全部结果（不受 since 影响），未完成时为 None
+        "result": response if status_info["status"] == TASK_STATUS_DONE else None,
         "error": status_info.get("error") if status_info["status"] == TASK_STATUS_FAILED else None
     }
 
 
+@app.get("/vision_engine/stats")
+async def get_stats():
+    """运行时统计信息（缓存命中率、内存占用等）"""
+    return {
+        "preprocess_cache": preprocess_cache.stats(),
+        "model_limiter": model_limiter.stats(),
+        "model_backends": backend_pool.stats(),
+        "stream_decode": stream_stats.stats(),
+        "preprocess_pool": preprocess_pool.stats(),
+        "result_cache": await asyncio.to_thread(result_cache.stats),
+        "inference_flight": inference_flight.stats(),
+        "task_store": task_store.stats(),
+        "task_registry": task_registry.stats(),
+        "callback_delivery": callback_delivery.stats(),
+        "scheduler": scheduler.stats(),
+        "pipeline": pipeline.stats(),
+        "task_checkpoint": task_checkpoint.stats(),
+        "logging": logging_stats(),
+        "audit_log": audit_log.stats(),
+    }
+
+
+@app.get("/vision_engine/images/{name}")
+async def get_shared_image(name: str):
+    """url 传输方式下供模型服务拉取预处理后的图片"""
+    path = shared_image_path(name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="图片不存在或已清理")
+    return FileResponse(path, media_type="image/jpeg")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 文本格式的运行指标：各阶段耗时直方图（按 identifyType）、队列深度、在途调用、缓存命中率"""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
 # ============================
 # 主入口
 # ============================
 if __name__ == "__main__":
     import uvicorn
-    logger.info("启动 FastAPI 服务...")
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("API_PORT", 5000)), workers=1)
\ No newline at end of file
+    if API_WORKERS > 1 and not SHARED_QUEUE:
+        raise SystemExit("API_WORKERS 大于1时需使用共享任务队列（TASK_QUEUE_BACKEND=sqlite）")
+    logger.info(f"启动 FastAPI 服务（{API_WORKERS} 个进程）...")
+    # 多进程时由 uvicorn 按模块路径在各子进程中分别加载应用
+    uvicorn.run("server:app" if API_WORKERS > 1 else app, host="0.0.0.0",
+                port=int(os.environ.get("API_PORT", 5000)), workers=API_WORKERS)
\ No newline at end of file
@@ -0,0 +1,67 @@
+# singleflight.py
+import asyncio
+from typing import Dict, Hashable, Optional
+
+
+class LeaderCancelled(Exception):
+    """合并等待的在途调用因执行者被取消而中止（不是调用本身出错）"""
+
+
+class SingleFlight:
+    """在途请求合并：相同键的并发调用只执行一次，其余调用等待同一个 Future
+
+    用法：
+        fut = flight.join(key)          # 已有在途调用时返回其 Future
+        if fut is None:
+            flight.lead(key)            # 成为执行者
+            ...
+            flight.resolve(key, result=...) / flight.resolve(key, error=...)
+
+    执行者被取消时等待者收到 LeaderCancelled，应重新 join / lead 自行执行，
+    而不是把与自己无关的取消当作失败；只有执行中的真实错误才传递给等待者
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.leader_calls = 0
+        self.shared_calls = 0  # 被合并、节省下来的调用次数
+        self.leader_cancels = 0  # 执行者被取消、等待者需要重新执行的次数
+
+    def join(self, key: Hashable) -> Optional[asyncio.Future]:
+        fut = self._calls.get(key)
+        if fut is not None:
+            self.shared_calls += 1
+        return fut
+
+    def lead(self, key: Hashable) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._calls[key] = fut
+        self.leader_calls += 1
+        return fut
+
+    def resolve(self, key: Hashable, result=None, error: BaseException = None) -> None:
+        fut = self._calls.pop(key, None)
+        if fut is None or fut.done():
+            return
+        if error is None:
+            fut.set_result(result)
+            return
+        if isinstance(error, asyncio.CancelledError):
+            # 执行者被取消不应连带取消等待者，等待者收到 LeaderCancelled 后重新执行
+            self.leader_cancels += 1
+            error = LeaderCancelled("共享的推理请求已被取消")
+        fut.set_exception(error)
+        # 标记异常已读取，避免无等待者时打印 "Future exception was never retrieved"
+        fut.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "leader_calls": self.leader_calls,
+            "shared_calls": self.shared_calls,
+            "leader_cancels": self.leader_cancels,
+        }
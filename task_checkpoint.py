@@ -0,0 +1,193 @@
+# task_checkpoint.py
+"""异步任务的逐图片 / 逐识别类型检查点
+
+- 每张图片完成即记录其结果（含完成顺序），每个识别类型推理完成即记录该类型的结果
+- 服务重启后恢复的任务只调度未完成的图片；中断时处理到一半的图片只推理尚未完成的类型
+- 记录只放入内存队列，由后台线程攒批写入 SQLite，不阻塞事件循环；任务收尾后删除
+"""
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from task_store import TASK_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# 检查点配置
+# ============================
+TASK_CHECKPOINT_ENABLED = os.environ.get("TASK_CHECKPOINT_ENABLED", "1") == "1"
+TASK_CHECKPOINT_PATH = Path(os.environ.get("TASK_CHECKPOINT_PATH", str(TASK_DATA_DIR / "checkpoints.db")))
+# 后台写线程单批最多合并的记录数 / 等待凑批的最长时间（秒）
+TASK_CHECKPOINT_BATCH_SIZE = int(os.environ.get("TASK_CHECKPOINT_BATCH_SIZE", 500))
+TASK_CHECKPOINT_BATCH_WAIT = float(os.environ.get("TASK_CHECKPOINT_BATCH_WAIT", 0.05))
+
+
+class TaskCheckpoint:
+    def __init__(self, path: Path = TASK_CHECKPOINT_PATH, enabled: bool = TASK_CHECKPOINT_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        # 写操作按登记顺序执行：("image", task_id, 下标, 完成序号, 结果) / ("type", task_id, 下标, 类型, 结果) / ("clear", task_id)
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+        self._writer = None
+        self.images = 0
+        self.types = 0
+        self.batches = 0
+        self.errors = 0
+
+    # ---------- 生命周期 ----------
+    def start(self) -> None:
+        if not self.enabled or self._writer is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS image_checkpoints (
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                PRIMARY KEY (task_id, idx)
+            );
+            CREATE TABLE IF NOT EXISTS type_checkpoints (
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                identify_type TEXT NOT NULL,
+                result TEXT NOT NULL,
+                PRIMARY KEY (task_id, idx, identify_type)
+            );
+        """)
+        self._writer = threading.Thread(target=self._write_loop, name="task-checkpoint-writer", daemon=True)
+        self._writer.start()
+
+    def close(self) -> None:
+        """写完队列中剩余记录后停止后台线程"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._read_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- 登记 ----------
+    def record_image(self, task_id: str, index: int, seq: int, result: Dict) -> None:
+        """一张图片完成；seq 为任务内的完成序号，恢复时按此顺序重建结果列表"""
+        if self._writer is not None:
+            self._queue.put(("image", task_id, index, seq, json.dumps(result, ensure_ascii=False)))
+
+    def record_type(self, task_id: str, index: int, identify_type: str, result: Dict) -> None:
+        """一张图片的一个识别类型完成"""
+        if self._writer is not None:
+            self._queue.put(("type", task_id, index, identify_type, json.dumps(result, ensure_ascii=False)))
+
+    def clear(self, task_id: str) -> None:
+        """任务已收尾（完整结果已在任务存储中），删除其检查点"""
+        if self._writer is not None:
+            self._queue.put(("clear", task_id))
+
+    def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            ops = [self._queue.get()]
+            deadline = time.monotonic() + TASK_CHECKPOINT_BATCH_WAIT
+            while len(ops) < TASK_CHECKPOINT_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    ops.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in ops:
+                stopping = True
+                # 停止前取尽队列中剩余记录
+                while True:
+                    try:
+                        ops.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+            ops = [op for op in ops if op is not None]
+            if not ops:
+                continue
+            try:
+                self._write_batch(ops)
+                self.batches += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"检查点写入失败（{len(ops)} 条）: {e}")
+
+    def _write_batch(self, ops: List[tuple]) -> None:
+        with self._read_lock, self._conn:
+            for op in ops:
+                if op[0] == "image":
+                    self._conn.execute("INSERT OR REPLACE INTO image_checkpoints (task_id, idx, seq, result) "
+                                       "VALUES (?, ?, ?, ?)", op[1:])
+                    self.images += 1
+                elif op[0] == "type":
+                    self._conn.execute("INSERT OR REPLACE INTO type_checkpoints (task_id, idx, identify_type, result) "
+                                       "VALUES (?, ?, ?, ?)", op[1:])
+                    self.types += 1
+                else:
+                    self._conn.execute("DELETE FROM image_checkpoints WHERE task_id = ?", (op[1],))
+                    self._conn.execute("DELETE FROM type_checkpoints WHERE task_id = ?", (op[1],))
+
+    # ---------- 恢复 ----------
+    def load_images(self, task_id: str) -> List[Tuple[int, Dict]]:
+        """任务已完成的图片 [(下标, 结果)]，按完成顺序"""
+        if self._conn is None:
+            return []
+        with self._read_lock:
+            rows = self._conn.execute(
+                "SELECT idx, result FROM image_checkpoints WHERE task_id = ? ORDER BY seq", (task_id,)).fetchall()
+        return [(idx, json.loads(result)) for idx, result in rows]
+
+    def load_types(self, task_id: str, index: int) -> Dict[str, Dict]:
+        """一张图片已完成的识别类型 {类型: 结果}"""
+        if self._conn is None:
+            return {}
+        with self._read_lock:
+            rows = self._conn.execute(
+                "SELECT identify_type, result FROM type_checkpoints WHERE task_id = ? AND idx = ?",
+                (task_id, index)).fetchall()
+        return {identify_type: json.loads(result) for identify_type, result in rows}
+
+    def prune(self, keep_task_ids: Iterable[str]) -> int:
+        """删除不属于未完成任务的检查点（如任务收尾后、删除记录前进程退出），返回删除的任务数"""
+        if self._conn is None:
+            return 0
+        keep = set(keep_task_ids)
+        with self._read_lock, self._conn:
+            task_ids = {r[0] for r in self._conn.execute(
+                "SELECT DISTINCT task_id FROM image_checkpoints UNION SELECT DISTINCT task_id FROM type_checkpoints")}
+            stale = [(task_id,) for task_id in task_ids - keep]
+            self._conn.executemany("DELETE FROM image_checkpoints WHERE task_id = ?", stale)
+            self._conn.executemany("DELETE FROM type_checkpoints WHERE task_id = ?", stale)
+        return len(stale)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "path": str(self.path),
+            "queued": self._queue.qsize(),
+            "images": self.images,
+            "types": self.types,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+
+# 进程级共享检查点
+task_checkpoint = TaskCheckpoint()
@@ -0,0 +1,101 @@
+# task_registry.py
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from task_store import TaskStore
+
+
+# ============================
+# 内存任务表配置
+# ============================
+# 已结束任务在内存中保留的时长（秒），超时后只能从持久化存储查询
+TASK_REGISTRY_TTL = float(os.environ.get("TASK_REGISTRY_TTL", 3600))
+# 内存中最多保留的已结束任务数
+TASK_REGISTRY_MAX_FINISHED = int(os.environ.get("TASK_REGISTRY_MAX_FINISHED", 10000))
+# 过期清理周期（秒）
+TASK_REGISTRY_SWEEP_INTERVAL = float(os.environ.get("TASK_REGISTRY_SWEEP_INTERVAL", 60))
+
+
+class TaskRegistry:
+    """有界的内存任务表
+
+    - status / metadata 保存进行中任务和最近结束的任务
+    - 任务结束后立即释放 metadata（持久化存储中仍有），status 按 TTL / 数量上限淘汰
+    - 被淘汰的任务查询时回退到持久化存储
+    """
+
+    def __init__(self, store: TaskStore, ttl: float = TASK_REGISTRY_TTL,
+                 max_finished: int = TASK_REGISTRY_MAX_FINISHED):
+        self.store = store
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.status: Dict[str, Dict] = {}
+        self.metadata: Dict[str, List[Dict]] = {}
+        # 已结束任务：task_id -> (结束时间, 估算字节数)，按结束顺序排列
+        self._finished: "OrderedDict[str, tuple]" = OrderedDict()
+        self.finished_bytes = 0
+        self.evictions = 0
+        self.store_lookups = 0
+
+    def add(self, task_id: str, status_info: Dict, metadata: List[Dict]) -> None:
+        self.status[task_id] = status_info
+        self.metadata[task_id] = metadata
+
+    def discard(self, task_id: str) -> None:
+        self.status.pop(task_id, None)
+        self.metadata.pop(task_id, None)
+
+    def mark_finished(self, task_id: str, approx_bytes: int = 0) -> None:
+        """任务结束：释放任务参数，结果转入可淘汰区"""
+        self.metadata.pop(task_id, None)
+        old = self._finished.pop(task_id, None)
+        if old is not None:
+            self.finished_bytes -= old[1]
+        self._finished[task_id] = (time.monotonic(), approx_bytes)
+        self.finished_bytes += approx_bytes
+        self.evict()
+
+    def evict(self) -> int:
+        """淘汰超过 TTL 或超出数量上限的已结束任务，返回淘汰数"""
+        now = time.monotonic()
+        evicted = 0
+        while self._finished:
+            task_id, (finished_at, approx_bytes) = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_finished and now - finished_at < self.ttl:
+                break
+            self._finished.popitem(last=False)
+            self.finished_bytes -= approx_bytes
+            self.status.pop(task_id, None)
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    async def sweep_loop(self, interval: float = TASK_REGISTRY_SWEEP_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.evict()
+
+    async def get_status(self, task_id: str) -> Optional[Dict]:
+        """查询任务状态，内存中没有时从持久化存储读取"""
+        status_info = self.status.get(task_id)
+        if status_info is not None:
+            return status_info.copy()
+        self.store_lookups += 1
+        stored = await asyncio.to_thread(self.store.get, task_id)
+        return stored["status_info"] if stored else None
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self.status),
+            "active": len(self.status) - len(self._finished),
+            "finished_in_memory": len(self._finished),
+            "finished_bytes": self.finished_bytes,
+            "metadata_entries": len(self.metadata),
+            "ttl": self.ttl,
+            "max_finished": self.max_finished,
+            "evictions": self.evictions,
+            "store_lookups": self.store_lookups,
+        }
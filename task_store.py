@@ -0,0 +1,334 @@
+# task_store.py
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# 存储配置
+# ============================
+# 任务存储后端：sqlite（默认，WAL模式单库）或 json（旧版每任务一个文件）
+TASK_STORE_BACKEND = os.environ.get("TASK_STORE_BACKEND", "sqlite")
+TASK_DATA_DIR = Path(os.environ.get("TASK_DATA_DIR", "./task_data"))
+TASK_STORE_PATH = Path(os.environ.get("TASK_STORE_PATH", str(TASK_DATA_DIR / "tasks.db")))
+# 后台写线程单批最多合并的记录数 / 等待凑批的最长时间（秒）
+TASK_STORE_BATCH_SIZE = int(os.environ.get("TASK_STORE_BATCH_SIZE", 500))
+TASK_STORE_BATCH_WAIT = float(os.environ.get("TASK_STORE_BATCH_WAIT", 0.05))
+
+UNFINISHED_STATUSES = ("pending", "processing")
+# 已存储的任务已结束、新写入的是未结束状态
+KEEP_FINISHED = "tasks.status NOT IN ('pending', 'processing') AND excluded.status IN ('pending', 'processing')"
+
+
+# ============================
+# 存储基类：后台批量写入
+# ============================
+class TaskStore:
+    """任务持久化存储基类
+
+    save() 只在内存中登记并入队，由后台线程合并批量写入，调用方（事件循环）不等待磁盘；
+    同一任务在一个批次内的多次保存只写最后一次。需要在落盘之后执行的操作通过 on_commit 登记。
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        # 尚未落盘的记录：task_id -> (status_info_json, metadata_json 或 None)
+        self._pending: Dict[str, Tuple[str, Optional[str]]] = {}
+        self._pending_lock = threading.Lock()
+        # 等待记录提交的回调：task_id -> [回调]
+        self._on_commit: Dict[str, List[Callable[[], None]]] = {}
+        self._writer = None
+        self.writes = 0
+        self.batches = 0
+
+    # ---------- 生命周期 ----------
+    def start(self) -> None:
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="task-store-writer", daemon=True)
+            self._writer.start()
+
+    def close(self) -> None:
+        """写完所有待落盘记录后停止后台线程"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    # ---------- 写入 ----------
+    def save(self, task_id: str, status_info: Dict, metadata: Optional[List[Dict]] = None,
+             on_commit: Optional[Callable[[], None]] = None) -> int:
+        """登记任务状态（metadata 为 None 时保留已存储的任务参数），返回序列化后的字节数
+        on_commit 在本次登记的记录（或覆盖它的更新记录）提交后由后台写线程调用
+        """
+        status_json = json.dumps(status_info, ensure_ascii=False)
+        metadata_json = json.dumps(metadata, ensure_ascii=False) if metadata is not None else None
+        with self._pending_lock:
+            previous = self._pending.get(task_id)
+            if metadata_json is None and previous is not None:
+                metadata_json = previous[1]
+            self._pending[task_id] = (status_json, metadata_json)
+            if on_commit is not None:
+                self._on_commit.setdefault(task_id, []).append(on_commit)
+        self._queue.put(task_id)
+        return len(status_json) + len(metadata_json or "")
+
+    def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            task_ids = [self._queue.get()]
+            deadline = time.monotonic() + TASK_STORE_BATCH_WAIT
+            while len(task_ids) < TASK_STORE_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    task_ids.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in task_ids:
+                stopping = True
+                # 停止前取尽队列中剩余记录
+                while True:
+                    try:
+                        task_ids.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+            with self._pending_lock:
+                records = {}
+                callbacks = {}
+                for task_id in task_ids:
+                    if task_id is not None and task_id in self._pending and task_id not in records:
+                        records[task_id] = self._pending[task_id]
+                        # 与记录一同取出：写入期间新登记的回调等待其对应的记录
+                        if task_id in self._on_commit:
+                            callbacks[task_id] = self._on_commit.pop(task_id)
+            if not records:
+                continue
+            try:
+                self._write_batch(records)
+                self.writes += len(records)
+                self.batches += 1
+            except Exception as e:
+                logger.error(f"任务存储批量写入失败（{len(records)} 条），稍后重试: {e}")
+                if not stopping:
+                    with self._pending_lock:
+                        for task_id, pending in callbacks.items():
+                            self._on_commit[task_id] = pending + self._on_commit.get(task_id, [])
+                    time.sleep(1)
+                    for task_id in records:
+                        self._queue.put(task_id)
+                continue
+            with self._pending_lock:
+                for task_id, record in records.items():
+                    # 写入期间又有新的保存时保留新记录
+                    if self._pending.get(task_id) is record:
+                        del self._pending[task_id]
+            for task_id, pending in callbacks.items():
+                for callback in pending:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logger.error(f"任务 {task_id} 落盘回调执行失败: {e}")
+
+    # ---------- 读取 ----------
+    def get(self, task_id: str) -> Optional[Dict]:
+        """按任务ID查询，返回 {"status_info": ..., "metadata": ...}"""
+        with self._pending_lock:
+            record = self._pending.get(task_id)
+        if record is not None and record[1] is not None:
+            return {"status_info": json.loads(record[0]), "metadata": json.loads(record[1])}
+        stored = self._read(task_id)
+        if stored is not None and record is not None:
+            stored["status_info"] = json.loads(record[0])
+        return stored
+
+    def stats(self) -> Dict:
+        return {
+            "backend": type(self).__name__,
+            "pending_writes": len(self._pending),
+            "writes": self.writes,
+            "batches": self.batches,
+        }
+
+    # ---------- 子类实现 ----------
+    def _write_batch(self, records: Dict[str, Tuple[str, Optional[str]]]) -> None:
+        raise NotImplementedError
+
+    def _read(self, task_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def load_unfinished(self) -> List[Tuple[str, Dict, List[Dict]]]:
+        """返回所有 pending/processing 任务 [(task_id, status_info, metadata)]"""
+        raise NotImplementedError
+
+
+# ============================
+# 旧版：每任务一个 JSON 文件
+# ============================
+class JsonDirTaskStore(TaskStore):
+    def __init__(self, data_dir: Path = TASK_DATA_DIR):
+        super().__init__()
+        self.data_dir = data_dir
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+
+    def _write_batch(self, records):
+        for task_id, (status_json, metadata_json) in records.items():
+            if metadata_json is None:
+                existing = self._read(task_id)
+                metadata_json = json.dumps(existing["metadata"] if existing else [], ensure_ascii=False)
+            with open(self.data_dir / f"{task_id}.json", "w", encoding="utf-8") as f:
+                f.write(f'{{"status_info": {status_json}, "metadata": {metadata_json}}}')
+
+    def _read(self, task_id):
+        file = self.data_dir / f"{task_id}.json"
+        if not file.exists():
+            return None
+        with open(file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_unfinished(self):
+        tasks = []
+        for file in self.data_dir.glob("*.json"):
+            try:
+                with open(file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data["status_info"]["status"] in UNFINISHED_STATUSES:
+                    tasks.append((file.stem, data["status_info"], data["metadata"]))
+            except Exception as e:
+                logger.error(f"读取任务文件 {file} 失败: {e}")
+        return tasks
+
+
+# ============================
+# SQLite（WAL）存储
+# ============================
+class SQLiteTaskStore(TaskStore):
+    def __init__(self, path: Path = TASK_STORE_PATH, legacy_dir: Path = TASK_DATA_DIR):
+        super().__init__()
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._read_lock = threading.Lock()
+        self._write_conn = None
+        self._read_conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+            self._read_conn = self._connect()
+            self._create_schema()
+            self._migrate_legacy_json()
+        super().start()
+
+    def close(self):
+        super().close()
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
+    def _create_schema(self) -> None:
+        self._write_conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                create_time REAL,
+                end_time REAL,
+                status_info TEXT NOT NULL,
+                metadata TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+        """)
+
+    def _write_batch(self, records):
+        now = time.time()
+        rows = []
+        for task_id, (status_json, metadata_json) in records.items():
+            status_info = json.loads(status_json)
+            rows.append((task_id, status_info.get("status"), status_info.get("create_time"),
+                         status_info.get("end_time"), status_json, metadata_json, now))
+        # 多进程共享存储时，其他进程迟到的中间状态（pending/processing）不覆盖已结束的任务，
+        # 否则重启后该任务会被当作未完成重新处理
+        with self._write_conn:
+            self._write_conn.executemany(f"""
+                INSERT INTO tasks (task_id, status, create_time, end_time, status_info, metadata, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(task_id) DO UPDATE SET
+                    status = CASE WHEN {KEEP_FINISHED} THEN tasks.status ELSE excluded.status END,
+                    create_time = excluded.create_time,
+                    end_time = CASE WHEN {KEEP_FINISHED} THEN tasks.end_time ELSE excluded.end_time END,
+                    status_info = CASE WHEN {KEEP_FINISHED} THEN tasks.status_info ELSE excluded.status_info END,
+                    metadata = COALESCE(excluded.metadata, tasks.metadata),
+                    updated_at = excluded.updated_at
+            """, rows)
+
+    def _read(self, task_id):
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT status_info, metadata FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"status_info": json.loads(row[0]), "metadata": json.loads(row[1]) if row[1] else []}
+
+    def load_unfinished(self):
+        placeholders = ",".join("?" * len(UNFINISHED_STATUSES))
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                f"SELECT task_id, status_info, metadata FROM tasks WHERE status IN ({placeholders}) "
+                f"ORDER BY create_time",
+                UNFINISHED_STATUSES,
+            ).fetchall()
+        return [(task_id, json.loads(status), json.loads(meta) if meta else []) for task_id, status, meta in rows]
+
+    def _migrate_legacy_json(self) -> None:
+        """首次启用 SQLite 时导入旧版 task_data/*.json（只执行一次）"""
+        marker = self.legacy_dir / ".migrated_to_sqlite"
+        if marker.exists() or not self.legacy_dir.exists():
+            return
+        rows = []
+        now = time.time()
+        for file in self.legacy_dir.glob("*.json"):
+            try:
+                with open(file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                status_info = data["status_info"]
+                rows.append((file.stem, status_info.get("status"), status_info.get("create_time"),
+                             status_info.get("end_time"), json.dumps(status_info, ensure_ascii=False),
+                             json.dumps(data["metadata"], ensure_ascii=False), now))
+            except Exception as e:
+                logger.error(f"迁移任务文件 {file} 失败: {e}")
+        if rows:
+            with self._write_conn:
+                self._write_conn.executemany(
+                    "INSERT OR IGNORE INTO tasks (task_id, status, create_time, end_time, status_info, metadata, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            logger.info(f"已将 {len(rows)} 个旧版任务文件迁移到 {self.path}")
+        marker.touch()
+
+
+def create_task_store(backend: str = TASK_STORE_BACKEND) -> TaskStore:
+    if backend == "json":
+        return JsonDirTaskStore()
+    if backend == "sqlite":
+        return SQLiteTaskStore()
+    raise ValueError(f"未知的任务存储后端：{backend}")
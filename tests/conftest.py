@@ -0,0 +1,6 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+# 服务模块位于仓库根目录（非安装包），测试直接按顶层模块导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
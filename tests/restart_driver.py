@@ -0,0 +1,88 @@
+# tests/restart_driver.py
+"""test_checkpoint_resume 的子进程入口：在独立进程中运行一次服务生命周期
+
+    python restart_driver.py interrupt <输出文件>   提交任务，部分图片完成后关闭服务（模拟中断）
+    python restart_driver.py resume <输出文件>      重启服务，恢复任务直到完成
+
+推理阶段替换为按 ftp_path 控制的假推理，记录每张图片实际推理的识别类型
+"""
+import sys
+import json
+import asyncio
+
+import pipeline
+import server
+from main_async import PreparedTask
+
+PHASE, OUTPUT = sys.argv[1], sys.argv[2]
+inferred = {}  # 图片路径 -> 实际推理的识别类型
+
+
+async def fake_fetch(task):
+    return PreparedTask(task)
+
+
+async def fake_preprocess(prepared):
+    return None
+
+
+async def fake_process(task, prepared):
+    path = task["ftp_path"]
+    judgment = []
+    for identify_type in task["identifyType"]:
+        if identify_type in prepared.resumed:
+            judgment.append(prepared.resumed[identify_type])
+            continue
+        if PHASE == "interrupt":
+            if path == "/img/slow.jpg":
+                # 排空期间完成的图片
+                await asyncio.sleep(0.3)
+            elif path == "/img/half.jpg" and inferred.get(path):
+                # 第一个类型已完成、第二个类型推理中时服务关闭
+                await asyncio.Event().wait()
+            elif path.startswith("/img/hang"):
+                await asyncio.Event().wait()
+        inferred.setdefault(path, []).append(identify_type)
+        result = {"identifyType": identify_type, "result": "不存在", "sceneDesc": PHASE}
+        prepared.on_type_result(identify_type, result)
+        judgment.append(result)
+    return {"ftp_path": path, "judgmentInfo": judgment, "status": "success", "error_msg": ""}
+
+
+pipeline.fetch_task_async = fake_fetch
+pipeline.preprocess_task_async = fake_preprocess
+pipeline.process_single_task_async = fake_process
+
+
+async def wait_until(predicate, timeout: float = 20) -> None:
+    for _ in range(int(timeout / 0.02)):
+        if predicate():
+            return
+        await asyncio.sleep(0.02)
+    raise TimeoutError(PHASE)
+
+
+async def main():
+    output = {}
+    async with server.lifespan(server.app):
+        if PHASE == "interrupt":
+            paths = ["/img/fast.jpg", "/img/slow.jpg", "/img/half.jpg", "/img/hang1.jpg", "/img/hang2.jpg"]
+            payload = server.TaskSubmitRequest(tasks=[
+                server.TaskItem(ftp_path=p, identifyType=["道路-积水", "道路-破损"]) for p in paths])
+            task_id = (await server.submit_tasks(payload))["task_id"]
+            await wait_until(lambda: server.task_status[task_id]["completed"] >= 1
+                             and "/img/half.jpg" in inferred and "/img/slow.jpg" in inferred)
+        else:
+            task_id = next(iter(server.task_status))
+            output["resumed_completed"] = server.task_status[task_id]["completed"]
+            output["polled"] = await server.get_result(task_id, since=0)
+            await wait_until(lambda: server.task_status[task_id]["status"] == server.TASK_STATUS_DONE)
+            output["response"] = server.task_status[task_id]["response"]
+            output["polled_done"] = await server.get_result(task_id, since=3)
+    output["task_id"] = task_id
+    output["inferred"] = inferred
+    with open(OUTPUT, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False)
+
+
+asyncio.run(main())
@@ -0,0 +1,47 @@
+# tests/test_answer_parsing.py
+import pytest
+
+from main_async import parse_model_answer, parse_multi_model_answer
+
+
+# ==============================
+# 单类型回答
+# ==============================
+def test_parse_model_answer_array_with_single_quotes():
+    answer = "判断如下：[{'状态':'存在','描述':'画面左侧有人员未佩戴安全帽'}] 以上。"
+    assert parse_model_answer("安全帽", answer) == {
+        "identifyType": "安全帽", "result": "存在", "sceneDesc": "画面左侧有人员未佩戴安全帽"}
+
+
+def test_parse_model_answer_fast_path_strict_object():
+    # 结构化输出（仅判定模式）返回严格 JSON 对象，不含描述
+    assert parse_model_answer("烟火", ' {"状态": "不存在"} ') == {
+        "identifyType": "烟火", "result": "不存在", "sceneDesc": ""}
+
+
+def test_parse_model_answer_fast_path_falls_back_to_array():
+    # 以 { 开头但不是合法判定对象时，回落到数组提取
+    answer = '{"说明": "见下"} [{"状态":"存在","描述":"有积水"}]'
+    assert parse_model_answer("积水", answer)["result"] == "存在"
+
+
+def test_parse_model_answer_invalid_raises():
+    with pytest.raises(ValueError, match="解析失败"):
+        parse_model_answer("积水", "无法判断")
+
+
+# ==============================
+# 多问题合并回答
+# ==============================
+def test_parse_multi_model_answer_whole_object():
+    answer = '{"安全帽": [{"状态":"存在","描述":"未佩戴"}], "烟火": {"状态":"不存在"}}'
+    parsed = parse_multi_model_answer(["安全帽", "烟火"], answer)
+    assert parsed["安全帽"] == {"identifyType": "安全帽", "result": "存在", "sceneDesc": "未佩戴"}
+    assert parsed["烟火"] == {"identifyType": "烟火", "result": "不存在", "sceneDesc": ""}
+
+
+def test_parse_multi_model_answer_per_type_fallback_and_missing():
+    # 整体不是合法 JSON（缺少结尾括号）时按类型名逐个提取，缺失的类型不在结果中
+    answer = "结果：{'安全帽': [{'状态':'不存在','描述':'均已佩戴'}], '烟火': {'状态':'存在'"
+    parsed = parse_multi_model_answer(["安全帽", "烟火", "积水"], answer)
+    assert parsed == {"安全帽": {"identifyType": "安全帽", "result": "不存在", "sceneDesc": "均已佩戴"}}
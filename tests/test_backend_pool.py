@@ -0,0 +1,102 @@
+# tests/test_backend_pool.py
+import asyncio
+
+import pytest
+
+from model import backend_pool
+from model.backend_pool import BackendPool, CIRCUIT_CLOSED, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN
+
+A = "http://a:8000/v1/chat/completions"
+B = "http://b:8000/v1/chat/completions"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(backend_pool, "BACKEND_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(backend_pool, "BACKEND_EJECT_SECONDS", 10)
+    monkeypatch.setattr(backend_pool, "BACKEND_EJECT_MAX_SECONDS", 25)
+    monkeypatch.setattr(backend_pool, "BACKEND_AFFINITY", False)
+    return BackendPool([{"url": A}, {"url": B}])
+
+
+def call(pool: BackendPool, failed: bool, exclude=()):
+    with pool.route(exclude=exclude) as c:
+        c.failed = failed
+    return c.backend
+
+
+def expire(backend) -> None:
+    """跳过冷却期"""
+    backend.open_until = 0.0
+
+
+def test_consecutive_failures_open_circuit(pool):
+    a, b = pool.backends
+    call(pool, failed=True, exclude=(b,))
+    # 成功一次即清零连续失败计数
+    call(pool, failed=False, exclude=(b,))
+    assert a.circuit == CIRCUIT_CLOSED
+    call(pool, failed=True, exclude=(b,))
+    call(pool, failed=True, exclude=(b,))
+    assert a.circuit == CIRCUIT_OPEN
+    assert a.ejections == 1
+    # 熔断期间不参与路由
+    assert all(pool.select() is b for _ in range(5))
+
+
+def test_half_open_allows_single_trial_and_recovers(pool):
+    a, b = pool.backends
+    for _ in range(2):
+        call(pool, failed=True, exclude=(b,))
+    expire(a)
+    with pool.route(exclude=(b,)) as trial:
+        assert trial.backend is a
+        assert a.circuit == CIRCUIT_HALF_OPEN
+        # 试探请求在途时不再放行其他请求
+        assert pool.select() is b
+    assert a.circuit == CIRCUIT_CLOSED
+    assert a.consecutive_failures == 0
+    assert a.eject_seconds == 10
+
+
+def test_failed_trial_doubles_cooldown(pool):
+    a, b = pool.backends
+    for _ in range(2):
+        call(pool, failed=True, exclude=(b,))
+    for expected in (20, 25):
+        expire(a)
+        assert call(pool, failed=True, exclude=(b,)) is a
+        assert a.circuit == CIRCUIT_OPEN
+        assert a.eject_seconds == expected
+    assert a.ejections == 3
+    expire(a)
+    call(pool, failed=False, exclude=(b,))
+    assert a.circuit == CIRCUIT_CLOSED
+    assert a.eject_seconds == 10
+
+
+def test_cancelled_call_is_not_a_failure(pool):
+    a, b = pool.backends
+    for _ in range(2):
+        call(pool, failed=True, exclude=(b,))
+    expire(a)
+    with pytest.raises(asyncio.CancelledError):
+        with pool.route(exclude=(b,)) as trial:
+            assert trial.backend is a
+            raise asyncio.CancelledError()
+    # 被取消的试探不改变熔断状态，可以重新试探
+    assert a.circuit == CIRCUIT_HALF_OPEN
+    assert not a.trial_in_flight
+    assert a.failures == 2
+    assert a.in_flight == 0
+
+
+def test_all_unavailable_falls_back(pool):
+    a, b = pool.backends
+    a.healthy = False
+    for _ in range(2):
+        call(pool, failed=True, exclude=(a,))
+    assert b.circuit == CIRCUIT_OPEN
+    # 全部不可用时仍选择负载最低的实例
+    assert pool.select() in (a, b)
+    assert pool.fallbacks == 1
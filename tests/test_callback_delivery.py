@@ -0,0 +1,136 @@
+# tests/test_callback_delivery.py
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import callback_delivery
+from callback_delivery import CallbackDelivery, FailedPushOutbox
+
+URL = "http://receiver/callback"
+
+
+def record(task_id: str, url: str = URL):
+    return {"task_id": task_id, "callback_url": url, "data": {"taskId": task_id, "response": []}, "time": "t"}
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return FailedPushOutbox(tmp_path / "failed_push.jsonl")
+
+
+class Receiver:
+    """记录收到的请求体，status 为返回的状态码"""
+
+    def __init__(self):
+        self.payloads = []
+        self.status = 200
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.payloads.append(json.loads(request.content))
+        return httpx.Response(self.status)
+
+
+@pytest.fixture
+def delivery(outbox):
+    receiver = Receiver()
+    delivery = CallbackDelivery(URL, outbox)
+    delivery._client = httpx.AsyncClient(transport=httpx.MockTransport(receiver))
+    delivery.receiver = receiver
+    return delivery
+
+
+# ==============================
+# 发件箱
+# ==============================
+def test_append_read_compact_keeps_new_tail(outbox):
+    outbox.append([record("a"), record("b")])
+    records, offset = outbox.read()
+    assert [r["task_id"] for r in records] == ["a", "b"]
+    # 读取之后、压缩之前追加的记录不会丢失
+    outbox.append([record("c")])
+    outbox.compact([records[1]], offset)
+    assert [r["task_id"] for r in outbox.read()[0]] == ["b", "c"]
+
+
+def test_read_skips_corrupt_lines(outbox):
+    outbox.append([record("a")])
+    with open(outbox.path, "a", encoding="utf-8") as f:
+        f.write("{损坏的记录\n")
+    outbox.append([record("b")])
+    assert [r["task_id"] for r in outbox.read()[0]] == ["a", "b"]
+
+
+def test_migrate_legacy(outbox, tmp_path):
+    legacy = tmp_path / "failed_push.json"
+    legacy.write_text(json.dumps([record("old1"), record("old2")], ensure_ascii=False), encoding="utf-8")
+    assert outbox.migrate_legacy(legacy) == 2
+    assert not legacy.exists()
+    assert (tmp_path / "failed_push.json.migrated").exists()
+    assert [r["task_id"] for r in outbox.read()[0]] == ["old1", "old2"]
+    # 已迁移过不再重复迁移
+    assert outbox.migrate_legacy(legacy) == 0
+
+
+# ==============================
+# 补推
+# ==============================
+def test_redelivery_uses_live_payload_shape(delivery, monkeypatch):
+    monkeypatch.setattr(callback_delivery, "CALLBACK_BATCH_SIZE", 2)
+    delivery.outbox.append([record("a"), record("b"), record("c"), record("d", "http://old/callback")])
+
+    asyncio.run(delivery._redeliver_once())
+    # 批量推送时补推同样为列表，按回调地址分批
+    assert delivery.receiver.payloads == [
+        [record("a")["data"], record("b")["data"]],
+        [record("c")["data"]],
+        [record("d")["data"]],
+    ]
+    assert delivery.redelivered == 4
+    assert delivery.outbox.read()[0] == []
+
+
+def test_redelivery_single_payload(delivery, monkeypatch):
+    monkeypatch.setattr(callback_delivery, "CALLBACK_BATCH_SIZE", 1)
+    delivery.outbox.append([record("a"), record("b")])
+    asyncio.run(delivery._redeliver_once())
+    assert delivery.receiver.payloads == [record("a")["data"], record("b")["data"]]
+
+
+def test_live_batch_payload_is_a_list(delivery, monkeypatch):
+    monkeypatch.setattr(callback_delivery, "CALLBACK_BATCH_SIZE", 2)
+    monkeypatch.setattr(callback_delivery, "CALLBACK_BATCH_WAIT", 0.01)
+
+    async def main():
+        await delivery.submit("a", {"taskId": "a"})
+        sender = asyncio.ensure_future(delivery._sender())
+        while not delivery.delivered:
+            await asyncio.sleep(0.01)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
+    asyncio.run(main())
+    assert delivery.receiver.payloads == [[{"taskId": "a"}]]
+
+
+def test_backoff_after_first_failure(delivery, monkeypatch):
+    monkeypatch.setattr(callback_delivery, "CALLBACK_BATCH_SIZE", 1)
+    monkeypatch.setattr(callback_delivery, "CALLBACK_REDELIVERY_INTERVAL", 30)
+    monkeypatch.setattr(callback_delivery, "CALLBACK_REDELIVERY_MAX_INTERVAL", 100)
+    delivery.redelivery_interval = 30
+    delivery.outbox.append([record("a"), record("b"), record("c")])
+    delivery.receiver.status = 503
+
+    for expected in (60, 100, 100):
+        asyncio.run(delivery._redeliver_once())
+        assert delivery.redelivery_interval == expected
+    # 首条失败即停止本轮，不逐条重试
+    assert len(delivery.receiver.payloads) == 3
+    assert [r["task_id"] for r in delivery.outbox.read()[0]] == ["a", "b", "c"]
+
+    # 接收方恢复后全部补推，间隔复位
+    delivery.receiver.status = 200
+    asyncio.run(delivery._redeliver_once())
+    assert delivery.redelivery_interval == 30
+    assert delivery.outbox.read()[0] == []
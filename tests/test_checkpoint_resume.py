@@ -0,0 +1,122 @@
+# tests/test_checkpoint_resume.py
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from task_checkpoint import TaskCheckpoint
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DRIVER = Path(__file__).resolve().parent / "restart_driver.py"
+
+
+# ==============================
+# 检查点存取
+# ==============================
+def test_checkpoint_roundtrip_and_prune(tmp_path):
+    checkpoint = TaskCheckpoint(tmp_path / "checkpoints.db", enabled=True)
+    checkpoint.start()
+    checkpoint.record_image("t1", 3, 1, {"idx": 3})
+    checkpoint.record_image("t1", 0, 2, {"idx": 0})
+    checkpoint.record_type("t1", 1, "道路-积水", {"result": "存在"})
+    checkpoint.record_image("t2", 0, 1, {"idx": 0})
+    checkpoint.record_image("t3", 0, 1, {"idx": 0})
+    checkpoint.clear("t3")
+    checkpoint.close()
+
+    checkpoint.start()
+    # 按完成顺序返回
+    assert checkpoint.load_images("t1") == [(3, {"idx": 3}), (0, {"idx": 0})]
+    assert checkpoint.load_types("t1", 1) == {"道路-积水": {"result": "存在"}}
+    assert checkpoint.load_images("t3") == []
+    # 只保留未完成任务的检查点
+    assert checkpoint.prune(["t1"]) == 1
+    assert checkpoint.load_images("t2") == []
+    assert checkpoint.load_images("t1")
+    checkpoint.close()
+
+
+def test_disabled_checkpoint_is_noop(tmp_path):
+    checkpoint = TaskCheckpoint(tmp_path / "checkpoints.db", enabled=False)
+    checkpoint.start()
+    checkpoint.record_image("t1", 0, 1, {})
+    assert checkpoint.load_images("t1") == []
+    checkpoint.close()
+    assert not (tmp_path / "checkpoints.db").exists()
+
+
+# ==============================
+# 中断 -> 重启 -> 续跑
+# ==============================
+def run_driver(phase: str, workdir: Path) -> dict:
+    env = dict(os.environ,
+               PYTHONPATH=str(REPO_ROOT),
+               TASK_DATA_DIR=str(workdir / "task_data"),
+               RESULT_CACHE_PATH=str(workdir / "result_cache.db"),
+               LOG_DIR=str(workdir / "logs"),
+               CALLBACK_OUTBOX_FILE=str(workdir / "failed_push.jsonl"),
+               CALLBACK_URL="http://127.0.0.1:9/callback",
+               CALLBACK_MAX_RETRIES="1",
+               BACKEND_HEALTH_INTERVAL="0",
+               TASK_QUEUE_BACKEND="memory",
+               API_WORKERS="1",
+               SHUTDOWN_DRAIN_TIMEOUT="1.5")
+    output = workdir / f"{phase}.json"
+    proc = subprocess.run([sys.executable, str(DRIVER), phase, str(output)], cwd=workdir, env=env,
+                          capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr[-3000:]
+    return json.loads(output.read_text(encoding="utf-8"))
+
+
+def test_interrupted_task_resumes_only_unfinished_work(tmp_path):
+    first = run_driver("interrupt", tmp_path)
+    task_id = first["task_id"]
+    # 中断前：fast 完成；slow 在排空期间完成；half 只完成了第一个类型；hang* 未开始
+    assert first["inferred"] == {"/img/fast.jpg": ["道路-积水", "道路-破损"],
+                                 "/img/slow.jpg": ["道路-积水", "道路-破损"],
+                                 "/img/half.jpg": ["道路-积水"]}
+
+    checkpoints = tmp_path / "task_data" / "checkpoints.db"
+    conn = sqlite3.connect(str(checkpoints))
+    with conn:
+        # 已结束任务残留的检查点，重启时清理
+        conn.execute("INSERT INTO image_checkpoints (task_id, idx, seq, result) VALUES ('stale', 0, 1, '{}')")
+    conn.close()
+
+    second = run_driver("resume", tmp_path)
+    assert second["task_id"] == task_id
+    assert second["resumed_completed"] == 2
+    # 重启后只推理未完成的图片，中断时推理到一半的图片只推理剩余类型
+    assert second["inferred"] == {"/img/half.jpg": ["道路-破损"],
+                                  "/img/hang1.jpg": ["道路-积水", "道路-破损"],
+                                  "/img/hang2.jpg": ["道路-积水", "道路-破损"]}
+    # 结果按完成顺序，保留中断前完成的图片
+    response = second["response"]
+    assert [r["ftpPath"] for r in response[:2]] == ["/img/fast.jpg", "/img/slow.jpg"]
+    assert sorted(r["ftpPath"] for r in response[2:]) == ["/img/half.jpg", "/img/hang1.jpg", "/img/hang2.jpg"]
+    half = next(r for r in response if r["ftpPath"] == "/img/half.jpg")
+    assert [j["sceneDesc"] for j in half["judgmentInfo"]] == ["interrupt", "resume"]
+
+    # 轮询接口：未完成时 result 为 None；完成后 result 为全部结果，response 只含 since 之后的部分
+    assert second["polled"]["result"] is None
+    assert second["polled"]["completed"] == 2 and second["polled"]["total"] == 5
+    assert second["polled_done"]["result"] == response
+    assert second["polled_done"]["response"] == response[3:]
+    assert second["polled_done"]["next"] == 5
+
+    conn = sqlite3.connect(str(checkpoints))
+    try:
+        # 任务完成后检查点已清除，残留的检查点已清理
+        assert conn.execute("SELECT COUNT(*) FROM image_checkpoints").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM type_checkpoints").fetchone()[0] == 0
+    finally:
+        conn.close()
+    conn = sqlite3.connect(str(tmp_path / "task_data" / "tasks.db"))
+    try:
+        assert conn.execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()[0] == "done"
+    finally:
+        conn.close()
@@ -0,0 +1,141 @@
+# tests/test_limiter.py
+import asyncio
+import time
+
+from model.limiter import (AdaptiveLimiter, LimiterSample, OUTCOME_OVERLOAD, OUTCOME_IGNORE,
+                           CALL_VERDICT, CALL_SINGLE, CALL_MULTI, call_class, per_process)
+
+
+def sample(latency: float = 1.0, outcome: str = None, cls: str = CALL_SINGLE) -> LimiterSample:
+    """构造固定延迟的样本，避免测试结果受真实耗时抖动影响"""
+    s = LimiterSample(cls)
+    s.start = time.monotonic() - latency
+    if outcome:
+        s.outcome = outcome
+    return s
+
+
+def test_acquire_waits_at_limit_and_release_wakes():
+    async def main():
+        limiter = AdaptiveLimiter(initial=2, min_limit=1, max_limit=2)
+        await limiter.acquire()
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        assert limiter.stats()["waiting"] == 1
+        limiter.release(sample())
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.in_flight == 2
+
+    asyncio.run(main())
+
+
+def test_overload_backs_off_once_per_congestion():
+    limiter = AdaptiveLimiter(initial=10, min_limit=2, max_limit=20, backoff_ratio=0.5)
+    limiter.in_flight = 3
+    # 同一批在途请求都超时：只有第一个触发收缩
+    samples = [sample(outcome=OUTCOME_OVERLOAD) for _ in range(3)]
+    for s in samples:
+        limiter.release(s)
+    assert limiter.limit == 5
+    assert limiter.decreases == 1
+    assert limiter.overloads == 3
+
+    # 收缩后发出的请求再次过载才继续收缩，且不低于下限
+    for _ in range(3):
+        limiter.in_flight += 1
+        limiter.release(sample(latency=0, outcome=OUTCOME_OVERLOAD))
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_success_grows_only_when_saturated():
+    limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=5)
+    # 并发未用满：不增长
+    limiter.in_flight = 1
+    limiter.release(sample())
+    assert limiter.limit == 4
+    # 并发用满：每满一个窗口约 +1
+    for _ in range(4):
+        limiter.in_flight = 4
+        limiter.release(sample())
+    assert 4.9 < limiter.limit <= 5
+
+
+def test_latency_rise_backs_off():
+    limiter = AdaptiveLimiter(initial=10, min_limit=1, max_limit=10, latency_tolerance=2.0, backoff_ratio=0.5)
+    limiter.in_flight = 1
+    limiter.release(sample(latency=1.0))
+    # 平滑延迟逐步上升到超过基线 2 倍时收缩
+    for _ in range(20):
+        limiter.in_flight = 1
+        limiter.release(sample(latency=10.0))
+        if limiter.decreases:
+            break
+    assert limiter.decreases == 1
+    assert limiter.limit == 5
+
+
+def test_mixed_call_classes_do_not_back_off():
+    # 仅判定调用（约 0.2s）、单类型完整回答（约 3s）、多问题合并回答（约 8s）交替，且并发未过载
+    limiter = AdaptiveLimiter(initial=10, min_limit=1, max_limit=10, latency_tolerance=2.5)
+    for _ in range(50):
+        for latency, cls in ((0.2, CALL_VERDICT), (3.0, CALL_SINGLE), (8.0, CALL_MULTI)):
+            limiter.in_flight = 1
+            limiter.release(sample(latency=latency, cls=cls))
+    assert limiter.decreases == 0
+    assert limiter.limit == 10
+    stats = limiter.stats()
+    assert set(stats["baseline_latency"]) == {CALL_VERDICT, CALL_SINGLE, CALL_MULTI}
+
+    # 同一类别的延迟上升仍会触发收缩
+    for _ in range(30):
+        limiter.in_flight = 1
+        limiter.release(sample(latency=2.0, cls=CALL_VERDICT))
+    assert limiter.decreases == 1
+
+
+def test_call_class():
+    assert call_class(True) == call_class(True, True) == CALL_VERDICT
+    assert call_class(False) == CALL_SINGLE
+    assert call_class(False, True) == CALL_MULTI
+
+
+def test_cancelled_slot_is_ignored_and_waiter_removed():
+    async def main():
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+
+        async def hold():
+            async with limiter.slot():
+                await asyncio.sleep(10)
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        holder.cancel()
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+        stats = limiter.stats()
+        assert stats["in_flight"] == 0
+        assert stats["waiting"] == 0
+        # 取消既不算成功也不算过载
+        assert stats["successes"] == stats["overloads"] == 0
+
+    asyncio.run(main())
+
+
+def test_ignore_outcome_does_not_adjust():
+    limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=8)
+    limiter.in_flight = 4
+    limiter.release(sample(outcome=OUTCOME_IGNORE))
+    assert limiter.limit == 4
+    assert limiter.in_flight == 3
+
+
+def test_limits_are_split_across_processes():
+    # 4 个服务进程合计不超过配置的上限
+    assert per_process(32, workers=4) == 8
+    assert per_process(3, workers=4) == 1
+    assert per_process(32, workers=1) == 32
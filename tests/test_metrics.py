@@ -0,0 +1,17 @@
+# tests/test_metrics.py
+from metrics import Histogram, metric_types, UNKNOWN_TYPE
+
+
+def test_unconfigured_types_become_unknown():
+    task = {"identifyType": ["道路-积水", "随便写的类型", 123]}
+    assert metric_types(task) == ["道路-积水", UNKNOWN_TYPE, UNKNOWN_TYPE]
+    assert metric_types({"identifyType": "道路-积水"}) == [UNKNOWN_TYPE]
+    assert metric_types(None) == [UNKNOWN_TYPE]
+
+
+def test_client_strings_do_not_add_series():
+    histogram = Histogram("test_stage_seconds", "测试", ("stage", "identifyType"))
+    for i in range(100):
+        for identify_type in metric_types({"identifyType": [f"垃圾标签{i}"]}):
+            histogram.observe(0.1, "queue_wait", identify_type)
+    assert sum(1 for line in histogram.render() if line.startswith("test_stage_seconds_count")) == 1
@@ -0,0 +1,78 @@
+# tests/test_pipeline.py
+import asyncio
+
+import pytest
+
+import pipeline
+from main_async import PreparedTask
+from pipeline import ImagePipeline
+from scheduler import FairScheduler
+
+# 各阶段遇到该路径时抛出与关闭流水线无关的 CancelledError（如共享的在途计算被其他请求取消）
+CANCEL_IN = {"/data/fetch.jpg": "fetch", "/data/preprocess.jpg": "preprocess",
+             "/data/inference.jpg": "inference", "/data/finish.jpg": "finish"}
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    async def fake_fetch(task):
+        await asyncio.sleep(0)
+        if CANCEL_IN.get(task["ftp_path"]) == "fetch":
+            raise asyncio.CancelledError()
+        return PreparedTask(task)
+
+    async def fake_preprocess(prepared):
+        await asyncio.sleep(0)
+        if CANCEL_IN.get(prepared.task["ftp_path"]) == "preprocess":
+            raise asyncio.CancelledError()
+
+    async def fake_process(task, prepared):
+        await asyncio.sleep(0)
+        if prepared.error is not None:
+            return {"ftp_path": task["ftp_path"], "status": "failed", "error_msg": str(prepared.error)}
+        if CANCEL_IN.get(task["ftp_path"]) == "inference":
+            raise asyncio.CancelledError()
+        return {"ftp_path": task["ftp_path"], "status": "success"}
+
+    monkeypatch.setattr(pipeline, "fetch_task_async", fake_fetch)
+    monkeypatch.setattr(pipeline, "preprocess_task_async", fake_preprocess)
+    monkeypatch.setattr(pipeline, "process_single_task_async", fake_process)
+
+
+def test_stray_cancelled_error_fails_only_that_image(stages):
+    async def main():
+        scheduler = FairScheduler()
+        scheduler.start()
+        results = {}
+
+        async def on_done(run, index, result):
+            await asyncio.sleep(0)
+            if result["ftp_path"] == "/data/finish.jpg":
+                raise asyncio.CancelledError()
+            results[result["ftp_path"]] = result
+
+        # 预读名额少于图片数：名额泄漏时流水线会卡住
+        image_pipeline = ImagePipeline(scheduler, on_dispatch=lambda run, index: None, on_done=on_done,
+                                       inference_workers=2, read_ahead=2)
+        image_pipeline.start()
+        paths = list(CANCEL_IN) + [f"/data/ok{i}.jpg" for i in range(6)]
+        await scheduler.submit("t1", [{"ftp_path": p, "identifyType": ["安全帽"]} for p in paths])
+        try:
+            for _ in range(200):
+                if len(results) == len(paths) - 1 and not image_pipeline.in_flight:
+                    break
+                await asyncio.sleep(0.01)
+            # 阶段协程都还在运行
+            assert all(not task.done() for task in image_pipeline._tasks)
+            return results, image_pipeline.stats()
+        finally:
+            await image_pipeline.stop()
+
+    results, stats = asyncio.run(main())
+    assert stats["in_flight"] == 0
+    assert stats["finish_errors"] == 1
+    assert stats["processed"] == 9
+    for path in ("/data/fetch.jpg", "/data/preprocess.jpg", "/data/inference.jpg"):
+        assert results[path]["status"] == "failed"
+        assert "取消" in results[path]["error_msg"]
+    assert all(results[f"/data/ok{i}.jpg"]["status"] == "success" for i in range(6))
@@ -0,0 +1,131 @@
+# tests/test_preprocess_pool.py
+import asyncio
+import sys
+import threading
+import uuid
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from model import preprocess_worker
+from model.image_cache import preprocess_cache, PreprocessCache
+from model.preprocess_pool import PreprocessPool, _worker_main
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """计算替换为可控的协程，不启动子进程"""
+    pool = PreprocessPool(workers=1)
+    pool.calls = 0
+    pool.release = None
+
+    async def fake_compute(image_path, quality, timings_out=None, reference_original=True):
+        pool.calls += 1
+        await pool.release.wait()
+        return f"b64:{image_path}"
+
+    monkeypatch.setattr(pool, "_compute", fake_compute)
+    yield pool
+    preprocess_cache.clear()
+
+
+def test_cancelled_leader_does_not_break_waiters(pool):
+    async def main():
+        pool.release = asyncio.Event()
+        key = f"sha256:{uuid.uuid4().hex}"
+        leader = asyncio.ensure_future(pool.get_image("/spool/a.jpg", content_key=key))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(pool.get_image("/spool/b.jpg", content_key=key))
+        await asyncio.sleep(0)
+        # 发起者被取消（如客户端断开），同一图片的等待者仍拿到结果
+        leader.cancel()
+        await asyncio.sleep(0)
+        pool.release.set()
+        assert await asyncio.wait_for(waiter, 1) == "b64:/spool/a.jpg"
+        assert leader.cancelled()
+        assert pool.calls == 1
+        assert not pool._pending
+        # 计算结果已写入缓存
+        assert await pool.get_image("/spool/c.jpg", content_key=key) == "b64:/spool/a.jpg"
+        assert pool.calls == 1
+
+    asyncio.run(main())
+
+
+def test_all_callers_cancelled_still_caches(pool):
+    async def main():
+        pool.release = asyncio.Event()
+        key = f"sha256:{uuid.uuid4().hex}"
+        leader = asyncio.ensure_future(pool.get_image("/spool/a.jpg", content_key=key))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        pool.release.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert not pool._pending
+        assert await pool.get_image("/spool/b.jpg", content_key=key) == "b64:/spool/a.jpg"
+        assert pool.calls == 1
+
+    asyncio.run(main())
+
+
+def test_worker_main_is_restored():
+    main_module = sys.modules["__main__"]
+    with _worker_main():
+        # spawn 子进程按 __main__ 的模块名重新导入，启动期间指向轻量的 preprocess_worker
+        assert sys.modules["__main__"] is preprocess_worker
+    assert sys.modules["__main__"] is main_module
+
+
+class BrokenExecutor:
+    """提交即失败的进程池，记录关闭参数"""
+
+    def __init__(self):
+        self.shutdown_calls = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("子进程异常退出"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shutdown_calls.append((wait, cancel_futures))
+
+
+def test_broken_pool_is_shut_down_before_replacing():
+    pool = PreprocessPool(workers=1)
+    broken = BrokenExecutor()
+    pool._executor = broken
+
+    async def main():
+        with pytest.raises(BrokenProcessPool):
+            await pool._compute("/data/a.jpg", 80)
+
+    asyncio.run(main())
+    # 旧池的剩余子进程被回收，下次提交时重建
+    assert broken.shutdown_calls == [(False, True)]
+    assert pool._executor is None
+    assert pool.failed == 1
+
+
+def test_path_key_stat_runs_off_event_loop(pool, monkeypatch, tmp_path):
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"\xff\xd8fake-jpeg")
+    stat_threads = []
+    make_key = PreprocessCache.make_key
+
+    def recording_make_key(image_path, target_max_size, quality):
+        stat_threads.append(threading.current_thread())
+        return make_key(image_path, target_max_size, quality)
+
+    monkeypatch.setattr(preprocess_cache, "make_key", recording_make_key)
+
+    async def main():
+        pool.release = asyncio.Event()
+        pool.release.set()
+        assert await pool.get_image(str(image)) == f"b64:{image}"
+
+    asyncio.run(main())
+    assert stat_threads and stat_threads[0] is not threading.main_thread()
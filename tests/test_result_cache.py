@@ -0,0 +1,139 @@
+# tests/test_result_cache.py
+import asyncio
+import json
+
+import pytest
+
+import main_async
+import model.model as model_module
+from result_cache import ResultCache, sha256_text
+from singleflight import SingleFlight
+
+PROMPTS = {"道路-破损": "破损Prompt", "道路-积水": "积水Prompt"}
+
+
+def entry(type_name, result="存在"):
+    return {"identifyType": type_name, "result": result, "sceneDesc": ""}
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"\xff\xd8fake-jpeg")
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = ResultCache(path=str(tmp_path / "result_cache.db"), ttl=3600, max_entries=100, enabled=True)
+    yield c
+    c.close()
+
+
+def test_put_get_roundtrip(cache, image):
+    cache.put_many(image, PROMPTS, "params", {t: entry(t) for t in PROMPTS})
+    assert cache.get_many(image, PROMPTS, "params") == {t: entry(t) for t in PROMPTS}
+    # 模型参数不同即为不同条目
+    assert cache.get_many(image, PROMPTS, "other") == {}
+    assert cache.hits == 2 and cache.misses == 2
+
+
+def test_invalidate_stale_prompts(cache, image):
+    cache.put_many(image, PROMPTS, "params", {t: entry(t) for t in PROMPTS})
+    # 修改一个类型的 Prompt 只清除该类型；已下线的类型全部清除
+    removed = cache.invalidate_stale_prompts({"道路-破损": "破损Prompt", "道路-积水": "积水Prompt v2"})
+    assert removed == 1
+    assert set(cache.get_many(image, PROMPTS, "params")) == {"道路-破损"}
+    assert cache.invalidate_stale_prompts({}) == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_expired_entries_miss_and_are_pruned(cache, image):
+    cache.put_many(image, PROMPTS, "params", {t: entry(t) for t in PROMPTS})
+    key, _ = cache.make_key(cache.image_hash(image), "道路-积水", PROMPTS["道路-积水"], "params")
+    conn = cache._connect()
+    conn.execute("UPDATE results SET created_at = created_at - 7200 WHERE cache_key = ?", (key,))
+    conn.commit()
+    assert set(cache.get_many(image, PROMPTS, "params")) == {"道路-破损"}
+    cache.prune()
+    assert cache.stats()["entries"] == 1
+
+
+def test_prune_evicts_least_recently_accessed(tmp_path, image):
+    cache = ResultCache(path=str(tmp_path / "lru.db"), ttl=3600, max_entries=2, enabled=True)
+    try:
+        for idx in range(3):
+            cache.put_many(image, {"道路-积水": "Prompt"}, f"params-{idx}", {"道路-积水": entry("道路-积水")})
+        conn = cache._connect()
+        for idx, offset in enumerate((30, 10, 20)):
+            key, _ = cache.make_key(cache.image_hash(image), "道路-积水", "Prompt", f"params-{idx}")
+            conn.execute("UPDATE results SET last_access = last_access - ? WHERE cache_key = ?", (offset, key))
+        conn.commit()
+        cache.prune()
+        kept = [idx for idx in range(3) if cache.get_many(image, {"道路-积水": "Prompt"}, f"params-{idx}")]
+        assert kept == [1, 2]
+    finally:
+        cache.close()
+
+
+def test_signature_covers_modes_and_verdict_settings(monkeypatch):
+    sign = main_async.cache_params_signature
+    signatures = {sign(False, False), sign(False, True), sign(True, False), sign(True, True)}
+    assert len(signatures) == 4
+    assert json.loads(sign(True, False))["instruction"] == sha256_text(main_async.VERDICT_ONLY_SUFFIX)[:16]
+
+    before = sign(True, False)
+    monkeypatch.setattr(main_async, "VERDICT_ONLY_SUFFIX", main_async.VERDICT_ONLY_SUFFIX + "。")
+    assert sign(True, False) != before
+    before = sign(True, True)
+    monkeypatch.setattr(model_module, "VERDICT_MAX_TOKENS_PER_TYPE", model_module.VERDICT_MAX_TOKENS_PER_TYPE + 8)
+    assert sign(True, True) != before
+    # 描述模式的结果不受仅判定配置影响
+    assert sign(False, False) == model_module.model_params_signature()
+
+
+@pytest.fixture
+def inference(monkeypatch, cache):
+    calls = []
+
+    async def fake_prepare(task, identify_types=None, content_key=None):
+        return "b64"
+
+    async def fake_infer(img_path, types, b64_image, multi_question, verdict_only, on_result=None,
+                         affinity_key=None):
+        calls.append((list(types), multi_question))
+        return {t: entry(t, f"第{len(calls)}次") for t in types}
+
+    monkeypatch.setattr(main_async, "inference_flight", SingleFlight())
+    monkeypatch.setattr(main_async, "result_cache", cache)
+    monkeypatch.setattr(main_async, "prepare_task_image_async", fake_prepare)
+    monkeypatch.setattr(main_async, "infer_types_async", fake_infer)
+    return calls
+
+
+def test_bypass_cache_reinfers_and_refreshes(inference, image):
+    types = ["道路-积水"]
+    task = {"ftp_path": image, "identifyType": types}
+    resolve = main_async.resolve_types_async
+
+    assert asyncio.run(resolve(task, types, False, False))["道路-积水"]["result"] == "第1次"
+    assert asyncio.run(resolve(task, types, False, False))["道路-积水"]["result"] == "第1次"
+    assert len(inference) == 1
+    # bypassCache 跳过读取，但新结果写回缓存
+    bypass = {**task, "bypassCache": True}
+    assert asyncio.run(resolve(bypass, types, False, False))["道路-积水"]["result"] == "第2次"
+    assert asyncio.run(resolve(task, types, False, False))["道路-积水"]["result"] == "第2次"
+    assert len(inference) == 2
+
+
+def test_merged_and_single_results_cached_separately(inference, image):
+    types = ["道路-破损", "道路-积水"]
+    task = {"ftp_path": image, "identifyType": types}
+    resolve = main_async.resolve_types_async
+
+    asyncio.run(resolve(task, types, True, True))
+    asyncio.run(resolve(task, types, True, True))
+    assert inference == [(types, True)]
+    # 逐类型提问不复用合并提问的结果
+    asyncio.run(resolve(task, types, False, True))
+    assert inference == [(types, True), (types, False)]
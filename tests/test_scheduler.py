@@ -0,0 +1,72 @@
+# tests/test_scheduler.py
+import asyncio
+from collections import Counter
+
+import pytest
+
+from scheduler import FairScheduler, SchedulerFull
+
+
+def items(n: int):
+    return [{"ftp_path": f"/data/{i}.jpg", "identifyType": ["道路-积水"]} for i in range(n)]
+
+
+async def drain(scheduler: FairScheduler, n: int):
+    order = []
+    for _ in range(n):
+        run, index = await scheduler.get()
+        order.append((run.task_id, index))
+    return order
+
+
+def test_priorities_are_weighted():
+    async def main():
+        scheduler = FairScheduler()
+        scheduler.start()
+        for priority in ("high", "normal", "low"):
+            await scheduler.submit(priority, items(70), priority)
+        return await drain(scheduler, 70)
+
+    counts = Counter(task_id for task_id, _ in asyncio.run(main()))
+    # 权重 high:normal:low = 4:2:1，每 7 个工作项一轮
+    assert counts == {"high": 40, "normal": 20, "low": 10}
+
+
+def test_smooth_weighting_interleaves():
+    # 平滑加权轮询：高优先级不会一次占满整轮
+    scheduler = FairScheduler()
+    picks = [scheduler._pick_priority(["high", "normal", "low"]) for _ in range(7)]
+    assert picks == ["high", "normal", "high", "low", "high", "normal", "high"]
+
+
+def test_tasks_round_robin_within_priority():
+    async def main():
+        scheduler = FairScheduler()
+        scheduler.start()
+        await scheduler.submit("big", items(5))
+        await scheduler.submit("small", items(2))
+        return await drain(scheduler, 7)
+
+    order = asyncio.run(main())
+    # 后到的小任务不必等大任务全部处理完
+    assert order[:4] == [("big", 0), ("small", 0), ("big", 1), ("small", 1)]
+    assert order[4:] == [("big", 2), ("big", 3), ("big", 4)]
+
+
+def test_completed_items_are_not_queued_and_limit_applies():
+    async def main():
+        scheduler = FairScheduler(max_pending_items=3)
+        scheduler.start()
+        run = await scheduler.submit("t1", items(3), completed={1: {"idx": 1}})
+        assert run.remaining == 2
+        assert scheduler.pending_items == 2
+        assert scheduler.pending_by_type == {"道路-积水": 2}
+        with pytest.raises(SchedulerFull):
+            await scheduler.submit("t2", items(2))
+        assert await drain(scheduler, 2) == [("t1", 0), ("t1", 2)]
+        # 排队数归零的识别类型不再保留
+        assert scheduler.pending_by_type == {}
+        assert not run.complete(0, {"idx": 0})
+        assert run.complete(2, {"idx": 2})
+
+    asyncio.run(main())
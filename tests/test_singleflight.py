@@ -0,0 +1,79 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+
+import main_async
+from singleflight import SingleFlight, LeaderCancelled
+
+
+class FakeResultCache:
+    def get_many(self, image_path, prompts, model_params):
+        return {}
+
+    def put_many(self, image_path, prompts, model_params, results):
+        pass
+
+
+@pytest.fixture
+def inference(monkeypatch):
+    """推理替换为可控的协程：第一次调用（执行者）阻塞到被取消，之后的调用立即返回"""
+    calls = []
+
+    async def fake_prepare(task, identify_types=None, content_key=None):
+        return "b64"
+
+    async def fake_infer(img_path, types, b64_image, multi_question, verdict_only, on_result=None,
+                         affinity_key=None):
+        calls.append(list(types))
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return {t: {"identifyType": t, "result": "存在", "sceneDesc": ""} for t in types}
+
+    monkeypatch.setattr(main_async, "inference_flight", SingleFlight())
+    monkeypatch.setattr(main_async, "result_cache", FakeResultCache())
+    monkeypatch.setattr(main_async, "prepare_task_image_async", fake_prepare)
+    monkeypatch.setattr(main_async, "infer_types_async", fake_infer)
+    return calls
+
+
+def test_follower_reruns_when_leader_cancelled(inference):
+    async def main():
+        task = {"ftp_path": "/data/a.jpg", "identifyType": ["道路-积水"]}
+        resolve = main_async.resolve_types_async
+        leader = asyncio.ensure_future(resolve(task, ["道路-积水"], False, False))
+        while not main_async.inference_flight.in_flight:
+            await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(resolve(dict(task), ["道路-积水"], False, False))
+        while not main_async.inference_flight.shared_calls:
+            await asyncio.sleep(0.01)
+        assert main_async.inference_flight.shared_calls == 1
+        # 执行者的客户端断开，等待者重新执行而不是失败
+        leader.cancel()
+        results = await asyncio.wait_for(follower, 1)
+        assert results["道路-积水"]["result"] == "存在"
+        assert leader.cancelled()
+        assert main_async.inference_flight.leader_cancels == 1
+        assert main_async.inference_flight.in_flight == 0
+
+    asyncio.run(main())
+    assert inference == [["道路-积水"], ["道路-积水"]]
+
+
+def test_real_errors_are_shared():
+    async def main():
+        flight = SingleFlight()
+        assert flight.join("k") is None
+        flight.lead("k")
+        fut = flight.join("k")
+        flight.resolve("k", error=ValueError("模型返回结果解析失败"))
+        with pytest.raises(ValueError):
+            await fut
+
+        flight.lead("k")
+        fut = flight.join("k")
+        flight.resolve("k", error=asyncio.CancelledError())
+        with pytest.raises(LeaderCancelled):
+            await fut
+
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+# tests/test_stream_parser.py
+from model.stream_parser import VerdictStreamParser, StreamStats, SHAPE_OBJECT
+
+
+def feed_all(parser: VerdictStreamParser, chunks) -> int:
+    """逐段喂入，返回判定完整时的段下标（未完整返回 -1）"""
+    for i, chunk in enumerate(chunks):
+        if parser.feed(chunk):
+            return i
+    return -1
+
+
+def test_array_verdict_completes_on_closing_bracket():
+    parser = VerdictStreamParser()
+    chunks = ["好的，", "[{'状态':'存", "在','描述':'有人", "员吸烟'}", "]", "，补充说明……"]
+    assert feed_all(parser, chunks) == 4
+    assert parser.verdict == "[{'状态':'存在','描述':'有人员吸烟'}]"
+    # 完整后继续喂入不再改变结果
+    assert parser.feed("[{'状态':'不存在'}]")
+    assert parser.verdict == "[{'状态':'存在','描述':'有人员吸烟'}]"
+
+
+def test_brackets_inside_strings_are_ignored():
+    parser = VerdictStreamParser()
+    assert feed_all(parser, ['[{"状态":"存在","描述":"标牌写着]', '[禁止]"}]']) == 1
+    assert parser.verdict == '[{"状态":"存在","描述":"标牌写着][禁止]"}]'
+
+
+def test_non_verdict_brackets_are_skipped():
+    # 描述前的示例括号不是判定，从下一个字符继续寻找
+    parser = VerdictStreamParser()
+    assert feed_all(parser, ["格式为 [1, 2]，回答：", '[{"状态":"不存在","描述":""}]']) == 1
+    assert parser.verdict == '[{"状态":"不存在","描述":""}]'
+
+
+def test_incomplete_stream_has_no_verdict():
+    parser = VerdictStreamParser()
+    assert feed_all(parser, ['[{"状态":"存在",', '"描述":"未完']) == -1
+    assert parser.verdict is None
+
+
+def test_object_shape():
+    parser = VerdictStreamParser(SHAPE_OBJECT)
+    assert feed_all(parser, ['{"安全帽": [{"状态":"存在"}],', ' "烟火": {"状态":"不存在"}}']) == 1
+    assert parser.verdict.startswith('{"安全帽"')
+
+
+def test_stream_stats_records_each_call():
+    stats = StreamStats(recent=2)
+    stats.record(tokens=40, max_tokens=512, early_stop=True, time_to_verdict=0.5)
+    stats.record(tokens=512, max_tokens=512, early_stop=False, time_to_verdict=2.0)
+    stats.record(tokens=60, max_tokens=512, early_stop=True, time_to_verdict=1.5)
+    result = stats.stats()
+    assert result["calls"] == 3
+    assert result["early_stops"] == 2
+    assert result["tokens_saved_estimate"] == (512 - 40) + (512 - 60)
+    assert result["avg_time_to_verdict"] == 1.0
+    assert result["max_time_to_verdict"] == 1.5
+    # 只保留最近的逐次记录
+    assert result["recent"] == [
+        {"tokens": 512, "time_to_verdict": 2.0, "early_stop": False},
+        {"tokens": 60, "time_to_verdict": 1.5, "early_stop": True},
+    ]
@@ -0,0 +1,148 @@
+# tests/test_task_store.py
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from task_store import JsonDirTaskStore, SQLiteTaskStore
+
+
+def status(state: str, create_time: float = 100.0, **extra):
+    return {"status": state, "create_time": create_time, **extra}
+
+
+def read_committed(path, task_id: str):
+    """用独立连接读取已提交的数据（不经过 store 的待落盘记录）"""
+    conn = sqlite3.connect(str(path))
+    try:
+        row = conn.execute("SELECT status, status_info, metadata FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+    finally:
+        conn.close()
+    return row and (row[0], json.loads(row[1]), json.loads(row[2]) if row[2] else None)
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return tmp_path / "tasks.db"
+
+
+def open_store(path, legacy_dir) -> SQLiteTaskStore:
+    store = SQLiteTaskStore(path, legacy_dir=legacy_dir)
+    store.start()
+    return store
+
+
+def test_late_intermediate_status_does_not_overwrite_finished(store_path, tmp_path):
+    # 两个进程共用存储：先落盘 done，另一进程迟到的 processing 不得覆盖
+    finisher = open_store(store_path, tmp_path / "legacy")
+    other = open_store(store_path, tmp_path / "legacy")
+    finisher.save("t1", status("pending"), metadata=[{"ftp_path": "/a.jpg"}])
+    finisher.save("t1", status("done", end_time=200.0))
+    finisher.close()
+    other.save("t1", status("processing", completed=1))
+    other.close()
+
+    state, status_info, metadata = read_committed(store_path, "t1")
+    assert state == "done" and status_info["end_time"] == 200.0
+    # 只更新状态时保留已存储的任务参数
+    assert metadata == [{"ftp_path": "/a.jpg"}]
+
+    # 已结束的任务可以被新的结束状态更新（如重新推送后的结果）
+    store = open_store(store_path, tmp_path / "legacy")
+    store.save("t1", status("failed", error="x"))
+    store.close()
+    assert read_committed(store_path, "t1")[0] == "failed"
+
+
+def test_load_unfinished(store_path, tmp_path):
+    store = open_store(store_path, tmp_path / "legacy")
+    store.save("late", status("processing", create_time=300.0), metadata=[{"i": 2}])
+    store.save("early", status("pending", create_time=100.0), metadata=[{"i": 1}])
+    store.save("finished", status("done", create_time=50.0), metadata=[])
+    store.close()
+
+    store = open_store(store_path, tmp_path / "legacy")
+    # 按创建时间排序，只返回未结束的任务
+    assert store.load_unfinished() == [
+        ("early", status("pending", create_time=100.0), [{"i": 1}]),
+        ("late", status("processing", create_time=300.0), [{"i": 2}]),
+    ]
+    assert store.get("finished")["status_info"]["status"] == "done"
+    assert store.get("missing") is None
+    store.close()
+
+
+def test_legacy_json_migration(store_path, tmp_path):
+    legacy = tmp_path / "legacy"
+    legacy.mkdir()
+    (legacy / "old1.json").write_text(json.dumps(
+        {"status_info": status("processing"), "metadata": [{"ftp_path": "/a.jpg"}]}), encoding="utf-8")
+    (legacy / "old2.json").write_text(json.dumps(
+        {"status_info": status("done"), "metadata": []}), encoding="utf-8")
+    (legacy / "broken.json").write_text("{", encoding="utf-8")
+
+    store = open_store(store_path, legacy)
+    assert [t for t, _, _ in store.load_unfinished()] == ["old1"]
+    assert store.get("old2")["status_info"]["status"] == "done"
+    store.close()
+    assert (legacy / ".migrated_to_sqlite").exists()
+
+    # 只迁移一次：之后新增的旧版文件不再导入
+    (legacy / "old3.json").write_text(json.dumps(
+        {"status_info": status("pending"), "metadata": []}), encoding="utf-8")
+    store = open_store(store_path, legacy)
+    assert store.get("old3") is None
+    store.close()
+
+
+def test_on_commit_runs_after_record_is_committed(store_path, tmp_path):
+    store = open_store(store_path, tmp_path / "legacy")
+    seen = []
+    done = threading.Event()
+
+    def on_commit():
+        seen.append(read_committed(store_path, "t1")[0])
+        done.set()
+
+    store.save("t1", status("processing"), metadata=[])
+    store.save("t1", status("done"), on_commit=on_commit)
+    assert done.wait(5)
+    # 回调执行时最终状态已提交
+    assert seen == ["done"]
+    store.close()
+
+
+def test_on_commit_waits_for_retry_after_failed_write(store_path, tmp_path, monkeypatch):
+    store = SQLiteTaskStore(store_path, legacy_dir=tmp_path / "legacy")
+    original = store._write_batch
+    attempts = []
+
+    def flaky_write(records):
+        attempts.append(list(records))
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        original(records)
+
+    monkeypatch.setattr(store, "_write_batch", flaky_write)
+    monkeypatch.setattr("task_store.time.sleep", lambda seconds: None)
+    committed = threading.Event()
+    store.start()
+    store.save("t1", status("done"), metadata=[], on_commit=committed.set)
+    assert committed.wait(5)
+    assert len(attempts) == 2
+    assert read_committed(store_path, "t1")[0] == "done"
+    store.close()
+
+
+def test_json_dir_store(tmp_path):
+    store = JsonDirTaskStore(tmp_path / "json")
+    store.start()
+    store.save("t1", status("pending"), metadata=[{"ftp_path": "/a.jpg"}])
+    store.save("t2", status("done"), metadata=[])
+    store.close()
+    store.start()
+    store.save("t1", status("processing"))
+    store.close()
+    assert store.get("t1") == {"status_info": status("processing"), "metadata": [{"ftp_path": "/a.jpg"}]}
+    assert [t for t, _, _ in store.load_unfinished()] == ["t1"]
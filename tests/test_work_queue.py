@@ -0,0 +1,101 @@
+# tests/test_work_queue.py
+import time
+
+import pytest
+
+from scheduler import SchedulerFull
+from work_queue import SharedWorkQueue
+
+
+def items(n: int):
+    return [{"ftp_path": f"/data/{i}.jpg", "identifyType": ["安全帽"]} for i in range(n)]
+
+
+def first(available):
+    return available[0]
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return tmp_path / "queue.db"
+
+
+def open_queue(path, owner: str, lease_seconds: float = 60) -> SharedWorkQueue:
+    queue = SharedWorkQueue(path, lease_seconds=lease_seconds, owner=owner)
+    queue.open()
+    return queue
+
+
+def test_claim_and_complete(queue_path):
+    a = open_queue(queue_path, "a")
+    b = open_queue(queue_path, "b")
+    assert a.submit("t1", items(3), "normal", 100.0, max_pending_items=10)
+    # 重复提交（恢复任务时多个进程同时提交）被忽略
+    assert not b.submit("t1", items(3), "normal", 100.0, max_pending_items=10)
+
+    claimed, loaded, reclaimed = b.claim(2, first, known_tasks=set())
+    assert claimed == [("t1", 0), ("t1", 1)]
+    assert loaded == {"t1": ("normal", 100.0, items(3))}
+    assert reclaimed == 0
+    assert a.task_state("t1")["status"] == "processing"
+
+    # 已认领的图片不会被再次认领
+    claimed, loaded, _ = a.claim(5, first, known_tasks={"t1"})
+    assert claimed == [("t1", 2)]
+    assert loaded == {}
+    assert b.claim(5, first, known_tasks={"t1"}) == ([], {}, 0)
+
+    assert b.complete("t1", 1, {"idx": 1}) is None
+    assert b.complete("t1", 0, {"idx": 0}) is None
+    # 完成最后一张图片的进程取得收尾，拿到按提交顺序排列的全部结果
+    run = a.complete("t1", 2, {"idx": 2})
+    assert run["results"] == [{"idx": 0}, {"idx": 1}, {"idx": 2}]
+    state = b.task_state("t1")
+    assert state["completed"] == state["total"] == 3
+    # 按完成顺序返回
+    assert state["response"] == [{"idx": 1}, {"idx": 0}, {"idx": 2}]
+    # 重复完成同一张图片不再计数
+    assert a.complete("t1", 2, {"idx": 2}) is None
+
+
+def test_expired_lease_is_reclaimed(queue_path):
+    crashed = open_queue(queue_path, "crashed", lease_seconds=0.05)
+    survivor = open_queue(queue_path, "survivor")
+    crashed.submit("t1", items(2), "normal", 100.0, max_pending_items=10)
+    assert crashed.claim(2, first, known_tasks=set())[0] == [("t1", 0), ("t1", 1)]
+
+    # 租约未过期前其他进程认领不到
+    assert survivor.claim(2, first, known_tasks=set())[0] == []
+    time.sleep(0.1)
+    claimed, loaded, reclaimed = survivor.claim(2, first, known_tasks=set())
+    assert reclaimed == 2
+    assert claimed == [("t1", 0), ("t1", 1)]
+    assert "t1" in loaded
+
+    # 过期持有者之后完成的结果只计一次
+    assert crashed.complete("t1", 0, {"idx": 0, "by": "crashed"}) is None
+    assert survivor.complete("t1", 0, {"idx": 0, "by": "survivor"}) is None
+    run = survivor.complete("t1", 1, {"idx": 1})
+    assert run["results"][0] == {"idx": 0, "by": "crashed"}
+
+
+def test_renew_keeps_lease(queue_path):
+    holder = open_queue(queue_path, "holder", lease_seconds=0.2)
+    other = open_queue(queue_path, "other")
+    holder.submit("t1", items(1), "normal", 100.0, max_pending_items=10)
+    holder.claim(1, first, known_tasks=set())
+    for _ in range(3):
+        time.sleep(0.1)
+        assert holder.renew() == 1
+    assert other.claim(1, first, known_tasks=set()) == ([], {}, 0)
+
+
+def test_pending_limit(queue_path):
+    queue = open_queue(queue_path, "a")
+    queue.submit("t1", items(3), "normal", 100.0, max_pending_items=4)
+    with pytest.raises(SchedulerFull):
+        queue.submit("t2", items(2), "normal", 100.0, max_pending_items=4)
+    # 全部已完成的任务不占排队名额，直接进入收尾
+    assert queue.submit("t3", items(2), "normal", 100.0, max_pending_items=4,
+                        completed={0: {"idx": 0}, 1: {"idx": 1}})
+    assert queue.task_state("t3")["completed"] == 2
@@ -0,0 +1,488 @@
+# work_queue.py
+"""多进程共享的任务队列（SQLite，认领 / 租约）
+
+- 任意进程都可以提交任务、认领图片、查询任意任务的进度
+- 认领的图片带租约，持有进程定期续租；进程崩溃后租约过期，其他进程自动回收重新处理
+- 每张图片的结果完成即写入共享队列；完成最后一张图片的进程负责收尾（推送、落盘），
+  收尾同样持有租约，收尾进程崩溃时由其他进程接手
+- 同一优先级内按图片下标排序认领，各任务交替推进，大批量任务不会阻塞后到的小任务
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from scheduler import FairScheduler, SchedulerFull, TaskRun, PRIORITY_WEIGHTS, DEFAULT_PRIORITY
+from task_store import TASK_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# 共享队列配置
+# ============================
+# 任务队列后端：memory（进程内，仅支持单进程）或 sqlite（多进程共享）
+# 未指定时按 API_WORKERS 选择：多进程部署必须使用共享队列
+TASK_QUEUE_BACKEND = os.environ.get(
+    "TASK_QUEUE_BACKEND", "sqlite" if int(os.environ.get("API_WORKERS", 1)) > 1 else "memory")
+WORK_QUEUE_PATH = Path(os.environ.get("WORK_QUEUE_PATH", str(TASK_DATA_DIR / "queue.db")))
+# 租约时长（秒）：持有进程超过该时长未续租即视为已退出，图片由其他进程回收
+WORK_LEASE_SECONDS = float(os.environ.get("WORK_LEASE_SECONDS", 60))
+# 续租周期（秒）
+WORK_HEARTBEAT_INTERVAL = float(os.environ.get("WORK_HEARTBEAT_INTERVAL", WORK_LEASE_SECONDS / 3))
+# 单次认领的图片数（越小各进程间越均衡，越大数据库事务越少）
+WORK_CLAIM_BATCH = int(os.environ.get("WORK_CLAIM_BATCH", 8))
+# 队列为空时的轮询间隔（秒）；本进程提交的任务会立即唤醒
+WORK_POLL_INTERVAL = float(os.environ.get("WORK_POLL_INTERVAL", 0.2))
+# 已结束任务在共享队列中的保留时长（秒），之后只能从任务存储查询
+WORK_QUEUE_RETENTION = float(os.environ.get("WORK_QUEUE_RETENTION", 24 * 3600))
+WORK_QUEUE_PRUNE_INTERVAL = float(os.environ.get("WORK_QUEUE_PRUNE_INTERVAL", 600))
+
+# 共享队列中的任务状态 -> 对外的任务状态
+TASK_STATES = {"pending": "pending", "processing": "processing", "finishing": "processing",
+               "done": "done", "failed": "failed"}
+
+
+# ============================
+# SQLite 队列（同步接口，由调用方放到线程中执行）
+# ============================
+class SharedWorkQueue:
+    def __init__(self, path: Path = WORK_QUEUE_PATH, lease_seconds: float = WORK_LEASE_SECONDS,
+                 owner: Optional[str] = None):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        # 主机名 + 进程号 + 随机后缀，进程重启后不会误认前一个进程的租约
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        if self._conn is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS queue_tasks (
+                task_id TEXT PRIMARY KEY,
+                priority TEXT NOT NULL,
+                state TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                remaining INTEGER NOT NULL,
+                create_time REAL,
+                end_time REAL,
+                error TEXT,
+                owner TEXT,
+                lease_expires REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_queue_tasks_state ON queue_tasks(state, lease_expires);
+            CREATE TABLE IF NOT EXISTS work_items (
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                priority TEXT NOT NULL,
+                created REAL NOT NULL,
+                item TEXT NOT NULL,
+                state TEXT NOT NULL,
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                done_seq INTEGER,
+                PRIMARY KEY (task_id, idx)
+            );
+            CREATE INDEX IF NOT EXISTS idx_work_items_claim ON work_items(state, priority, idx, created);
+            CREATE INDEX IF NOT EXISTS idx_work_items_lease ON work_items(state, lease_expires);
+        """)
+        self._conn = conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 立即取得写锁，多进程的认领 / 完成互相串行"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # ---------- 提交 ----------
+    def submit(self, task_id: str, items: List[Dict], priority: str, create_time: float,
+               max_pending_items: int, completed: Optional[Dict[int, Dict]] = None) -> bool:
+        """登记任务及其全部图片（completed 中的图片直接记为已完成）；
+        任务已在队列中时返回 False（恢复任务时多个进程可能同时提交）
+        """
+        completed = completed or {}
+        remaining = len(items) - len(completed)
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM queue_tasks WHERE task_id = ?", (task_id,)).fetchone():
+                return False
+            if remaining:
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM work_items WHERE state IN ('queued', 'leased')").fetchone()[0]
+                if pending + remaining > max_pending_items:
+                    raise SchedulerFull(f"排队图片数已达上限 {max_pending_items}")
+            # 没有图片可认领（空任务 / 已全部完成），直接由提交进程收尾
+            finishing = not remaining
+            conn.execute(
+                "INSERT INTO queue_tasks (task_id, priority, state, total, remaining, create_time, owner, lease_expires) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (task_id, priority, "finishing" if finishing else "pending", len(items), remaining, create_time,
+                 self.owner if finishing else None, time.time() + self.lease_seconds if finishing else None))
+            done_seq = {index: seq for seq, index in enumerate(completed, 1)}
+            conn.executemany(
+                "INSERT INTO work_items (task_id, idx, priority, created, item, state, result, done_seq) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(task_id, i, priority, create_time, json.dumps(item, ensure_ascii=False),
+                  "done" if i in completed else "queued",
+                  json.dumps(completed[i], ensure_ascii=False) if i in completed else None, done_seq.get(i))
+                 for i, item in enumerate(items)])
+        return True
+
+    # ---------- 认领 ----------
+    def claim(self, limit: int, pick_priority: Callable[[List[str]], str],
+              known_tasks: set) -> Tuple[List[Tuple[str, int]], Dict[str, Tuple], int]:
+        """认领最多 limit 张图片
+
+        返回 (认领的 [(task_id, 下标)], 本进程尚未加载的任务 {task_id: (优先级, 创建时间, 图片列表)}, 回收的过期租约数)
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            # 持有进程已退出（租约过期）的图片放回队列
+            reclaimed = conn.execute(
+                "UPDATE work_items SET state = 'queued', owner = NULL, lease_expires = NULL, attempts = attempts + 1 "
+                "WHERE state = 'leased' AND lease_expires < ?", (now,)).rowcount
+            available = [p for p in PRIORITY_WEIGHTS if conn.execute(
+                "SELECT 1 FROM work_items WHERE state = 'queued' AND priority = ? LIMIT 1", (p,)).fetchone()]
+            if not available:
+                return [], {}, reclaimed
+            rows = conn.execute(
+                "SELECT task_id, idx FROM work_items WHERE state = 'queued' AND priority = ? "
+                "ORDER BY idx, created LIMIT ?", (pick_priority(available), limit)).fetchall()
+            conn.executemany(
+                "UPDATE work_items SET state = 'leased', owner = ?, lease_expires = ? WHERE task_id = ? AND idx = ?",
+                [(self.owner, now + self.lease_seconds, task_id, idx) for task_id, idx in rows])
+            task_ids = {task_id for task_id, _ in rows}
+            conn.executemany("UPDATE queue_tasks SET state = 'processing' WHERE task_id = ? AND state = 'pending'",
+                             [(task_id,) for task_id in task_ids])
+        with self._lock:
+            loaded = {}
+            for task_id in task_ids - known_tasks:
+                priority, create_time = self._conn.execute(
+                    "SELECT priority, create_time FROM queue_tasks WHERE task_id = ?", (task_id,)).fetchone()
+                items = [json.loads(r[0]) for r in self._conn.execute(
+                    "SELECT item FROM work_items WHERE task_id = ? ORDER BY idx", (task_id,))]
+                loaded[task_id] = (priority, create_time, items)
+        return rows, loaded, reclaimed
+
+    def complete(self, task_id: str, idx: int, result: Dict) -> Optional[Dict]:
+        """记录一张图片的结果；完成了任务的最后一张图片时取得收尾租约并返回完整任务（load_run）"""
+        with self._transaction() as conn:
+            done_seq = conn.execute(
+                "SELECT COALESCE(MAX(done_seq), 0) + 1 FROM work_items WHERE task_id = ?", (task_id,)).fetchone()[0]
+            updated = conn.execute(
+                "UPDATE work_items SET state = 'done', result = ?, done_seq = ?, owner = NULL, lease_expires = NULL "
+                "WHERE task_id = ? AND idx = ? AND state != 'done'",
+                (json.dumps(result, ensure_ascii=False), done_seq, task_id, idx)).rowcount
+            if not updated:
+                # 租约过期后已被其他进程处理完成
+                return None
+            conn.execute("UPDATE queue_tasks SET remaining = remaining - 1 WHERE task_id = ?", (task_id,))
+            remaining = conn.execute("SELECT remaining FROM queue_tasks WHERE task_id = ?", (task_id,)).fetchone()[0]
+            if remaining > 0:
+                return None
+            conn.execute("UPDATE queue_tasks SET state = 'finishing', owner = ?, lease_expires = ? WHERE task_id = ?",
+                         (self.owner, time.time() + self.lease_seconds, task_id))
+        return self.load_run(task_id)
+
+    def claim_finishing(self) -> List[Tuple[str, Dict]]:
+        """接手收尾进程已退出（收尾租约过期）的任务"""
+        with self._transaction() as conn:
+            now = time.time()
+            task_ids = [r[0] for r in conn.execute(
+                "SELECT task_id FROM queue_tasks WHERE state = 'finishing' AND lease_expires < ?", (now,))]
+            conn.executemany("UPDATE queue_tasks SET owner = ?, lease_expires = ? WHERE task_id = ?",
+                             [(self.owner, now + self.lease_seconds, task_id) for task_id in task_ids])
+        return [(task_id, self.load_run(task_id)) for task_id in task_ids]
+
+    def close_task(self, task_id: str, status: str, end_time: Optional[float], error: Optional[str]) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE queue_tasks SET state = ?, end_time = ?, error = ?, owner = NULL, lease_expires = NULL "
+                "WHERE task_id = ?", (status, end_time, error, task_id))
+
+    # ---------- 租约 ----------
+    def renew(self) -> int:
+        """续租本进程持有的全部图片和收尾任务"""
+        with self._transaction() as conn:
+            expires = time.time() + self.lease_seconds
+            renewed = conn.execute("UPDATE work_items SET lease_expires = ? WHERE state = 'leased' AND owner = ?",
+                                   (expires, self.owner)).rowcount
+            conn.execute("UPDATE queue_tasks SET lease_expires = ? WHERE state = 'finishing' AND owner = ?",
+                         (expires, self.owner))
+        return renewed
+
+    def release(self, task_id: Optional[str] = None, idx: Optional[int] = None) -> int:
+        """归还租约（不指定图片时归还本进程持有的全部图片和收尾任务），其他进程可立即认领"""
+        with self._transaction() as conn:
+            if task_id is not None:
+                return conn.execute(
+                    "UPDATE work_items SET state = 'queued', owner = NULL, lease_expires = NULL "
+                    "WHERE state = 'leased' AND owner = ? AND task_id = ? AND idx = ?",
+                    (self.owner, task_id, idx)).rowcount
+            released = conn.execute(
+                "UPDATE work_items SET state = 'queued', owner = NULL, lease_expires = NULL "
+                "WHERE state = 'leased' AND owner = ?", (self.owner,)).rowcount
+            conn.execute("UPDATE queue_tasks SET lease_expires = 0 WHERE state = 'finishing' AND owner = ?",
+                         (self.owner,))
+        return released
+
+    # ---------- 查询 ----------
+    def load_run(self, task_id: str) -> Dict:
+        """任务的全部图片及结果（按提交顺序）"""
+        with self._lock:
+            priority, create_time = self._conn.execute(
+                "SELECT priority, create_time FROM queue_tasks WHERE task_id = ?", (task_id,)).fetchone()
+            rows = self._conn.execute(
+                "SELECT item, result FROM work_items WHERE task_id = ? ORDER BY idx", (task_id,)).fetchall()
+        return {
+            "priority": priority,
+            "create_time": create_time,
+            "items": [json.loads(item) for item, _ in rows],
+            "results": [json.loads(result) if result else None for _, result in rows],
+        }
+
+    def task_state(self, task_id: str) -> Optional[Dict]:
+        """任务状态与已完成图片的结果（按完成顺序），不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, priority, total, remaining, create_time, end_time, error "
+                "FROM queue_tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            results = [json.loads(r[0]) for r in self._conn.execute(
+                "SELECT result FROM work_items WHERE task_id = ? AND state = 'done' ORDER BY done_seq", (task_id,))]
+        state, priority, total, remaining, create_time, end_time, error = row
+        status_info = {
+            "status": TASK_STATES.get(state, state),
+            "create_time": create_time,
+            "priority": priority,
+            "completed": total - remaining,
+            "total": total,
+            "response": results,
+        }
+        if end_time is not None:
+            status_info["end_time"] = end_time
+        if error:
+            status_info["error"] = error
+        return status_info
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM work_items WHERE state IN ('queued', 'leased') GROUP BY state").fetchall()
+        return dict(rows)
+
+    def prune(self, retention: float = WORK_QUEUE_RETENTION) -> int:
+        """删除结束超过保留时长的任务（任务存储中仍有完整结果）"""
+        with self._transaction() as conn:
+            cutoff = time.time() - retention
+            task_ids = [(r[0],) for r in conn.execute(
+                "SELECT task_id FROM queue_tasks WHERE state IN ('done', 'failed') AND end_time < ?", (cutoff,))]
+            conn.executemany("DELETE FROM work_items WHERE task_id = ?", task_ids)
+            conn.executemany("DELETE FROM queue_tasks WHERE task_id = ?", task_ids)
+        return len(task_ids)
+
+
+# ============================
+# 共享队列调度器（与 FairScheduler 接口一致）
+# ============================
+class SharedScheduler(FairScheduler):
+    """从共享队列认领图片交给本进程的流水线
+
+    - 优先级类别之间沿用平滑加权轮询（各进程独立计算）
+    - 认领的图片先放入本进程缓冲区，由流水线逐个取走；缓冲区中的图片同样持有租约
+    - pending_items 为全部进程排队中的图片数（定期刷新），pending_by_type 为本进程已认领未开始的图片
+    """
+
+    def __init__(self, queue: Optional[SharedWorkQueue] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.queue = queue or SharedWorkQueue()
+        self._buffer: deque = deque()
+        # task_id -> 本进程持有（已认领未完成）的图片数，归零后释放本地缓存的任务图片列表
+        self._held: Counter = Counter()
+        self._claim_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.leased_items = 0
+        self.reclaimed = 0
+
+    def start(self) -> None:
+        super().start()
+        self.queue.open()
+        self._claim_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self) -> None:
+        """归还本进程持有的全部租约，其他进程可立即接手"""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        released = await asyncio.to_thread(self.queue.release)
+        if released:
+            logger.info(f"已归还 {released} 张未完成图片的租约")
+        self._buffer.clear()
+        self._held.clear()
+        self.pending_by_type.clear()
+        await asyncio.to_thread(self.queue.close)
+
+    async def submit(self, task_id: str, items: List[Dict], priority: str = DEFAULT_PRIORITY,
+                     create_time: Optional[float] = None,
+                     completed: Optional[Dict[int, Dict]] = None) -> Optional[TaskRun]:
+        """提交任务到共享队列；任务已在队列中时返回 None"""
+        priority = self.normalize_priority(priority)
+        created = await asyncio.to_thread(self.queue.submit, task_id, items, priority,
+                                          create_time or time.time(), self.max_pending_items, completed)
+        if not created:
+            return None
+        self._wakeup.set()
+        run = TaskRun(task_id, items, priority, create_time)
+        for index, result in (completed or {}).items():
+            run.complete(index, result)
+        return run
+
+    async def get(self) -> Tuple[TaskRun, int]:
+        async with self._claim_lock:
+            while self.paused or not self._buffer:
+                self._wakeup.clear()
+                if not self.paused:
+                    await self._claim()
+                if self._buffer and not self.paused:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), WORK_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            run, index = self._buffer.popleft()
+        self._untrack_types(run.items[index])
+        self.dispatched += 1
+        return run, index
+
+    async def _claim(self) -> None:
+        # 本进程已不再持有图片的任务不保留图片列表，再次认领时重新加载
+        for task_id in [t for t in self.runs if not self._held[t]]:
+            del self.runs[task_id]
+            del self._held[task_id]
+        rows, loaded, reclaimed = await asyncio.to_thread(
+            self.queue.claim, WORK_CLAIM_BATCH, self._pick_priority, set(self.runs))
+        if reclaimed:
+            self.reclaimed += reclaimed
+            logger.warning(f"回收 {reclaimed} 张租约过期的图片（持有进程可能已退出）")
+        for task_id, (priority, create_time, items) in loaded.items():
+            run = TaskRun(task_id, items, priority, create_time)
+            # 认领的图片可能是其他进程中断后回收的，处理前查询其识别类型检查点
+            run.recovered = True
+            self.runs[task_id] = run
+        for task_id, idx in rows:
+            run = self.runs[task_id]
+            self._held[task_id] += 1
+            self.pending_by_type.update(self._item_types(run.items[idx]))
+            self._buffer.append((run, idx))
+
+    async def complete(self, run: TaskRun, index: int, result: Dict) -> Optional[TaskRun]:
+        """写入一张图片的结果；完成了任务的最后一张图片时返回带全部结果的任务，由调用方收尾"""
+        self._held[run.task_id] -= 1
+        try:
+            finished = await asyncio.to_thread(self.queue.complete, run.task_id, index, result)
+        except Exception:
+            # 结果未写入时归还租约，由其他进程重新处理，避免本进程一直续租
+            try:
+                await asyncio.to_thread(self.queue.release, run.task_id, index)
+            except Exception as e:
+                logger.error(f"归还任务 {run.task_id} 第 {index} 张图片的租约失败: {e}")
+            raise
+        return self._make_run(run.task_id, finished) if finished is not None else None
+
+    async def reclaim_finishing(self) -> List[TaskRun]:
+        """接手收尾进程已退出的任务"""
+        claimed = await asyncio.to_thread(self.queue.claim_finishing)
+        if claimed:
+            logger.warning(f"接手 {len(claimed)} 个收尾中断的任务: {[task_id for task_id, _ in claimed]}")
+        return [self._make_run(task_id, data) for task_id, data in claimed]
+
+    async def close(self, task_id: str, status_info: Dict) -> None:
+        """任务收尾完成，记录最终状态"""
+        await asyncio.to_thread(self.queue.close_task, task_id, status_info["status"],
+                                status_info.get("end_time"), status_info.get("error"))
+
+    async def task_state(self, task_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.queue.task_state, task_id)
+
+    @staticmethod
+    def _make_run(task_id: str, data: Dict) -> TaskRun:
+        run = TaskRun(task_id, data["items"], data["priority"], data["create_time"])
+        run.results = data["results"]
+        run.remaining = sum(1 for r in run.results if r is None)
+        run.started = True
+        return run
+
+    async def _heartbeat_loop(self) -> None:
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(WORK_HEARTBEAT_INTERVAL)
+            try:
+                await asyncio.to_thread(self.queue.renew)
+                counts = await asyncio.to_thread(self.queue.counts)
+                self.pending_items = counts.get("queued", 0)
+                self.leased_items = counts.get("leased", 0)
+                if time.monotonic() - last_prune >= WORK_QUEUE_PRUNE_INTERVAL:
+                    last_prune = time.monotonic()
+                    removed = await asyncio.to_thread(self.queue.prune)
+                    if removed:
+                        logger.info(f"共享队列清理已结束任务 {removed} 个")
+            except Exception as e:
+                logger.error(f"共享队列续租失败: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "sqlite",
+            "path": str(self.queue.path),
+            "owner": self.queue.owner,
+            "lease_seconds": self.queue.lease_seconds,
+            "pending_items": self.pending_items,
+            "leased_items": self.leased_items,
+            "max_pending_items": self.max_pending_items,
+            "buffered": len(self._buffer),
+            "held": sum(self._held.values()),
+            "active_tasks": len(self.runs),
+            "dispatched": self.dispatched,
+            "reclaimed": self.reclaimed,
+            "paused": self.paused,
+        }
+
+
+def create_scheduler(backend: str = TASK_QUEUE_BACKEND) -> FairScheduler:
+    if backend == "memory":
+        return FairScheduler()
+    if backend == "sqlite":
+        return SharedScheduler()
+    raise ValueError(f"未知的任务队列后端：{backend}")